@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the memory use of NCstructure
+
+Compares the slotted structure classes with interned names and
+scalar attributes to the original classes with an instance
+dictionary and a numpy array for every attribute value.
+The structures are typical model output, every variable with
+a few text and numeric attributes.
+
+Usage: python benchmarks/bench_memory.py [nvariables [nfiles]]
+"""
+
+from __future__ import print_function
+
+import sys
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+
+from netcdf_utilities.ncstructure import NCstructure
+
+
+class Dimension(object):
+    """The original dimension"""
+
+    def __init__(self, name, length, isUnlimited=False):
+        self._name = name
+        self.length = length
+        self.isUnlimited = isUnlimited
+
+
+class Attribute(object):
+    """The original attribute"""
+
+    def __init__(self, name, value):
+        self._name = name
+        if isinstance(value, str):
+            self.nctype = 'String'
+            self.value = value
+        else:
+            self.value = np.atleast_1d(value)
+            self.nctype = np.asarray(value).dtype.char
+
+
+class Variable(object):
+    """The original variable"""
+
+    def __init__(self, name, nctype, shape=()):
+        self._name = name
+        self.nctype = nctype
+        self.shape = tuple(shape)
+        self.attributes = OrderedDict()
+
+    def createAttribute(self, name, value):
+        self.attributes[name] = Attribute(name, value)
+
+
+class Original(object):
+    """The original structure"""
+
+    def __init__(self):
+        self.dimensions = OrderedDict()
+        self.variables = OrderedDict()
+
+    def createDimension(self, name, length, isUnlimited=False):
+        self.dimensions[name] = Dimension(name, length, isUnlimited)
+
+    def createVariable(self, name, nctype, shape):
+        var = self.variables[name] = Variable(name, nctype, shape)
+        return var
+
+
+def build(cls, nvar):
+    """A structure with nvar variables
+
+    Names are made fresh, as when read from a file.
+    """
+    nc = cls()
+    for name, length in [('time', 0), ('s_rho', 30), ('eta_rho', 500),
+                         ('xi_rho', 600)]:
+        nc.createDimension(''.join(name), length, length == 0)
+    for i in range(nvar):
+        var = nc.createVariable('var_{}'.format(i), ''.join('float'),
+                                [''.join(d) for d in nc.dimensions])
+        var.createAttribute(''.join('long_name'), 'variable {}'.format(i))
+        var.createAttribute(''.join('units'), ''.join('meter second-1'))
+        var.createAttribute(''.join('_FillValue'), np.float32(1.0e37))
+        var.createAttribute(''.join('scale_factor'), np.float32(0.01))
+        var.createAttribute(''.join('valid_range'),
+                            np.array([-10, 10], dtype='float32'))
+        var.createAttribute(''.join('field'), ''.join('velocity, scalar'))
+    return nc
+
+
+def memory(cls, nvar, nfiles):
+    """Memory in bytes of nfiles structures"""
+    tracemalloc.start()
+    structures = [build(cls, nvar) for i in range(nfiles)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del structures
+    return size
+
+
+def main():
+    args = [int(a) for a in sys.argv[1:]]
+    nvar = args[0] if args else 5000
+    nfiles = args[1] if len(args) > 1 else 4
+    MB = 2.0**20
+
+    print("{} structures with {} variables".format(nfiles, nvar))
+    original = memory(Original, nvar, nfiles)
+    compact = memory(NCstructure, nvar, nfiles)
+    print("{:<12s} {:8.1f} MB".format('original', original / MB))
+    print("{:<12s} {:8.1f} MB".format('compact', compact / MB))
+    print("saving       {:8.1f} %".format(100.0 * (1 - compact / original)))
+
+
+if __name__ == '__main__':
+    main()
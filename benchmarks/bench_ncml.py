@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the NcML reader on aggregation documents
+
+An aggregation with a growing number of <netcdf> members is
+read by NCstructure.from_NcML. The peak memory of the streaming
+reader should not grow with the number of members.
+
+Usage: python benchmarks/bench_ncml.py [nmembers ...]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+from netcdf_utilities.ncstructure import NCstructure
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<netcdf xmlns="http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2"
+        location="aggregation.nc">
+  <dimension name="time" length="0" isUnlimited="true" />
+  <dimension name="x" length="100" />
+  <attribute name="title" value="Aggregation benchmark" />
+  <variable name="temp" shape="time x" type="float">
+    <attribute name="valid_range" type="float" value="-5.0 40.0" />
+  </variable>
+  <aggregation type="joinExisting" dimName="time">
+"""
+
+MEMBER = """    <netcdf location="member_{0:06d}.nc" ncoords="24">
+      <attribute name="source" value="member {0}" />
+    </netcdf>
+"""
+
+FOOTER = """  </aggregation>
+</netcdf>
+"""
+
+
+def make_document(filename, nmembers):
+    with open(filename, 'w') as fid:
+        fid.write(HEADER)
+        for i in range(nmembers):
+            fid.write(MEMBER.format(i))
+        fid.write(FOOTER)
+
+
+def main(sizes):
+    fd, filename = tempfile.mkstemp(suffix='.ncml')
+    os.close(fd)
+    try:
+        print('{:>10s} {:>10s} {:>10s} {:>12s}'.format(
+            'members', 'MB', 'seconds', 'peak kB'))
+        for n in sizes:
+            make_document(filename, n)
+            size = os.path.getsize(filename) / 1e6
+            tracemalloc.start()
+            t0 = time.time()
+            NCstructure.from_NcML(filename)
+            elapsed = time.time() - t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('{:10d} {:10.1f} {:10.3f} {:12.0f}'.format(
+                n, size, elapsed, peak / 1e3))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    main(sizes)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the int16 quantization kernel
+
+Compares the in-place kernel with reused buffers to the
+straightforward numpy expression, on a 3D temperature-like field.
+
+Usage: python benchmarks/bench_quantize.py [nz ny nx]
+"""
+
+from __future__ import print_function
+
+import sys
+import timeit
+
+import numpy as np
+
+from netcdf_utilities.packing import UNDEF, quantize, quantize_chunk
+
+
+def quantize_naive(values, scale_factor, add_offset):
+    """The original conversion, with full size temporaries"""
+    values = (values - add_offset) / scale_factor
+    values[~(np.abs(values) <= abs(UNDEF))] = UNDEF
+    return np.round(values).astype('int16')
+
+
+def main():
+    shape = tuple(int(n) for n in sys.argv[1:]) or (40, 500, 600)
+    values = np.random.uniform(-2, 20, shape).astype('float32')
+    work = np.empty(shape, dtype='float32')
+    mask = np.empty(shape, dtype=bool)
+    out = np.empty(shape, dtype='int16')
+    MB = values.nbytes / 2.0**20
+
+    cases = [
+        ('naive expression',
+         lambda: quantize_naive(values, 0.001, 10.0)),
+        ('kernel, new buffers',
+         lambda: quantize(values, 0.001, 10.0)),
+        ('kernel, thread buffers',
+         lambda: quantize_chunk(values, 0.001, 10.0)),
+        ('kernel, all buffers given',
+         lambda: quantize(values, 0.001, 10.0, out, work, mask)),
+    ]
+
+    print('shape = {}, {:.1f} MB float32'.format(shape, MB))
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=1, repeat=5))
+        print('{:28s} {:8.1f} ms {:8.1f} MB/s'.format(
+            name, 1000 * seconds, MB / seconds))
+
+
+if __name__ == '__main__':
+    main()
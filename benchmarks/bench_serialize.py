@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the CDL and NcML serializers
+
+Compares the buffered serializers to the original writers with
+one write per item and per element formatting, on a large
+synthetic structure with text, scalar and vector attributes.
+
+Usage: python benchmarks/bench_serialize.py [nvariables]
+"""
+
+from __future__ import print_function
+
+import io
+import sys
+import timeit
+
+import numpy as np
+
+from netcdf_utilities.ncstructure import NCstructure
+
+
+def vector2cdl_original(vector):
+    """The original formatting, element by element"""
+    dtype = vector.dtype
+
+    def normalize(x):
+        if dtype == 'int16':
+            s = '{}s'.format(x)
+        elif dtype == 'int32':
+            s = str(x)
+        elif dtype == 'float32':
+            s = str(x).rstrip('0')
+            if '.' not in s:
+                s = s.replace('e', '.e')
+            s = '{}f'.format(s)
+        else:
+            s = str(x).rstrip('0')
+            if '.' not in s:
+                s = s.replace('e', '.e')
+        return s
+
+    return ', '.join(normalize(a) for a in vector)
+
+
+def write_CDL_original(nc, fid):
+    """The original writer, many small writes"""
+    fid.write('netcdf {} {{\n'.format(nc.location))
+    if nc.dimensions:
+        fid.write('dimensions:\n')
+    for name, dim in nc.dimensions.items():
+        if dim.isUnlimited:
+            fid.write('\t{} = UNLIMITED ; // ({} currently)\n'.
+                      format(name, dim.length))
+        else:
+            fid.write('\t{} = {} ;\n'.format(name, dim.length))
+    if nc.variables:
+        fid.write('variables:\n')
+    for varname, var in nc.variables.items():
+        fid.write('\t{} {}'.format(var.nctype, varname))
+        if var.shape:
+            fid.write('(')
+            for d in var.shape[:-1]:
+                fid.write('{}, '.format(d))
+            fid.write('{}) ;\n'.format(var.shape[-1]))
+        else:
+            fid.write(' ;\n')
+        for attname, att in var.attributes.items():
+            if isinstance(att.value, str):
+                fid.write('\t\t{}:{} = "{}" ;\n'.
+                          format(varname, attname, att.value))
+            else:
+                fid.write('\t\t{}:{} = {} ;\n'.format(
+                    varname, attname, vector2cdl_original(att.value)))
+    fid.write('}\n')
+
+
+def build(nvar):
+    """A structure with nvar variables"""
+    nc = NCstructure('bench')
+    nc.createDimension('time', 0, isUnlimited=True)
+    nc.createDimension('s_rho', 30)
+    nc.createDimension('eta_rho', 500)
+    nc.createDimension('xi_rho', 600)
+    table = np.linspace(0, 1, 50)
+    for i in range(nvar):
+        var = nc.createVariable('var_{}'.format(i), 'float',
+                                ('time', 's_rho', 'eta_rho', 'xi_rho'))
+        var.createAttribute('long_name', 'variable {}'.format(i))
+        var.createAttribute('units', 'meter second-1')
+        var.createAttribute('_FillValue', np.float32(1.0e37))
+        var.createAttribute('valid_range',
+                            np.array([-10, 10], dtype='float32'))
+        var.createAttribute('flag_values',
+                            np.arange(10, dtype='int16'))
+        var.createAttribute('coefficients', table)
+    return nc
+
+
+def main():
+    nvar = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    nc = build(nvar)
+    size = len(nc.to_CDL()) / 2.0**20
+
+    cases = [
+        ('CDL, original', lambda: write_CDL_original(nc, io.StringIO())),
+        ('CDL, buffered', lambda: nc.write_CDL(io.StringIO())),
+        ('NcML, buffered', lambda: nc.write_NcML(io.StringIO())),
+    ]
+
+    print("{} variables, {:.1f} MB of CDL".format(nvar, size))
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=1, repeat=3))
+        print("{:<16s} {:8.3f} s  {:8.1f} MB/s".format(
+            name, seconds, size / seconds))
+
+
+if __name__ == '__main__':
+    main()
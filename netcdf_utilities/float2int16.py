@@ -3,8 +3,11 @@
 
 # -------------------------------------------------------------------
 # Convert float/double variables in a netCDF file to 16-bit integers
-# Usage:
-# float2int16.py [-h] [-3] infile outfile
+# Usage (run as python -m netcdf_utilities.float2int16):
+# float2int16.py [-h] [-3] [-m MAX_MEMORY] [-a] [-c STATS_CACHE]
+#                [-t VAR:DIGITS] [-z COMPLEVEL] [--no-shuffle] [--compress-all]
+#                [--chunking {map,timeseries}] [-j WORKERS] [-p]
+#                infile outfile
 #
 # Convert float/double to 16-bit integers
 #
@@ -15,8 +18,37 @@
 # optional arguments:
 #   -h, --help  show this help message and exit
 #   -3          Create netCDF-3 format instead of default netCDF-4
+#   -m MAX_MEMORY, --max-memory MAX_MEMORY
+#               memory budget per chunk in MB, default 16
+#   -a, --auto  derive scale_factor and add_offset from the data
+#   -c STATS_CACHE, --stats-cache STATS_CACHE
+#               file for reusing value ranges between files
+#   -t VAR:DIGITS, --trim VAR:DIGITS
+#               keep variable as float, rounded to significant digits,
+#               may be repeated
+#   -z COMPLEVEL, --complevel COMPLEVEL
+#               zlib compression level, default 4
+#   --no-shuffle
+#               do not use the shuffle filter
+#   --compress-all
+#               compress also the variables not packed
+#   --chunking {map,timeseries}
+#               chunk layout for fast map or time series reads
+#   -j WORKERS, --workers WORKERS
+#               number of conversion workers, default 1
+#   -p, --processes
+#               use worker processes instead of threads
 # -------------------------------------------------------------------
 
+# The conversion is also available from python:
+#
+#   from netcdf_utilities.float2int16 import pack_file, Packer
+#   pack_file('ocean_his.nc', 'ocean_his_packed.nc')
+#
+#   with Packer(rescale_map, exclude, workers=4) as packer:
+#       for infile, outfile in jobs:
+#           packer.pack(infile, outfile)
+
 # ---------------------------------------------
 # Bjørn Ådlandsvik <bjorn@imr.no>
 # Institute of Marine Research, Bergen, Norway
@@ -27,8 +59,9 @@
 # --------
 
 import sys
+import warnings
 from argparse import ArgumentParser
-import collections
+import itertools
 
 try:
     import numpy as np
@@ -42,14 +75,27 @@ except ImportError:
     print("ERROR: netcdf4-python is not installed")
     sys.exit(1)
 
+from netcdf_utilities.packing import UNDEF, DEFAULT_CHUNK_BYTES
+from netcdf_utilities.packing import Rescale, AUTO, Trim, auto_rescale
+from netcdf_utilities.packing import variable_range, StatisticsCache
+from netcdf_utilities.packing import quantizer, bitrounder, variable_tasks
+from netcdf_utilities.packing import variable_fill_values
+from netcdf_utilities.packing import choose_chunksizes
+from netcdf_utilities.packing import DEFAULT_STORAGE_CHUNK_BYTES
+from netcdf_utilities.packing import make_executor, convert
+from netcdf_utilities.packing import RangeStatistics, ObservedSource
+from netcdf_utilities.packing import packed_limits
+
 # -------------------------
-# User settings: Configure the conversion
+# Default settings: Configure the conversion
 # -------------------------
 
 
 # Variables to convert into 16-bit integers
 # Format: variable = Rescale(scale_factor, add_offset)
-Rescale = collections.namedtuple('Rescale', ('scale_factor', 'add_offset'))
+#     or: variable = AUTO, derive scale_factor and add_offset from the data
+#     or: variable = Trim(digits=...) or Trim(rel_error=...),
+#         keep float, but round to the given precision
 scale_dictionary = dict(
     zeta = Rescale(0.01, 0.0),
     ubar = Rescale(0.001, 0.0),
@@ -65,145 +111,369 @@ scale_dictionary = dict(
 # List of variables to not copy
 dont_copy = ['omega']
 
-# --- End user settings ---
-
-# ----------
-# Constants
-# ----------
-
-UNDEF = -32767  # 1 - 2**15
+# --- End default settings ---
+
+# ---------------
+# The converter
+# ---------------
+
+
+class Packer(object):
+    """Convert float/double variables in netCDF files to 16-bit integers
+
+    rescale_map: dictionary, variable name -> Rescale, AUTO or Trim
+    exclude: names of variables that are not copied
+
+    Trim variables keep their float type, but the low mantissa bits
+    are rounded away, keeping the given number of significant digits
+    or relative error. This compresses well and suits fields with
+    a large dynamic range, where linear packing is poor.
+
+    For AUTO variables the packing is derived from the range of
+    the values, found by an extra pass through the variable.
+    With quantiles, f.ex. (0.001, 0.999), the range is given by
+    these quantiles, values outside are set to UNDEF.
+    With a stats_cache (a StatisticsCache or a file name), the
+    ranges are saved and reused for the next files in the series,
+    so the extra pass is only done once per variable. The cached
+    range is widened by the fraction headroom in both directions.
+    Values outside this range are counted during the conversion;
+    they are set to UNDEF with a RuntimeWarning, and the cached
+    range is extended to cover them for the next files.
+
+    For netCDF-4 output, the packed variables are compressed with
+    zlib at the given complevel, with or without the shuffle filter.
+    With compress_all, the other variables are compressed as well.
+    The chunk shapes are taken from the dictionary chunksizes,
+    variable name -> tuple, or chosen by the chunking layout,
+    'map' or 'timeseries' (see packing.choose_chunksizes).
+    By default the library chooses the chunk shapes.
+
+    The worker pool is kept between files, so a Packer can be
+    used for many conversions. Use close(), or a with statement,
+    to shut down the pool.
+    """
+
+    def __init__(self, rescale_map=None, exclude=None,
+                 format='NETCDF4_CLASSIC', workers=1, processes=False,
+                 max_bytes=DEFAULT_CHUNK_BYTES, quantiles=None,
+                 stats_cache=None, headroom=0.1, complevel=4, shuffle=True,
+                 compress_all=False, chunking=None, chunksizes=None,
+                 chunk_bytes=DEFAULT_STORAGE_CHUNK_BYTES):
+        if rescale_map is None:
+            rescale_map = scale_dictionary
+        if exclude is None:
+            exclude = dont_copy
+        self.rescale_map = dict(rescale_map)
+        self.exclude = set(exclude)
+        self.format = format
+        self.max_bytes = max_bytes
+        self.quantiles = quantiles
+        if stats_cache is not None and not isinstance(stats_cache,
+                                                      StatisticsCache):
+            stats_cache = StatisticsCache(stats_cache)
+        self.stats_cache = stats_cache
+        self.headroom = headroom
+        self.complevel = complevel
+        self.shuffle = shuffle
+        self.compress_all = compress_all
+        self.chunking = chunking
+        self.chunksizes = dict(chunksizes or {})
+        self.chunk_bytes = chunk_bytes
+        self.max_pending = 2 * max(1, workers or 1)
+        self._executor = make_executor(workers, processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Shut down the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def is_packed(self, var):
+        """Check if a netCDF variable should be converted to int16"""
+        return (var.name in self.rescale_map and var.dtype.kind == 'f' and
+                not isinstance(self.rescale_map[var.name], Trim))
+
+    def is_trimmed(self, var):
+        """Check if a netCDF variable should be precision trimmed"""
+        return (var.name in self.rescale_map and var.dtype.kind == 'f' and
+                isinstance(self.rescale_map[var.name], Trim))
+
+    def pack(self, infile, outfile):
+        """Convert a netCDF file"""
+        with Dataset(infile) as f0:
+            with Dataset(outfile, mode='w', format=self.format) as f1:
+                names = [v for v in f0.variables if v not in self.exclude]
+                checked = self.cached_names(names)
+                rescale = self.rescale_parameters(f0, names)
+                self.define(f0, f1, names, rescale)
+                stats = self.convert(f0, f1, names, rescale, checked)
+                self.check_ranges(infile, stats, rescale)
+
+    def cached_names(self, names):
+        """The AUTO variables packed by a range from the cache
+
+        The values of these variables are checked against the
+        packing range during the conversion. Ranges given by
+        quantiles leave values outside by design, and are
+        not checked.
+        """
+        cache = self.stats_cache
+        if cache is None or self.quantiles is not None:
+            return []
+        return [name for name in names
+                if self.rescale_map.get(name) == AUTO and name in cache]
+
+    def check_ranges(self, infile, stats, rescale):
+        """Warn about values lost by a cached range and widen it
+
+        stats is a dictionary, variable name -> RangeStatistics
+        from the conversion pass.
+        """
+        cache = self.stats_cache
+        widened = False
+        for name, st in stats.items():
+            if st.outside:
+                warnings.warn(
+                    "{}: {} values of {} outside the packing range "
+                    "[{:g}, {:g}] from the statistics cache are set to "
+                    "undefined".format(infile, st.outside, name,
+                                       *packed_limits(*rescale[name])),
+                    RuntimeWarning)
+            vrange = st.range()
+            if vrange is not None:
+                vmin, vmax = cache[name]
+                if vrange[0] < vmin or vrange[1] > vmax:
+                    cache[name] = (min(vmin, vrange[0]), max(vmax, vrange[1]))
+                    widened = True
+        if widened:
+            cache.save()
+
+    def rescale_parameters(self, f0, names):
+        """The packing parameters of the converted variables in f0"""
+        rescale = {}
+        cache = self.stats_cache
+        for name in names:
+            v0 = f0.variables[name]
+            if not self.is_packed(v0):
+                continue
+            if self.rescale_map[name] != AUTO:
+                rescale[name] = Rescale(*self.rescale_map[name])
+                continue
+
+            if cache is not None and name in cache:
+                vmin, vmax = cache[name]
+                margin = self.headroom * (vmax - vmin)
+                vmin, vmax = vmin - margin, vmax + margin
+            else:
+                vrange = variable_range(v0, self.max_bytes, self.quantiles)
+                if vrange is None:   # No valid values
+                    vrange = (0.0, 0.0)
+                vmin, vmax = vrange
+                if cache is not None:
+                    cache[name] = vrange
+            rescale[name] = auto_rescale(vmin, vmax)
+
+        if cache is not None:
+            cache.save()
+        return rescale
+
+    def storage_options(self, v0):
+        """Compression and chunking keywords for the output variable"""
+        if self.format.startswith('NETCDF3'):
+            return {}
+        packed = self.is_packed(v0)
+        options = {}
+        if packed or self.is_trimmed(v0) or self.compress_all:
+            options.update(zlib=True, complevel=self.complevel,
+                           shuffle=self.shuffle)
+        if v0.name in self.chunksizes:
+            options['chunksizes'] = self.chunksizes[v0.name]
+        elif self.chunking is not None and v0.ndim > 0:
+            itemsize = 2 if packed else v0.dtype.itemsize
+            options['chunksizes'] = choose_chunksizes(
+                v0.shape, itemsize, self.chunking,
+                is_record_variable(v0), self.chunk_bytes)
+        return options
+
+    def define(self, f0, f1, names, rescale):
+        """Copy the structure of f0 to f1, with packed variables"""
+
+        # Global attributes
+        for att in f0.ncattrs():
+            setattr(f1, att, getattr(f0, att))
+
+        # Dimensions
+        for name, dim in f0.dimensions.items():
+            if dim.isunlimited():
+                f1.createDimension(name, None)
+            else:
+                f1.createDimension(name, len(dim))
+
+        # Variables
+        for name in names:
+            v0 = f0.variables[name]
+            options = self.storage_options(v0)
+            if self.is_packed(v0):
+                v1 = f1.createVariable(name, 'i2', v0.dimensions,
+                                       fill_value=UNDEF, **options)
+            elif '_FillValue' in v0.ncattrs():
+                v1 = f1.createVariable(name, v0.dtype, v0.dimensions,
+                                       fill_value=v0._FillValue, **options)
+            else:
+                v1 = f1.createVariable(name, v0.dtype, v0.dimensions,
+                                       **options)
+
+            # Variable attributes
+            for att in v0.ncattrs():
+                if att != '_FillValue':
+                    setattr(v1, att, getattr(v0, att))
+            if self.is_packed(v0):
+                v1.scale_factor = rescale[name].scale_factor
+                v1.add_offset = rescale[name].add_offset
+            elif self.is_trimmed(v0):
+                keepbits = self.rescale_map[name].keepbits()
+                v1.bitround_keepbits = np.int32(keepbits)
+
+    def convert(self, f0, f1, names, rescale, checked=()):
+        """Convert the data of the variables from f0 to f1
+
+        The values of the variables in checked are compared
+        to the packing range while they are read. Returns a
+        dictionary, variable name -> RangeStatistics, for these.
+        """
+
+        # Non-record variables first, then record variables
+        record = [v for v in names if is_record_variable(f0.variables[v])]
+        names = [v for v in names if v not in record] + record
+
+        tasks = []
+        stats = {}
+        for name in names:
+            v0 = f0.variables[name]
+            v1 = f1.variables[name]
+            v0.set_auto_maskandscale(False)
+            v1.set_auto_maskandscale(False)
+            source = v0
+            if self.is_packed(v0):
+                transform = quantizer(*rescale[name])
+                if name in checked:
+                    stats[name] = RangeStatistics(
+                        variable_fill_values(v0),
+                        limits=packed_limits(*rescale[name]))
+                    source = ObservedSource(v0, stats[name])
+            elif self.is_trimmed(v0):
+                transform = bitrounder(self.rescale_map[name].keepbits(),
+                                       variable_fill_values(v0))
+            else:  # No conversion
+                transform = None
+            # Whole storage chunks, each compressed chunk written once
+            chunksizes = self.storage_options(v0).get('chunksizes')
+            tasks.append(variable_tasks(source, v1, transform,
+                                        self.max_bytes, chunksizes))
+
+        convert(itertools.chain.from_iterable(tasks), self._executor,
+                self.max_pending)
+        return stats
+
+
+def is_record_variable(var):
+    """Check if a netCDF variable depends on the unlimited dimension"""
+    dims = var.get_dims()
+    return bool(dims) and dims[0].isunlimited()
+
+
+def pack_file(infile, outfile, rescale_map=None, exclude=None, **options):
+    """Convert float/double variables in a netCDF file to 16-bit integers
+
+    The options are passed on to Packer.
+    """
+    with Packer(rescale_map, exclude, **options) as packer:
+        packer.pack(infile, outfile)
 
 # ------------------------
-# Command line arguments
+# Command line interface
 # ------------------------
 
-aparser = ArgumentParser(description="Convert float/double to 16-bit integers")
-
-aparser.add_argument('-3', dest='format', action='store_const',
-                     const='NETCDF3_CLASSIC', default='NETCDF4_CLASSIC',
-                     help='Create netCDF-3 format instead of default netCDF-4')
-
-# File names
-aparser.add_argument('infile', help='Name of input netCDF file')
-aparser.add_argument('outfile', help='Name of output file')
-
-args = aparser.parse_args()
-
-# -------------------
-# Inspect input file
-# -------------------
-
-f0 = Dataset(args.infile)
-
-# Find unlimited dimension, if any
-# Classic format has at most one
-unlim_dim = None
-numrec = 0      # Number of records
-for name in f0.dimensions:
-    dim = f0.dimensions[name]
-    if dim.isunlimited():
-        unlim_dim = name
-        numrec = len(dim)
-        break
-
-# Classify input variables
-all_vars = f0.variables.keys()
-for v in dont_copy:
-    try:
-        all_vars.remove(v)
-    except ValueError:
-        pass  # Don't bark if variable v is missing already
-
-record_vars = [v for v in all_vars if unlim_dim in f0.variables[v].dimensions]
-nonrec_vars = [v for v in all_vars if v not in record_vars]
-
-# -------------------------------
-# Create output file
-# -------------------------------
-
-f1 = Dataset(args.outfile, mode='w', format=args.format)
-
-# -----------------------
-# Copy global attributes
-# -----------------------
-
-for name in f0.ncattrs():
-    setattr(f1, name, getattr(f0, name))
-
-# ----------------
-# Copy dimensions
-# ----------------
-
-for name, dim in f0.dimensions.items():
-    if dim.isunlimited():
-        f1.createDimension(name, 0)
-    else:
-        f1.createDimension(name, len(dim))
-
-# ---------------------
-# Variable definitions
-# ---------------------
-for name in f0.variables:
-    v0 = f0.variables[name]
-    if name in scale_dictionary:
-        v1 = f1.createVariable(name, 'i2', v0.dimensions,
-                               fill_value=UNDEF, zlib=True)
-    else:
-        if '_fillValue' in v0.ncattrs():
-            f1.createVariable(name, v0.dtype, v0.dimensions,
-                              fill_value=v0._fillValue)
-        else:
-            f1.createVariable(name, v0.dtype, v0.dimensions)
-
-# Variable attributes
-for name in f0.variables:
-    v0 = f0.variables[name]
-    v1 = f1.variables[name]
-    for att in v0.ncattrs():
-        if att != "_fillValue":
-            setattr(v1, att, getattr(v0, att))
-    if name in scale_dictionary:
-        v1.scale_factor = scale_dictionary[name].scale_factor
-        v1.add_offset = scale_dictionary[name].add_offset
-
-# ----------------
-# Non-record data
-# ----------------
-
-for name in nonrec_vars:
-    v0 = f0.variables[name]
-    v1 = f1.variables[name]
-    v0.set_auto_maskandscale(False)
-    v1.set_auto_maskandscale(False)
-    if (name in scale_dictionary) and (v0.dtype != dtype('int16')):
-        # Convert from float/double to int 16
-        scale_factor = scale_dictionary[name].scale_factor
-        offset = scale_dictionary[name].add_offset
-        values = (v0[:] - offset) / scale
-        values[np.abs(values) > abs(UNDEF)] = scale*UNDEF + offset
-        v1[:] = np.round(values).astype('int16')
-    else:  # No conversion
-        v1[:] = v0[:]
-
-# Take record variables record per record
-for name in record_vars:
-    v0 = f0.variables[name]
-    v1 = f1.variables[name]
-    v0.set_auto_maskandscale(False)
-    v1.set_auto_maskandscale(False)
-    if (name in scale_dictionary) and (v0.dtype != np.dtype('int16')):
-        # Convert from float/double to int 16
-        for rec in xrange(numrec):
-            scale = scale_dictionary[name].scale_factor
-            offset = scale_dictionary[name].add_offset
-            values = (v0[rec, ...] - offset) / scale
-            values[np.abs(values) > abs(UNDEF)] = scale*UNDEF + offset
-            v1[rec, ...] = np.round(values).astype('int16')
-    else:  # No conversion
-        for rec in xrange(numrec):
-            v1[rec, ...] = v0[rec, ...]
-
-# ----------
-# Clean up
-# ----------
-f1.close()
+
+def add_packer_arguments(aparser):
+    """Command line options for the Packer"""
+
+    aparser.add_argument('-3', dest='format', action='store_const',
+                         const='NETCDF3_CLASSIC', default='NETCDF4_CLASSIC',
+                         help='Create netCDF-3 format instead of default netCDF-4')
+    aparser.add_argument('-m', '--max-memory', type=float, default=16,
+                         help='memory budget per chunk in MB, default 16')
+
+    # Automatic packing parameters
+    aparser.add_argument('-a', '--auto', action='store_true',
+                         help='derive scale_factor and add_offset from the data')
+    aparser.add_argument('-c', '--stats-cache',
+                         help='file for reusing value ranges between files')
+    aparser.add_argument('-t', '--trim', action='append', default=[],
+                         metavar='VAR:DIGITS',
+                         help='keep variable as float, rounded to '
+                              'significant digits, may be repeated')
+
+    # Compression and chunking
+    aparser.add_argument('-z', '--complevel', type=int, default=4,
+                         help='zlib compression level, default 4')
+    aparser.add_argument('--no-shuffle', dest='shuffle',
+                         action='store_false',
+                         help='do not use the shuffle filter')
+    aparser.add_argument('--compress-all', action='store_true',
+                         help='compress also the variables not packed')
+    aparser.add_argument('--chunking', choices=['map', 'timeseries'],
+                         help='chunk layout for fast map or time series reads')
+
+
+def packer_options(args):
+    """Packer keyword arguments from the command line options"""
+
+    rescale_map = scale_dictionary
+    if args.auto:
+        rescale_map = dict.fromkeys(scale_dictionary, AUTO)
+    if args.trim:
+        rescale_map = dict(rescale_map)
+        for item in args.trim:
+            name, digits = item.rsplit(':', 1)
+            rescale_map[name] = Trim(digits=int(digits))
+
+    return dict(rescale_map=rescale_map, format=args.format,
+                max_bytes=int(args.max_memory * 2**20),
+                stats_cache=args.stats_cache, complevel=args.complevel,
+                shuffle=args.shuffle, compress_all=args.compress_all,
+                chunking=args.chunking)
+
+
+def main(argv=None):
+
+    aparser = ArgumentParser(
+        description="Convert float/double to 16-bit integers")
+
+    add_packer_arguments(aparser)
+
+    # Parallel conversion
+    aparser.add_argument('-j', '--workers', type=int, default=1,
+                         help='number of conversion workers, default 1')
+    aparser.add_argument('-p', '--processes', action='store_true',
+                         help='use worker processes instead of threads')
+
+    # File names
+    aparser.add_argument('infile', help='Name of input netCDF file')
+    aparser.add_argument('outfile', help='Name of output file')
+
+    args = aparser.parse_args(argv)
+
+    pack_file(args.infile, args.outfile, workers=args.workers,
+              processes=args.processes, **packer_options(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Convert float/double variables in many netCDF files to 16-bit integers
+# Usage (run as python -m netcdf_utilities.float2int16_batch):
+# float2int16_batch.py [-h] [-3] [-m MAX_MEMORY] [-a] [-c STATS_CACHE]
+#                      [-t VAR:DIGITS] [-z COMPLEVEL] [--no-shuffle] [--compress-all]
+#                      [--chunking {map,timeseries}] [-j WORKERS]
+#                      [-o OUTDIR] [-s SUFFIX] [-M MANIFEST] [-f FILELIST]
+#                      [files [files ...]]
+#
+# Convert float/double to 16-bit integers in many files
+#
+# positional arguments:
+#   files       Names or glob patterns of input netCDF files
+#
+# optional arguments:
+#   -h, --help  show this help message and exit
+#   -3          Create netCDF-3 format instead of default netCDF-4
+#   -m, -a, -c, -t, -z, --no-shuffle, --compress-all, --chunking
+#               as for float2int16.py
+#   -j WORKERS, --workers WORKERS
+#               number of worker processes, default number of CPUs
+#   -o OUTDIR, --outdir OUTDIR
+#               directory for the output files
+#   -s SUFFIX, --suffix SUFFIX
+#               suffix for output file names, default _int16
+#   -M MANIFEST, --manifest MANIFEST
+#               manifest of completed files, default in output directory
+#   -f FILELIST, --filelist FILELIST
+#               file with names of input files, one per line
+# -------------------------------------------------------------------
+
+# The files are converted by a pool of processes, the largest files
+# first so the pool is kept busy to the end. Every completed output
+# file is recorded in the manifest with its size and checksum.
+# A rerun with the same manifest skips the files already done,
+# so an interrupted batch can simply be restarted.
+
+# --------
+# Imports
+# --------
+
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from netcdf_utilities.float2int16 import Packer
+from netcdf_utilities.float2int16 import add_packer_arguments, packer_options
+
+MANIFEST_NAME = 'float2int16_manifest.jsonl'
+
+# -----------
+# Manifest
+# -----------
+
+
+class Manifest(object):
+    """Record of completed conversions
+
+    A JSON-lines file with one entry per output file.
+    Entries are appended and flushed one at a time,
+    so the manifest survives an interrupted run.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename) as fid:
+                for line in fid:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:   # Truncated last line
+                        continue
+                    self.entries[entry['outfile']] = entry
+
+    def is_done(self, infile, outfile):
+        """Check if a conversion is already completed
+
+        The input file must be unchanged and the output
+        file must exist with the recorded size.
+        """
+        entry = self.entries.get(outfile)
+        if entry is None or entry['infile'] != infile:
+            return False
+        try:
+            return (os.path.getsize(infile) == entry['insize'] and
+                    os.path.getsize(outfile) == entry['outsize'])
+        except OSError:
+            return False
+
+    def record(self, entry):
+        """Add a completed conversion"""
+        self.entries[entry['outfile']] = entry
+        with open(self.filename, 'a') as fid:
+            fid.write(json.dumps(entry, sort_keys=True) + '\n')
+            fid.flush()
+            os.fsync(fid.fileno())
+
+
+def file_checksum(filename, blocksize=2**20):
+    """MD5 checksum of a file"""
+    md5 = hashlib.md5()
+    with open(filename, 'rb') as fid:
+        for block in iter(lambda: fid.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+# ---------------
+# Worker process
+# ---------------
+
+# One Packer in every worker process, reused for all its files
+_packer = None
+
+
+def _init_worker(options):
+    global _packer
+    _packer = Packer(**options)
+
+
+def _pack_one(infile, outfile):
+    """Convert a file in a worker, return the manifest entry"""
+    start = time.time()
+    _packer.pack(infile, outfile)
+    return dict(infile=infile, outfile=outfile,
+                insize=os.path.getsize(infile),
+                outsize=os.path.getsize(outfile),
+                md5=file_checksum(outfile),
+                seconds=round(time.time() - start, 3))
+
+# -----------
+# Scheduler
+# -----------
+
+
+def output_name(infile, outdir=None, suffix='_int16'):
+    """Name of the output file for an input file"""
+    root, ext = os.path.splitext(os.path.basename(infile))
+    if outdir is None:
+        outdir = os.path.dirname(infile)
+    else:
+        suffix = ''   # Keep the name in a separate directory
+    return os.path.join(outdir, root + suffix + ext)
+
+
+def pack_many(infiles, outdir=None, suffix='_int16', manifest=None,
+              workers=None, **options):
+    """Convert many files over a process pool
+
+    The options are passed on to the Packer in each worker.
+    Returns the manifest entries of the converted files
+    and a list of (infile, error) for the failures, including
+    files that can not be found and files whose output would
+    overwrite an input file or the output of another file.
+    Files completed in the manifest, and repeated names of
+    the same file, are skipped.
+    """
+
+    if outdir is not None and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    if manifest is None:
+        manifest = os.path.join(outdir or '.', MANIFEST_NAME)
+    if not isinstance(manifest, Manifest):
+        manifest = Manifest(manifest)
+
+    # Each file once, missing files are failures
+    candidates, sizes, seen = [], {}, set()
+    done, failed = [], []
+    for infile in infiles:
+        path = os.path.abspath(infile)
+        if path in seen:
+            continue
+        seen.add(path)
+        try:
+            sizes[infile] = os.path.getsize(infile)
+        except OSError as err:
+            failed.append((infile, err))
+            continue
+        candidates.append((infile, output_name(infile, outdir, suffix)))
+
+    # An output file must not be an input file, or the
+    # output of another input file
+    outputs = {}
+    for infile, outfile in candidates:
+        outputs.setdefault(os.path.abspath(outfile), []).append(infile)
+    jobs = []
+    for infile, outfile in candidates:
+        outpath = os.path.abspath(outfile)
+        if outpath in seen:
+            failed.append((infile, ValueError(
+                "Output file {} is an input file".format(outfile))))
+        elif len(outputs[outpath]) > 1:
+            failed.append((infile, ValueError(
+                "Output file {} is shared with {}".format(
+                    outfile, ', '.join(f for f in outputs[outpath]
+                                       if f != infile)))))
+        elif not manifest.is_done(infile, outfile):
+            jobs.append((infile, outfile))
+    # Largest files first
+    jobs.sort(key=lambda job: sizes[job[0]], reverse=True)
+
+    if not jobs:
+        return done, failed
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(options,)) as pool:
+        futures = dict((pool.submit(_pack_one, *job), job) for job in jobs)
+        for future in as_completed(futures):
+            infile, outfile = futures[future]
+            try:
+                entry = future.result()
+            except Exception as err:
+                failed.append((infile, err))
+                continue
+            manifest.record(entry)
+            done.append(entry)
+
+    return done, failed
+
+
+def summary(entries, seconds):
+    """One line summary of a batch conversion"""
+    insize = sum(e['insize'] for e in entries)
+    outsize = sum(e['outsize'] for e in entries)
+    MB = 2.0**20
+    return ("{} files, {:.1f} MB -> {:.1f} MB in {:.1f} s, "
+            "{:.1f} MB/s, compression ratio {:.2f}".format(
+                len(entries), insize / MB, outsize / MB, seconds,
+                insize / MB / max(seconds, 1e-9),
+                insize / float(max(outsize, 1))))
+
+# ------------------------
+# Command line interface
+# ------------------------
+
+
+def main(argv=None):
+
+    aparser = ArgumentParser(
+        description="Convert float/double to 16-bit integers in many files")
+
+    add_packer_arguments(aparser)
+
+    aparser.add_argument('-j', '--workers', type=int,
+                         help='number of worker processes, default number of CPUs')
+    aparser.add_argument('-o', '--outdir',
+                         help='directory for the output files')
+    aparser.add_argument('-s', '--suffix', default='_int16',
+                         help='suffix for output file names, default _int16')
+    aparser.add_argument('-M', '--manifest',
+                         help='manifest of completed files, '
+                              'default in output directory')
+    aparser.add_argument('-f', '--filelist',
+                         help='file with names of input files, one per line')
+    aparser.add_argument('files', nargs='*',
+                         help='Names or glob patterns of input netCDF files')
+
+    args = aparser.parse_args(argv)
+
+    # Input files
+    infiles = []
+    for pattern in args.files:
+        infiles.extend(sorted(glob.glob(pattern)) or [pattern])
+    if args.filelist:
+        with open(args.filelist) as fid:
+            infiles.extend(line.strip() for line in fid if line.strip())
+    if not infiles:
+        print("ERROR: No input files")
+        sys.exit(1)
+
+    start = time.time()
+    done, failed = pack_many(infiles, args.outdir, args.suffix,
+                             args.manifest, args.workers,
+                             **packer_options(args))
+    print(summary(done, time.time() - start))
+    skipped = (len(set(os.path.abspath(f) for f in infiles)) -
+               len(done) - len(failed))
+    if skipped:
+        print("{} files already done".format(skipped))
+    for infile, err in failed:
+        print("ERROR: {}: {}".format(infile, err))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
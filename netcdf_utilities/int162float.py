@@ -0,0 +1,244 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# -------------------------------------------------------------------
+# Convert packed 16-bit integer variables in a netCDF file to float
+# Usage (run as python -m netcdf_utilities.int162float):
+# int162float.py [-h] [-3] [-d] [-n] [-m MAX_MEMORY] [-j WORKERS] [-p]
+#                infile outfile
+#
+# Convert packed 16-bit integers to float
+#
+# positional arguments:
+#   infile      Name of input netCDF file
+#   outfile     Name of output file
+#
+# optional arguments:
+#   -h, --help  show this help message and exit
+#   -3          Create netCDF-3 format instead of default netCDF-4
+#   -d, --double
+#               unpack to double instead of float
+#   -n, --nan   use NaN as fill value
+#   -m MAX_MEMORY, --max-memory MAX_MEMORY
+#               memory budget per chunk in MB, default 16
+#   -j WORKERS, --workers WORKERS
+#               number of conversion workers, default 1
+#   -p, --processes
+#               use worker processes instead of threads
+# -------------------------------------------------------------------
+
+# This is the inverse of float2int16.py. All integer variables
+# with scale_factor or add_offset attributes are unpacked.
+# Undefined values (_FillValue or missing_value) become the
+# default netCDF fill value for the output type, or NaN.
+# The variables are decoded chunk by chunk, the chunks of all
+# variables sharing the same worker pool.
+
+# --------
+# Imports
+# --------
+
+import sys
+from argparse import ArgumentParser
+import itertools
+
+try:
+    import numpy as np
+except ImportError:
+    print("ERROR: numpy is not installed")
+    sys.exit(1)
+
+try:
+    from netCDF4 import Dataset, default_fillvals
+except ImportError:
+    print("ERROR: netcdf4-python is not installed")
+    sys.exit(1)
+
+from netcdf_utilities.packing import DEFAULT_CHUNK_BYTES
+from netcdf_utilities.packing import dequantizer, variable_tasks
+from netcdf_utilities.packing import variable_fill_values
+from netcdf_utilities.packing import make_executor, convert
+from netcdf_utilities.float2int16 import is_record_variable
+
+# Attributes replaced when unpacking
+PACKING_ATTRIBUTES = ['scale_factor', 'add_offset',
+                      '_FillValue', 'missing_value']
+
+# Attributes in packed units, unpacked with the data
+VALID_ATTRIBUTES = ['valid_min', 'valid_max', 'valid_range']
+
+# ---------------
+# The converter
+# ---------------
+
+
+class Unpacker(object):
+    """Convert packed integer variables in netCDF files to float
+
+    The output type is dtype, 'float32' or 'float64'.
+    With nan, undefined values are set to NaN, otherwise to
+    the default netCDF fill value for the type.
+
+    The worker pool is kept between files, use close(),
+    or a with statement, to shut it down.
+    """
+
+    def __init__(self, format='NETCDF4_CLASSIC', dtype='float32', nan=False,
+                 workers=1, processes=False, max_bytes=DEFAULT_CHUNK_BYTES):
+        self.format = format
+        self.dtype = np.dtype(dtype)
+        if nan:
+            self.fill = np.nan
+        else:
+            self.fill = default_fillvals[self.dtype.str[1:]]
+        self.max_bytes = max_bytes
+        self.max_pending = 2 * max(1, workers or 1)
+        self._executor = make_executor(workers, processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Shut down the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def unpack(self, infile, outfile):
+        """Convert a netCDF file"""
+        with Dataset(infile) as f0:
+            with Dataset(outfile, mode='w', format=self.format) as f1:
+                self.define(f0, f1)
+                self.convert(f0, f1)
+
+    def define(self, f0, f1):
+        """Copy the structure of f0 to f1, with unpacked variables"""
+
+        # Global attributes
+        for att in f0.ncattrs():
+            setattr(f1, att, getattr(f0, att))
+
+        # Dimensions
+        for name, dim in f0.dimensions.items():
+            if dim.isunlimited():
+                f1.createDimension(name, None)
+            else:
+                f1.createDimension(name, len(dim))
+
+        # Variables
+        for name, v0 in f0.variables.items():
+            attrs = v0.ncattrs()
+            if is_packed(v0):
+                v1 = f1.createVariable(name, self.dtype, v0.dimensions,
+                                       fill_value=self.fill)
+                scale_factor, add_offset = packing(v0)
+                for att in attrs:
+                    value = getattr(v0, att)
+                    if att in PACKING_ATTRIBUTES:
+                        continue
+                    if (att in VALID_ATTRIBUTES and
+                            np.asarray(value).dtype == v0.dtype):
+                        value = (scale_factor * np.asarray(value) +
+                                 add_offset).astype(self.dtype)
+                    setattr(v1, att, value)
+            else:
+                if '_FillValue' in attrs:
+                    v1 = f1.createVariable(name, v0.dtype, v0.dimensions,
+                                           fill_value=v0._FillValue)
+                else:
+                    v1 = f1.createVariable(name, v0.dtype, v0.dimensions)
+                for att in attrs:
+                    if att != '_FillValue':
+                        setattr(v1, att, getattr(v0, att))
+
+    def convert(self, f0, f1):
+        """Convert the data of the variables from f0 to f1"""
+
+        # Non-record variables first, then record variables
+        names = list(f0.variables)
+        record = [v for v in names if is_record_variable(f0.variables[v])]
+        names = [v for v in names if v not in record] + record
+
+        tasks = []
+        for name in names:
+            v0 = f0.variables[name]
+            v1 = f1.variables[name]
+            v0.set_auto_maskandscale(False)
+            v1.set_auto_maskandscale(False)
+            if is_packed(v0):
+                transform = dequantizer(*packing(v0),
+                                        fill_values=variable_fill_values(v0),
+                                        fill=self.fill, dtype=self.dtype)
+            else:
+                transform = None
+            tasks.append(variable_tasks(v0, v1, transform, self.max_bytes))
+
+        convert(itertools.chain.from_iterable(tasks), self._executor,
+                self.max_pending)
+
+
+def is_packed(var):
+    """Check if a netCDF variable is packed integers"""
+    attrs = var.ncattrs()
+    return (var.dtype.kind in 'iu' and
+            ('scale_factor' in attrs or 'add_offset' in attrs))
+
+
+def packing(var):
+    """The scale_factor and add_offset of a packed variable"""
+    return (float(getattr(var, 'scale_factor', 1.0)),
+            float(getattr(var, 'add_offset', 0.0)))
+
+
+def unpack_file(infile, outfile, **options):
+    """Convert packed integer variables in a netCDF file to float
+
+    The options are passed on to Unpacker.
+    """
+    with Unpacker(**options) as unpacker:
+        unpacker.unpack(infile, outfile)
+
+# ------------------------
+# Command line interface
+# ------------------------
+
+
+def main(argv=None):
+
+    aparser = ArgumentParser(
+        description="Convert packed 16-bit integers to float")
+
+    aparser.add_argument('-3', dest='format', action='store_const',
+                         const='NETCDF3_CLASSIC', default='NETCDF4_CLASSIC',
+                         help='Create netCDF-3 format instead of default netCDF-4')
+    aparser.add_argument('-d', '--double', dest='dtype', action='store_const',
+                         const='float64', default='float32',
+                         help='unpack to double instead of float')
+    aparser.add_argument('-n', '--nan', action='store_true',
+                         help='use NaN as fill value')
+    aparser.add_argument('-m', '--max-memory', type=float, default=16,
+                         help='memory budget per chunk in MB, default 16')
+
+    # Parallel conversion
+    aparser.add_argument('-j', '--workers', type=int, default=1,
+                         help='number of conversion workers, default 1')
+    aparser.add_argument('-p', '--processes', action='store_true',
+                         help='use worker processes instead of threads')
+
+    # File names
+    aparser.add_argument('infile', help='Name of input netCDF file')
+    aparser.add_argument('outfile', help='Name of output file')
+
+    args = aparser.parse_args(argv)
+
+    unpack_file(args.infile, args.outfile, format=args.format,
+                dtype=args.dtype, nan=args.nan, workers=args.workers,
+                processes=args.processes,
+                max_bytes=int(args.max_memory * 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,14 @@
 # -*- coding: utf-8 -*-
 
 # ---------------------------------------------------------------------
-# usage: ncdate.py [-h] [-r RECORD] [-t TIME_VARIABLE] file
+# usage: ncdate.py [-h] [-r RECORD] [-t TIME_VARIABLE] [-d DATE]
+#                  [--to DATE] [-s] [-j WORKERS]
+#                  file [file ...]
 #
 # Display the time in a netCDF file
 #
 # positional arguments:
-#   file                  Name of netCDF file
+#   file                  Name of netCDF file, or directory
 #
 # optional arguments:
 #   -h, --help            show this help message and exit
@@ -15,9 +17,14 @@
 #                       record number, defaults to 0 i.e. first record
 #  -t TIME_VARIABLE, --time-variable TIME_VARIABLE
 #                        name of time variable
+#  -d DATE, --date DATE  print the records at a date
+#  --to DATE             with --date, print the records between the dates
+#  -s, --summary         print the time span of the files
+#  -j WORKERS, --workers WORKERS
+#                        number of processes for the summary
 # ---------------------------------------------------------------------
 
-# If no time variable is specified, it will use 
+# If no time variable is specified, it will use
 # a unique time variable in the file (1D and with "since" in units)
 # None or multiple time variables in the file give error.
 #
@@ -25,9 +32,21 @@
 # The default --record=0 gives the first record
 # Negative numbers count from the end, in particular
 # --record=-1 gives the last record in the file
+#
+# Dates are given as 2015-06-12, "2015-06-12 12:00" or
+# 2015-06-12T12:00:00. With --date the records at the date,
+# or with --to between the two dates inclusive, are printed
+# with their dates. The dates are converted to time values
+# by one call of date2num, and the records found by binary
+# search in an increasing time axis.
+#
+# With several files, directories or --summary, a table of
+# the first and last date, the number of records and the mean
+# time step is printed for each file. Only the first and last
+# time values are read. Directories are searched for *.nc files.
 
 # The script requires the netcdf4-python package
-# It should work with both python 2.7 and 3.x
+# with cftime, and python 3
 
 # ----------------------------------
 # Bjørn Ådlandsvik <bjorn@imr.no>
@@ -39,43 +58,28 @@
 # Imports
 # -----------
 
+from __future__ import print_function
+
+import os
+import re
+import fnmatch
 import sys
+import multiprocessing
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 try:
-    from netCDF4 import Dataset, num2date
+    import cftime
+    from netCDF4 import Dataset, num2date, date2num
 except ImportError:
     print("ERROR: netcdf4-python is not installed")
     sys.exit(1)
 
-# ------------------------
-# Command line arguments
-# ------------------------
-
-aparser = ArgumentParser(description="Display the time in a netCDF file")
-
-# File name
-aparser.add_argument('file', help='Name of netCDF file')
-
-# Record option
-aparser.add_argument('-r', '--record', type=int, default=0,
-                     help='record number, defaults to 0 i.e. first record')
-
-# Time variable option
-aparser.add_argument('-t', '--time-variable',
-                     help="name of time variable")
-
-args = aparser.parse_args()
-
-# ----------------------
-# The NetCDF file
-# ----------------------
-
-try:
-    fid = Dataset(args.file)
-except RuntimeError:
-    print("Can not open netcdf file: {}".format(args.file))
-    sys.exit(1)
+# Dates as 2015-06-12, 2015-06-12 12:00 or 2015-06-12T12:00:00
+DATE_RE = re.compile(r'\s*(-?\d+)-(\d+)-(\d+)'
+                     r'(?:[ T](\d+)(?::(\d+)(?::(\d+))?)?)?\s*$')
 
 # --------------
 # Time variable
@@ -84,63 +88,287 @@ except RuntimeError:
 
 # Check function for time variables
 # Criterion: 1D and "since" in units
-def is_time_variable(name):
+def is_time_variable(var):
     """Check if a variables is a time variable"""
-    answer = False
-    var = fid.variables[name]
-    if var.ndim == 1:
-        if 'units' in var.ncattrs():
-            if 'since' in var.units:
-                answer = True
-    return answer
-
-if args.time_variable is None:
-    # No time variable specified
-    # check the file for time variables
-
-    timevars = []
-    for var_name in fid.variables:
-        if is_time_variable(var_name):
-            timevars.append(var_name)
-
-    if len(timevars) == 0:
-        print("ERROR: No time variable")
-        sys.exit(1)
-
-    if len(timevars) > 1:
-        print("ERROR: Multiple time variables")
-        print(timevars)
-        print("Use --time-variable option")
-        sys.exit(1)
-
-    timevar = timevars[0]
-
-else:  # Time variable specified with --time-variable option
-
-    # Check the time variable
-    timevar = args.time_variable
-    # Is it defined?
+    return var.ndim == 1 and 'since' in getattr(var, 'units', '')
+
+
+def find_time_variable(fid, name=None):
+    """The time variable of a netCDF file
+
+    Without a name, the file must have a unique time variable.
+    Raises ValueError if there is no such time variable.
+    """
+    if name is None:
+        timevars = [var_name for var_name, var in fid.variables.items()
+                    if is_time_variable(var)]
+        if len(timevars) == 0:
+            raise ValueError("No time variable")
+        if len(timevars) > 1:
+            raise ValueError("Multiple time variables {}\n"
+                             "Use --time-variable option".format(timevars))
+        name = timevars[0]
+
     try:
-        tvar = fid.variables[timevar]
+        tvar = fid.variables[name]
     except KeyError:
-        print("ERROR: Can not find variable {}".format(timevar))
-        sys.exit(1)
-    # Is it a time variable?
-    assert(is_time_variable(timevar),
-           'ERROR: Variable {} is not a time variable'.format(timevar))
+        raise ValueError("Can not find variable {}".format(name))
+    if not is_time_variable(tvar):
+        raise ValueError("Variable {} is not a time variable".format(name))
+    return tvar
+
+
+# Time variable name by schema, the names and units of
+# the 1D variables, for the files read by this process
+_time_variables = {}
+
+
+def schema_time_variable(fid):
+    """The unique time variable of a netCDF file
+
+    The name found is remembered for the schema of the file,
+    the names and units of the 1D variables, so the time
+    variables are searched once for a series of files.
+    """
+    schema = tuple((name, getattr(var, 'units', None))
+                   for name, var in fid.variables.items() if var.ndim == 1)
+    name = _time_variables.get(schema)
+    if name is not None:
+        return fid.variables[name]
+    tvar = find_time_variable(fid)
+    _time_variables[schema] = tvar.name
+    return tvar
+
+
+def time_calendar(tvar):
+    """The calendar of a time variable"""
+    return getattr(tvar, 'calendar', 'standard')
 
 # -------------------
-# Get the time value
+# Dates and records
 # -------------------
 
-try:
-    time_value = tvar[args.record]
-except IndexError:
-    print("ERROR: Must have -{ntimes} <= record < {ntimes}".
-          format(ntimes=len(tvar)))
-    sys.exit(1)
 
-# Use the netcdf4-python function num2date to parse the time
-date = num2date(time_value, tvar.units)
+def parse_date(text, calendar='standard'):
+    """Date in the calendar from a string"""
+    match = DATE_RE.match(text)
+    if match is None:
+        raise ValueError("Can not parse date {}".format(text))
+    fields = [int(field) for field in match.groups(0)]
+    return cftime.datetime(*fields, calendar=calendar)
+
+
+def date_values(dates, units, calendar='standard'):
+    """Time values of a sequence of date strings
+
+    The dates are converted by one call of date2num.
+    """
+    return np.atleast_1d(date2num([parse_date(date, calendar)
+                                   for date in dates], units, calendar))
+
+
+def find_records(times, start, stop=None):
+    """Records with start <= time <= stop
+
+    Without stop, the records with time equal to start.
+    An increasing time axis is searched by binary search,
+    other time axes by comparing all values.
+    """
+    if stop is None:
+        stop = start
+    times = np.asarray(times)
+    if np.all(times[1:] >= times[:-1]):
+        first = np.searchsorted(times, start, side='left')
+        last = np.searchsorted(times, stop, side='right')
+        return np.arange(first, last)
+    return np.nonzero((times >= start) & (times <= stop))[0]
+
+
+def date_records(tvar, start, stop=None):
+    """Record numbers of a date or date range in a time variable"""
+    dates = [start] if stop is None else [start, stop]
+    values = date_values(dates, tvar.units, time_calendar(tvar))
+    return find_records(np.ma.getdata(tvar[:]), *values)
+
+
+def record_date(tvar, record):
+    """The date of a record"""
+    return num2date(tvar[record], tvar.units, time_calendar(tvar))
+
+# --------------
+# Time summary
+# --------------
+
+
+def find_files(paths, pattern='*.nc'):
+    """File names from paths
+
+    Directories are searched recursively for files
+    matching the pattern.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(fnmatch.filter(filenames, pattern)):
+                    yield os.path.join(dirpath, name)
+        else:
+            yield path
+
+
+def time_span(filename, time_variable=None):
+    """First and last date, number of records and mean time step
+
+    Only the first and last time values are read. The
+    time step is a string in the time unit, None for
+    less than two records.
+    """
+    with Dataset(filename) as fid:
+        if time_variable is None:
+            tvar = schema_time_variable(fid)
+        else:
+            tvar = find_time_variable(fid, time_variable)
+        nrecords = len(tvar)
+        if nrecords == 0:
+            return None, None, 0, None
+        values = np.array([tvar[0], tvar[-1]], dtype='f8')
+        units, calendar = tvar.units, time_calendar(tvar)
+    start, end = num2date(values, units, calendar)
+    step = None
+    if nrecords > 1:
+        step = '{:g} {}'.format((values[1] - values[0]) / (nrecords - 1),
+                                units.split()[0])
+    return start, end, nrecords, step
+
+
+def _time_span(args):
+    """time_span in a worker, errors are returned"""
+    filename, time_variable = args
+    try:
+        return time_span(filename, time_variable), None
+    except Exception as err:
+        return None, '{}: {}'.format(type(err).__name__, err)
+
+
+def time_spans(filenames, time_variable=None, workers=None):
+    """Time span of many files, read concurrently
+
+    Returns a list of (filename, span, error) in the order of
+    the files, with span as returned by time_span, or None
+    and an error message.
+    """
+    filenames = list(filenames)
+    todo = [(filename, time_variable) for filename in filenames]
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1 or len(todo) < 2:
+        results = map(_time_span, todo)
+    else:
+        # Large chunks keep the messaging overhead low,
+        # and reuse the time variable of the schema
+        chunksize = max(1, len(todo) // (4 * workers))
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_time_span, todo, chunksize=chunksize))
+    return [(filename,) + tuple(result)
+            for filename, result in zip(filenames, results)]
+
+
+def print_spans(spans, fid=sys.stdout):
+    """Print the time spans as a table"""
+    width = max([len('file')] + [len(span[0]) for span in spans])
+    row = '{:<%d}  {:<19}  {:<19}  {:>8}  {}\n' % width
+    fid.write(row.format('file', 'start', 'end', 'records', 'step'))
+    for filename, span, error in spans:
+        if span is None:
+            fid.write('{:<{}}  ERROR: {}\n'.format(filename, width, error))
+            continue
+        start, end, nrecords, step = span
+        fid.write(row.format(filename, str(start or '-'), str(end or '-'),
+                             nrecords, step or '-'))
+
+# ------------------------
+# Command line interface
+# ------------------------
+
+
+def main(argv=None):
+
+    aparser = ArgumentParser(description="Display the time in a netCDF file")
+
+    # File names
+    aparser.add_argument('file', nargs='+',
+                         help='Name of netCDF file, or directory')
+
+    # Record option
+    aparser.add_argument('-r', '--record', type=int,
+                         help='record number, defaults to 0 i.e. first record')
+
+    # Time variable option
+    aparser.add_argument('-t', '--time-variable',
+                         help="name of time variable")
+
+    # Date option
+    aparser.add_argument('-d', '--date',
+                         help='print the records at a date')
+    aparser.add_argument('--to', metavar='DATE',
+                         help='with --date, print the records '
+                              'between the dates')
+
+    # Summary options
+    aparser.add_argument('-s', '--summary', action='store_true',
+                         help='print the time span of the files')
+    aparser.add_argument('-j', '--workers', type=int,
+                         help='number of processes for the summary, '
+                              'default number of CPUs')
+
+    args = aparser.parse_args(argv)
+    if args.to is not None and args.date is None:
+        aparser.error('--to requires --date')
+    dates = [date for date in (args.date, args.to) if date is not None]
+
+    filename = args.file[0]
+    if args.summary or len(args.file) > 1 or os.path.isdir(filename):
+        if args.date is not None or args.record is not None:
+            aparser.error('--date and --record are not used for a summary')
+        spans = time_spans(find_files(args.file), args.time_variable,
+                           args.workers)
+        print_spans(spans)
+        return 1 if any(span[1] is None for span in spans) else 0
+
+    try:
+        fid = Dataset(filename)
+    except (RuntimeError, IOError):
+        print("Can not open netcdf file: {}".format(filename))
+        return 1
+
+    with fid:
+        try:
+            tvar = find_time_variable(fid, args.time_variable)
+
+            if args.date is None:
+                try:
+                    print(record_date(tvar, args.record or 0))
+                except IndexError:
+                    print("ERROR: Must have -{ntimes} <= record < {ntimes}".
+                          format(ntimes=len(tvar)))
+                    return 1
+                return 0
+
+            units, calendar = tvar.units, time_calendar(tvar)
+            times = np.ma.getdata(tvar[:])
+            records = find_records(times,
+                                   *date_values(dates, units, calendar))
+        except ValueError as err:
+            print("ERROR: {}".format(err))
+            return 1
+
+    if len(records) == 0:
+        print("No records at {}".format(' - '.join(dates)))
+        return 1
+    for record, date in zip(records,
+                            num2date(times[records], units, calendar)):
+        print(record, date)
+    return 0
+
 
-print(date)
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,30 +10,114 @@
 
 from __future__ import unicode_literals
 
+import io
+import math
+from collections import OrderedDict
+
 from .ncstructure import NCstructure
 
 # Translate netCDF types to netcdf4-python types
-type_abbrev = dict(short='i2', int='i', float='f', double='d', char='c')
+type_abbrev = dict(byte='i1', ubyte='u1', short='i2', ushort='u2', int='i',
+                   long='i', uint='u4', int64='i8', uint64='u8', float='f',
+                   real='f', double='d', char='c')
+
+# Data section of the script, copying in blocks of about
+# BLOCK_BYTES along the first dimension
+DATA_SECTION = '''
+
+BLOCK_BYTES = {block_bytes}
+
+
+def fillCDF(ncid, source):
+    """Copy the data of the variables from source
+
+    source is a netCDF file or a directory with a .npy file
+    for each variable, read as a memory map. Variables
+    not in the source are left undefined.
+    """
+    if os.path.isdir(source):
+        src = None
+    else:
+        src = Dataset(source)
+    try:
+        for name, v in ncid.variables.items():
+            if src is None:
+                path = os.path.join(source, name + '.npy')
+                if not os.path.exists(path):
+                    continue
+                data = np.load(path, mmap_mode='r')
+            elif name in src.variables:
+                data = src.variables[name]
+                data.set_auto_maskandscale(False)
+            else:
+                continue
+            v.set_auto_maskandscale(False)
+            copy_blocks(data, v)
+    finally:
+        if src is not None:
+            src.close()
+
+
+def copy_blocks(data, v):
+    """Copy data to the variable v in blocks of records"""
+    if not data.shape:
+        v.assignValue(data[...])
+        return
+    itemsize = np.dtype(data.dtype).itemsize
+    row_bytes = itemsize * int(np.prod(data.shape[1:]))
+    step = max(1, BLOCK_BYTES // max(1, row_bytes))
+    nrecords = data.shape[0]
+    for start in range(0, nrecords, step):
+        stop = min(start + step, nrecords)
+        v[start:stop] = data[start:stop]
+'''
+
+# Main of a script with a data section
+DATA_MAIN = '''
+if __name__ == '__main__':
+    # Usage: python script.py [source [filename]]
+    ncid = defineCDF(*sys.argv[2:3])
+    if len(sys.argv) > 1:
+        fillCDF(ncid, sys.argv[1])
+    ncid.close()
+'''
 
 
-def ncgen(ncstruc, f):
-    """Generate a script defining the netcdf structure"""
+def ncgen(ncstruc, f, data=False, format=None, compression=None,
+          complevel=4, shuffle=True, chunking=None, block_bytes=2**26):
+    """Generate a script defining the netcdf structure
+
+    With data, the script has a fillCDF function copying the
+    data from a netCDF file or from .npy files in blocks.
+    The format is taken from the structure if not given,
+    default NETCDF3_CLASSIC. For the netCDF-4 formats the
+    variables keep the chunking and compression of the structure,
+    or may be compressed by compression = 'zlib' and chunked by
+    the layout chunking, as for NCstructure.to_file.
+    """
+
+    format = format or ncstruc.format or 'NETCDF3_CLASSIC'
+    netcdf4 = not format.startswith('NETCDF3')
 
     # --- Header stuff
 
     f.write('# -*- coding: utf-8 -*-\n')
     f.write('\nfrom __future__ import unicode_literals\n\n')
+    if data:
+        f.write('import os\n')
+        f.write('import sys\n\n')
     f.write('import numpy as np\n')
     f.write('from netCDF4 import Dataset\n')
     f.write('\n\n')
 
     # --- Function
 
-    f.write("def defineCDF():\n")
+    f.write("def defineCDF(filename={!r}):\n".format(
+        '{}.nc'.format(ncstruc.location)))
     f.write('    """Create/define a netCDF file with given structure"""\n')
     f.write("\n    # --- Create netCDF file\n")
-    f.write("    ncid = Dataset('{}.nc', mode='w', ".format(ncstruc.location))
-    f.write("format='NETCDF3_CLASSIC')\n")
+    f.write("    ncid = Dataset(filename, mode='w', ")
+    f.write("format='{}')\n".format(format))
 
     # --- Dimensions
 
@@ -45,7 +129,7 @@ def ncgen(ncstruc, f):
             length = 'None'
         else:
             length = len(dim)
-        f.write("    ncid.createDimension('{}', {})\n".format(name, length))
+        f.write("    ncid.createDimension({!r}, {})\n".format(name, length))
 
     # --- Variables
 
@@ -53,48 +137,165 @@ def ncgen(ncstruc, f):
         f.write("\n    # --- Variables\n")
     for name in ncstruc.variables:
         var = ncstruc.variables[name]
-        attributes = var.attributes
-        # _FillValue attribute must be handled separately
-        if '_FillValue' in attributes:
-            f.write("    v = ncid.createVariable('{}', '{}', {}".format(
-                name, type_abbrev[var.nctype], var.shape))
-            f.write(", fill_value={})\n".format(
-                attributes['_FillValue'].value[0]))
-            attributes.pop('_FillValue')
-        else:
-            f.write("    v = ncid.createVariable('{}', '{}', {}\n".format(
-                name, type_abbrev[var.nctype], var.shape))
+        # _FillValue attribute must be handled separately,
+        # leave the structure unchanged
+        attributes = [attname for attname in var.attributes
+                      if attname != '_FillValue']
+        options = ''
+        if '_FillValue' in var.attributes:
+            options += ', fill_value={}'.format(
+                literal(var.attributes['_FillValue'].value[0].item()))
+        if netcdf4 and var.shape:
+            storage = dict(var.storage or {})
+            if compression == 'zlib':
+                storage.update(zlib=True, complevel=complevel,
+                               shuffle=shuffle)
+            if chunking is not None:
+                storage.pop('contiguous', None)
+                storage['chunksizes'] = tuple(
+                    ncstruc.chunksizes(var, chunking))
+            for key in sorted(storage):
+                options += ', {}={!r}'.format(key, storage[key])
+        f.write("    v = ncid.createVariable({!r}, '{}', {!r}{})\n".format(
+            name, type_abbrev[var.nctype], var.shape, options))
         # Variable attributes
         for attname in attributes:
-            value = var.attributes[attname].value
-            # if isinstance(value, basestring):
-            if isinstance(value, str):
-                value = "'{}'".format(value)
-            else:
-                value = 'np.' + repr(value).replace('dtype=', 'dtype=np.')
-            f.write("    v.{} = {}\n".format(attname, value))
+            f.write("    v.setncattr({!r}, {})\n".format(
+                attname, value_source(var.attributes[attname].value)))
 
     # --- Global attributes
 
     if len(ncstruc.attributes) > 0:
         f.write("\n    # --- Global attributes\n")
     for name in ncstruc.attributes:
-        value = ncstruc.attributes[name].value
-        # if isinstance(value, basestring):
-        if isinstance(value, str):
-            value = "'{}'".format(value)
-        else:
-            value = 'np.' + repr(value).replace('dtype=', 'dtype=np.')
-        f.write("    ncid.{} = {}\n".format(name, value))
+        f.write("    ncid.setncattr({!r}, {})\n".format(
+            name, value_source(ncstruc.attributes[name].value)))
 
     f.write("\n    return ncid\n")
 
+    # --- Data
+    if data:
+        f.write(DATA_SECTION.format(block_bytes=block_bytes))
+        f.write('\n' + DATA_MAIN)
+        return
+
     # --- Main
     f.write("\nif __name__ == '__main__':\n")
     f.write("    ncid = defineCDF()\n")
     f.write("    ncid.close()\n")
 
 
+def literal(x):
+    """Python source of a number, NaN and infinity from numpy"""
+    if isinstance(x, float) and not math.isfinite(x):
+        if math.isnan(x):
+            return 'np.nan'
+        return 'np.inf' if x > 0 else '-np.inf'
+    return repr(x)
+
+
+def value_source(value):
+    """Python source of an attribute value
+
+    Text is quoted by repr, numbers are written as a
+    numpy array of the attribute type, so no text from
+    the structure is run as code.
+    """
+    if isinstance(value, str):
+        return repr(value)
+    return "np.array([{}], dtype='{}')".format(
+        ', '.join(literal(x) for x in value.tolist()), value.dtype.str)
+
+
+# --- Compiled definitions ---
+
+
+class DefinitionCache(object):
+    """Compiled defineCDF functions for structures
+
+    The function generated by ncgen is compiled in memory and
+    kept under the structure hash, with attribute values, the
+    format and the order of the dimensions, variables and
+    attributes. The least recently used
+    function is dropped when more than maxsize are cached.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._functions = OrderedDict()
+
+    def __len__(self):
+        return len(self._functions)
+
+    def clear(self):
+        """Empty the cache and reset the counters"""
+        self._functions.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, ncstruc):
+        # The hash does not depend on the order, which is
+        # added for dimensions, variables and attributes,
+        # nor on the storage of the variables
+        return (ncstruc.structure_hash(values=True), ncstruc.format,
+                tuple(ncstruc.dimensions),
+                tuple((name, tuple(var.attributes),
+                       tuple(sorted((var.storage or {}).items())))
+                      for name, var in ncstruc.variables.items()),
+                tuple(ncstruc.attributes))
+
+    def function(self, ncstruc):
+        """The defineCDF function of a structure"""
+        key = self.key(ncstruc)
+        func = self._functions.get(key)
+        if func is not None:
+            self.hits += 1
+            del self._functions[key]     # Most recently used last
+            self._functions[key] = func
+            return func
+
+        self.misses += 1
+        func = compile_definition(ncstruc, key[0])
+        self._functions[key] = func
+        while len(self._functions) > self.maxsize:
+            self._functions.popitem(last=False)
+        return func
+
+    def create(self, ncstruc, filename):
+        """Create a netCDF file with the structure
+
+        Returns the open netCDF4 Dataset.
+        """
+        return self.function(ncstruc)(filename)
+
+
+def compile_definition(ncstruc, name='defineCDF'):
+    """Compile the ncgen script of a structure
+
+    Returns the defineCDF function, taking the file name.
+    """
+    source = io.StringIO()
+    ncgen(ncstruc, source)
+    code = compile(source.getvalue(), '<ncgen {}>'.format(name), 'exec')
+    namespace = {'__name__': 'ncgen_definition'}
+    exec(code, namespace)
+    return namespace['defineCDF']
+
+
+# Cache shared by the calls of a process
+definitions = DefinitionCache()
+
+
+def create_file(ncstruc, filename, cache=definitions):
+    """Create a netCDF file from a structure by a cached definition
+
+    Returns the open netCDF4 Dataset.
+    """
+    return cache.create(ncstruc, filename)
+
+
 if __name__ == '__main__':
     import sys
 
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+"""
+ncheader:
+
+Read the header of a classic netCDF file without the netCDF library
+
+The classic, 64-bit offset and 64-bit data (CDF-5) formats
+start with a binary header. The header is read by one read
+of the start of the file, enlarged only if the header is longer.
+Other formats, as netCDF-4/HDF5, are left to the netCDF library.
+
+"""
+
+# --- Imports ---
+
+from __future__ import print_function
+
+import struct
+
+import numpy as np
+
+# --- Format constants ---
+
+MAGIC = b'CDF'
+
+# Tags of the header lists
+NC_DIMENSION = 10
+NC_VARIABLE = 11
+NC_ATTRIBUTE = 12
+
+# netCDF type codes to nctype and big-endian numpy type
+NC_TYPES = {1: ('byte', 'i1'), 2: ('char', 'S1'), 3: ('short', '>i2'),
+            4: ('int', '>i4'), 5: ('float', '>f4'), 6: ('double', '>f8'),
+            7: ('ubyte', 'u1'), 8: ('ushort', '>u2'), 9: ('uint', '>u4'),
+            10: ('int64', '>i8'), 11: ('uint64', '>u8')}
+
+# File format by version byte
+FORMATS = {1: 'NETCDF3_CLASSIC', 2: 'NETCDF3_64BIT_OFFSET',
+           5: 'NETCDF3_64BIT_DATA'}
+
+# Big-endian integers of the header
+INT32 = struct.Struct('>i')
+INT64 = struct.Struct('>q')
+
+# Size of the first read, most headers are smaller
+BLOCK_SIZE = 8192
+
+
+class ShortBuffer(Exception):
+    """The header continues after the buffer"""
+    pass
+
+# --- Header decoder ---
+
+
+class HeaderDecoder(object):
+    """Decode a classic netCDF header from a buffer"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.pos = 4
+        self.version = bytearray(buffer[3:4])[0]
+        if self.version not in (1, 2, 5):
+            raise ValueError("Unknown netCDF version {}".format(self.version))
+        # Sizes are 64 bit in CDF-5, offsets in all but classic
+        self.count_struct = INT64 if self.version == 5 else INT32
+        self.offset_struct = INT32 if self.version == 1 else INT64
+
+    def unpack(self, st):
+        """The next value for the struct st"""
+        try:
+            value = st.unpack_from(self.buffer, self.pos)[0]
+        except struct.error:
+            raise ShortBuffer()
+        self.pos += st.size
+        return value
+
+    def count(self):
+        return self.unpack(self.count_struct)
+
+    def padded(self, n):
+        """The next n bytes, skipping the padding to 4 bytes"""
+        start = self.pos
+        end = start + n
+        if end > len(self.buffer):
+            raise ShortBuffer()
+        self.pos = end + (-n % 4)
+        return self.buffer[start:end]
+
+    def name(self):
+        return self.padded(self.count()).decode('utf-8')
+
+    def values(self, nctype_code, n):
+        """Attribute values, text or a native numpy array"""
+        nctype, dtype = NC_TYPES[nctype_code]
+        dtype = np.dtype(dtype)
+        data = self.padded(n * dtype.itemsize)
+        if nctype == 'char':
+            # As netCDF4, text that is not UTF-8 is not an error
+            return data.decode('utf-8', 'replace').replace('\x00', '')
+        values = np.frombuffer(data, dtype=dtype)
+        return values.astype(dtype.newbyteorder('='))
+
+    def list_header(self, tag):
+        """Number of items in a list, zero for an absent list"""
+        found = self.unpack(INT32)
+        n = self.count()
+        if found not in (0, tag):
+            raise ValueError("Bad netCDF header at byte {}".format(self.pos))
+        return n
+
+    def attributes(self):
+        """List of (name, value)"""
+        atts = []
+        for i in range(self.list_header(NC_ATTRIBUTE)):
+            name = self.name()
+            nctype_code = self.unpack(INT32)
+            atts.append((name, self.values(nctype_code, self.count())))
+        return atts
+
+    def decode(self):
+        """Decode the header
+
+        Returns dimensions, variables and attributes
+        as for parse_CDL.
+        """
+        numrecs = self.count()
+
+        dimensions = []
+        for i in range(self.list_header(NC_DIMENSION)):
+            name = self.name()
+            length = self.count()
+            if length == 0:    # Unlimited
+                dimensions.append((name, numrecs, True))
+            else:
+                dimensions.append((name, length, False))
+
+        attributes = {None: [(None,) + att for att in self.attributes()]}
+
+        variables = []
+        for i in range(self.list_header(NC_VARIABLE)):
+            name = self.name()
+            dimids = [self.count() for j in range(self.count())]
+            shape = tuple(dimensions[d][0] for d in dimids)
+            attributes[name] = [(name,) + att for att in self.attributes()]
+            nctype = NC_TYPES[self.unpack(INT32)][0]
+            self.count()                      # vsize
+            self.unpack(self.offset_struct)   # begin
+            variables.append((name, nctype, shape))
+
+        return dimensions, variables, attributes
+
+
+def read_header(filename, block_size=BLOCK_SIZE):
+    """Read the format and header of a classic format netCDF file
+
+    Returns the format name, as for netCDF4.Dataset, and
+    location, dimensions, variables and attributes as for
+    parse_CDL, or None if the file is not in a classic format.
+    """
+    with open(filename, 'rb') as fid:
+        buffer = fid.read(block_size)
+        if buffer[:3] != MAGIC:
+            return None
+        while True:
+            try:
+                decoder = HeaderDecoder(buffer)
+                header = decoder.decode()
+                break
+            except ShortBuffer:
+                # Grow fast, decoding restarts from the beginning
+                more = fid.read(7 * len(buffer))
+                if not more:
+                    raise ValueError("Truncated netCDF header")
+                buffer += more
+
+    return FORMATS[decoder.version], (filename,) + header
+
+
+def classic_header(filename, block_size=BLOCK_SIZE):
+    """Read the header of a classic format netCDF file
+
+    Returns location, dimensions, variables and attributes
+    as for parse_CDL, or None if the file is not in a
+    classic format.
+    """
+    found = read_header(filename, block_size)
+    if found is None:
+        return None
+    return found[1]
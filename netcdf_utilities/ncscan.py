@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+ncscan:
+
+Extract the structure of many netCDF files
+
+The structures are extracted by a pool of processes and
+stored in a SQLite cache keyed by path, size and modification
+time, so a rescan only opens the files that have changed.
+
+"""
+
+# --- Imports ---
+
+from __future__ import print_function
+
+import os
+import pickle
+import sqlite3
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from netcdf_utilities.ncstructure import NCstructure
+from netcdf_utilities.ncdate import find_files
+
+# --- Cache ---
+
+
+class StructureCache(object):
+    """NetCDF structures stored in a SQLite database
+
+    An entry is valid as long as the size and modification
+    time of the file are unchanged.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._db = sqlite3.connect(filename)
+        self._db.execute('CREATE TABLE IF NOT EXISTS structures ('
+                         'path TEXT PRIMARY KEY, size INTEGER, '
+                         'mtime REAL, structure BLOB)')
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the database"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def lookup(self, stats):
+        """Cached structures of unchanged files
+
+        stats is a dictionary from path to (size, mtime).
+        Returns a dictionary from path to structure.
+        """
+        found = {}
+        rows = self._db.execute(
+            'SELECT path, size, mtime, structure FROM structures')
+        for path, size, mtime, blob in rows:
+            if stats.get(path) == (size, mtime):
+                found[path] = pickle.loads(blob)
+        return found
+
+    def store(self, entries):
+        """Store (path, size, mtime, structure) entries
+
+        All the entries are written in one transaction.
+        """
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO structures VALUES (?, ?, ?, ?)',
+                ((path, size, mtime,
+                  sqlite3.Binary(pickle.dumps(nc, pickle.HIGHEST_PROTOCOL)))
+                 for path, size, mtime, nc in entries))
+
+
+# --- Scanning ---
+
+
+def file_stat(path):
+    """(size, mtime) of a file"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
+
+
+def _extract(path):
+    """Extract a structure in a worker, errors are returned"""
+    try:
+        return path, NCstructure.from_file(path), None
+    except Exception as err:
+        return path, None, '{}: {}'.format(type(err).__name__, err)
+
+
+def scan(paths, workers=None, cache=None, pattern='*.nc'):
+    """Extract the structures of many netCDF files
+
+    paths are file names or directories, searched recursively
+    for files matching pattern. workers is the number of
+    processes, default number of CPUs. cache is a StructureCache
+    or the file name of one.
+
+    Returns an ordered dictionary from absolute path to
+    structure and a list of (path, error) for the failures.
+    """
+
+    stats = OrderedDict()
+    failed = []
+    for path in find_files(paths, pattern):
+        path = os.path.abspath(path)
+        try:
+            stats[path] = file_stat(path)
+        except OSError as err:
+            failed.append((path, str(err)))
+
+    own_cache = cache is not None and not isinstance(cache, StructureCache)
+    if own_cache:
+        cache = StructureCache(cache)
+
+    try:
+        structures = cache.lookup(stats) if cache is not None else {}
+        todo = [path for path in stats if path not in structures]
+
+        entries = []
+        if todo:
+            workers = workers or multiprocessing.cpu_count()
+            # Large chunks keep the messaging overhead low
+            chunksize = max(1, len(todo) // (4 * workers))
+            with ProcessPoolExecutor(workers) as pool:
+                for path, nc, error in pool.map(_extract, todo,
+                                                chunksize=chunksize):
+                    if error is None:
+                        structures[path] = nc
+                        entries.append((path,) + stats[path] + (nc,))
+                    else:
+                        failed.append((path, error))
+
+        if cache is not None and entries:
+            cache.store(entries)
+    finally:
+        if own_cache:
+            cache.close()
+
+    # In the order of the paths
+    structures = OrderedDict((path, structures[path]) for path in stats
+                             if path in structures)
+    return structures, failed
+
+
+def group_by_schema(structures, values=False):
+    """Group files with the same structure
+
+    structures is a dictionary from path to structure, as
+    returned by scan. Returns an ordered dictionary from
+    structure hash to the list of paths.
+    """
+    groups = OrderedDict()
+    for path, nc in structures.items():
+        groups.setdefault(nc.structure_hash(values), []).append(path)
+    return groups
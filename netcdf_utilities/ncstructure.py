@@ -13,16 +13,22 @@ from __future__ import unicode_literals, print_function
 
 import sys
 import os
+import re
+import json
+import hashlib
+import binascii
 from operator import attrgetter
-from collections import OrderedDict
-import itertools as it
+from collections import namedtuple
 import codecs
 from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
 
 import numpy as np
 from netCDF4 import Dataset
 
-from netcdf_utilities.parse_CDL import parse_CDL
+from netcdf_utilities.parse_CDL import parse_CDL, data_value
+from netcdf_utilities.ncheader import read_header
+from netcdf_utilities.packing import choose_chunksizes
 
 # --- Python2/3 ---
 
@@ -38,27 +44,137 @@ string_type = str  # python 3
 if PY2:
     string_type = basestring
 
+if PY2:
+    from collections import MutableMapping
+else:
+    from collections.abc import MutableMapping
+
+# Names are interned, shared by all structures
+if PY2:
+    def intern_name(name):
+        return name   # intern only takes byte strings
+else:
+    intern_name = sys.intern
+
 
 # --- Conversion dictionaries ---
 
 # Conversion from numpy dtype.char to NetCDF type
 # May change to l -> long (not supported in NetCDF 3)
-NCtype = dict(h='short', i='int', l='int', f='float', d='double', S='String')
+NCtype = dict(b='byte', B='ubyte', h='short', H='ushort', i='int', I='uint',
+              l='int', L='uint64', q='int64', Q='uint64', f='float',
+              d='double', S='String')
 
 # Conversion from nctype to numpy dtype
-Dtype = dict(short=np.int16, int=np.int32, float=np.float32, double=np.float64)
+Dtype = dict(byte=np.int8, ubyte=np.uint8, short=np.int16, ushort=np.uint16,
+             int=np.int32, long=np.int32, uint=np.uint32, int64=np.int64,
+             uint64=np.uint64, float=np.float32, real=np.float32,
+             double=np.float64, string=str)
+
+# NcML types with other CDL names
+NcML_TYPES = dict(long='int', ulong='uint64')
+
+# --- Ordered name map ---
+
+
+class NameMap(MutableMapping):
+    """Ordered mapping from name to named objects
+
+    The objects are dimensions, variables or attributes, stored
+    with their name as key. The order is kept as a list of the
+    objects, so renaming is a constant time operation.
+    items() and values() return lists.
+    """
+
+    __slots__ = ('_items', '_order')
+
+    def __init__(self):
+        self._items = {}
+        self._order = []
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+    def __setitem__(self, name, obj):
+        old = self._items.get(name)
+        self._items[name] = obj
+        if old is None:
+            self._order.append(obj)
+        else:    # Replace in place
+            self._order[self._order.index(old)] = obj
+
+    def __delitem__(self, name):
+        self._order.remove(self._items.pop(name))
+
+    def __contains__(self, name):
+        return name in self._items
+
+    def __iter__(self):
+        return (obj._name for obj in self._order)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return 'NameMap({})'.format(list(self))
+
+    def values(self):
+        return list(self._order)
+
+    def items(self):
+        return [(obj._name, obj) for obj in self._order]
+
+    def rename(self, oldname, newname):
+        """Rename an object, keeping its position"""
+        self.rename_many({oldname: newname}, strict=True)
+
+    def rename_many(self, mapping, strict=False):
+        """Rename the objects with names in mapping
+
+        The names are changed simultaneously, so names may
+        be swapped. Names not present are ignored, unless
+        strict. A rename to a name in use is a ValueError.
+        Returns the renamed names.
+        """
+        if len(mapping) <= len(self._items):
+            renamed = [name for name in mapping if name in self._items]
+        else:
+            renamed = [name for name in self._items if name in mapping]
+        if strict and len(renamed) < len(mapping):
+            missing = [name for name in mapping if name not in self._items]
+            raise KeyError(missing[0])
+        # Check before changing anything
+        newnames = set()
+        for name in renamed:
+            newname = mapping[name]
+            if (newname in newnames or
+                    (newname in self._items and newname not in mapping)):
+                raise ValueError("Name {} already in use".format(newname))
+            newnames.add(newname)
+        objs = [self._items.pop(name) for name in renamed]
+        for name, obj in zip(renamed, objs):
+            obj._name = intern_name(mapping[name])
+            self._items[obj._name] = obj
+        return renamed
+
 
 # --- Main class ---
 
 
 class NCstructure(object):
-    """NetCDF structure"""
+    """NetCDF structure
+
+    Dimensions, variables and attributes have slots and
+    interned names, to keep many structures in memory.
+    """
 
     class Dimension(object):
         """NetCDF dimension"""
 
+        __slots__ = ('_name', 'length', 'isUnlimited')
+
         def __init__(self, name, length, isUnlimited=False):
-            self._name = name
+            self._name = intern_name(name)
             self.length = length
             self.isUnlimited = isUnlimited
 
@@ -72,45 +188,110 @@ class NCstructure(object):
             return self.isUnlimited
 
     class Attribute(object):
-        """NetCDF attribute"""
+        """NetCDF attribute
+
+        A single numeric value is stored as a numpy scalar,
+        the value is always returned as a 1D array.
+        Short text values are interned.
+        """
+
+        __slots__ = ('_name', '_value')
 
         def __init__(self, name, value):
-            self._name = name
+            self._name = intern_name(name)
+            self.value = value
+
+        name = property(attrgetter('_name'))
+
+        @property
+        def value(self):
+            value = self._value
+            if isinstance(value, np.generic):
+                return np.atleast_1d(value)
+            return value
+
+        @value.setter
+        def value(self, value):
             if isinstance(value, string_type):
-                self.nctype = 'String'
-                self.value = value
+                if len(value) <= 64:
+                    value = intern_name(value)
             else:
-                self.value = np.atleast_1d(value)
-                self.nctype = NCtype[np.asarray(value).dtype.char]
+                value = np.atleast_1d(value)
+                if value.size == 1:
+                    value = value[0]
+            self._value = value
 
-        name = property(attrgetter('_name'))
+        @property
+        def nctype(self):
+            if isinstance(self._value, string_type):
+                return 'String'
+            return NCtype[self._value.dtype.char]
 
     class Variable(object):
-        """NetCDF variable"""
+        """NetCDF variable
+
+        The attributes may be loaded lazily, by a loader
+        called at first access. storage holds the chunking and
+        compression of a variable from a netCDF-4 file, as
+        keywords to createVariable.
+        """
+
+        __slots__ = ('_name', 'nctype', 'shape', '_attributes', '_loader',
+                     'data', 'storage')
 
         def __init__(self, name, nctype, shape=()):
-            self._name = name
-            self.nctype = nctype
-            self.shape = tuple(shape)
-            self.attributes = OrderedDict()
+            self._name = intern_name(name)
+            self.nctype = intern_name(nctype)
+            self.shape = tuple(intern_name(d) for d in shape)
+            self._attributes = NameMap()
+            self._loader = None
+            self.data = None
+            self.storage = None
 
         name = property(attrgetter('_name'))
 
+        @property
+        def attributes(self):
+            if self._loader is not None:
+                loader, self._loader = self._loader, None
+                loader(self)
+            return self._attributes
+
+        @property
+        def isLoaded(self):
+            """True if the attributes are loaded"""
+            return self._loader is None
+
         def createAttribute(self, name, value):
             """Set a NetCDF variable attribute"""
             self.attributes[name] = NCstructure.Attribute(name, value)
 
         def renameAttribute(self, oldname, newname):
-            att = self.attributes[oldname]
-            att._name = newname
-            replace_ordered_key(self.attributes, oldname, newname)
+            self.attributes.rename(oldname, newname)
+
+        def rename_attributes(self, mapping):
+            """Rename the attributes with names in mapping
+
+            Lazy attributes are renamed after loading.
+            """
+            if self._loader is not None:
+                self._loader.renames.append(mapping)
+            else:
+                self._attributes.rename_many(mapping)
+
+    # File format, as for netCDF4.Dataset, known for a structure
+    # read by from_file
+    format = None
 
     # NCstructure.__init__
     def __init__(self, location=None):
         self.location = location
-        self.dimensions = OrderedDict()
-        self.variables = OrderedDict()
-        self.attributes = OrderedDict()
+        self.dimensions = NameMap()
+        self.variables = NameMap()
+        self.attributes = NameMap()
+        # Reverse index, dimension name -> variables using it,
+        # a dictionary used as an ordered set
+        self._dim_users = {}
 
     def createDimension(self, name, length=None, isUnlimited=False):
         """Define a dimension in the structure"""
@@ -123,6 +304,7 @@ class NCstructure(object):
             len_ = length
         dim = self.Dimension(name, len_, unlim)
         self.dimensions[name] = dim
+        self._dim_users.setdefault(dim.name, {})
         return dim
 
     def createAttribute(self, name, value):
@@ -133,71 +315,202 @@ class NCstructure(object):
         """Define a netCDF variable in the structure"""
         # Sanity check
         for d in shape:
-            assert d in self.dimensions.keys()
+            assert d in self.dimensions
+        if name in self.variables:
+            self._forget_variable(self.variables[name])
         var = self.Variable(name, nctype, shape)
         self.variables[name] = var
+        for d in var.shape:
+            self._dim_users[d][var] = None
         return var
 
+    def deleteDimension(self, name):
+        """Remove a dimension, not allowed if it is in use"""
+        if self._dim_users[name]:
+            raise ValueError("Dimension {} is used by {}".format(
+                name, ', '.join(self.variables_using(name))))
+        del self.dimensions[name]
+        del self._dim_users[name]
+
+    def deleteVariable(self, name):
+        """Remove a variable"""
+        self._forget_variable(self.variables[name])
+        del self.variables[name]
+
+    def _forget_variable(self, var):
+        for d in var.shape:
+            self._dim_users[d].pop(var, None)
+
+    # --- Dimension queries ---
+
+    def variables_using(self, dimname):
+        """Names of the variables using a dimension"""
+        return [var.name for var in self._dim_users[dimname]]
+
+    def is_used(self, dimname):
+        """True if a variable uses the dimension"""
+        return bool(self._dim_users[dimname])
+
+    def unused_dimensions(self):
+        """Names of the dimensions not used by any variable"""
+        return [name for name in self.dimensions
+                if not self._dim_users[name]]
+
+    # --- Renaming ---
+
     def renameDimension(self, oldname, newname):
-        dim = self.dimensions[oldname]
-        dim._name = newname
-        # rename the key of the OrderedDict in place
-        replace_ordered_key(self.dimensions, oldname, newname)
-        # rename the variable shapes
-        for varname, var in self.variables.items():
-            if oldname in var.shape:
-                L = list(var.shape)
-                L[L.index(oldname)] = newname
-                var.shape = tuple(L)
+        self.rename_dimensions({oldname: newname}, strict=True)
 
     def renameVariable(self, oldname, newname):
-        var = self.variables[oldname]
-        var._name = newname
-        replace_ordered_key(self.variables, oldname, newname)
+        self.variables.rename(oldname, newname)
 
     def renameAttribute(self, oldname, newname):
-        att = self.attributes[oldname]
-        att._name = newname
-        replace_ordered_key(self.attributes, oldname, newname)
+        self.attributes.rename(oldname, newname)
+
+    def rename_dimensions(self, mapping, strict=False):
+        """Rename dimensions, and update the variable shapes
+
+        Only the variables using the dimensions are visited.
+        """
+        renamed = self.dimensions.rename_many(mapping, strict)
+        users = dict((name, self._dim_users.pop(name)) for name in renamed)
+        for name in renamed:
+            self._dim_users[intern_name(mapping[name])] = users[name]
+        renamed = set(renamed)
+        visited = set()
+        for name in renamed:
+            for var in users[name]:
+                if var not in visited:
+                    visited.add(var)
+                    var.shape = tuple(intern_name(mapping[d])
+                                      if d in renamed else d
+                                      for d in var.shape)
+
+    def rename_many(self, mapping):
+        """Rename dimensions, variables and attributes in one pass
+
+        mapping is a rename table from old to new names,
+        names not in the structure are ignored.
+        """
+        self.rename_dimensions(mapping)
+        self.variables.rename_many(mapping)
+        self.attributes.rename_many(mapping)
+        for var in self.variables.values():
+            var.rename_attributes(mapping)
+
+    # --- Comparison ---
+
+    def structure_hash(self, values=False):
+        """Canonical hash of the structure
+
+        Covers dimensions, variables with types and shapes, and
+        attribute names and types, attribute values only with
+        values. The hash does not depend on the order, or on
+        the current length of an unlimited dimension, so it
+        is the same for all files of a series.
+        """
+        items = sorted(schema_items(self, values).items())
+        text = json.dumps(items, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
 
     @classmethod
-    def from_file(cls, filename):
-        """Extract the structure from a netCDF file"""
+    def from_file(cls, filename, lazy=False):
+        """Extract the structure from a netCDF file
+
+        The header of a classic format file is decoded directly,
+        other formats are read by the netCDF library.
+        With lazy, the attributes of a variable are then read from
+        the file the first time they are accessed. Use load_all
+        to read the remaining attributes in one pass.
+        """
+
+        found = read_header(filename)
+        if found is not None:
+            nc = cls.from_items(*found[1])
+            nc.format = found[0]
+            return nc
 
         with Dataset(filename) as fid:
             nc = cls(location=filename)
+            nc.format = fid.data_model
 
             for name, dim in fid.dimensions.items():
                 nc.createDimension(name, len(dim), dim.isunlimited())
 
             for name, var in fid.variables.items():
-                nctype = NCtype[var.dtype.char]
+                if var.dtype == np.dtype('S1'):
+                    nctype = 'char'
+                else:
+                    nctype = NCtype[var.dtype.char]
                 v = nc.createVariable(name, nctype, shape=var.dimensions)
+                if not nc.format.startswith('NETCDF3'):
+                    v.storage = storage_options(var)
 
                 # Variable attributes
-                for att in var.ncattrs():
-                    v.createAttribute(att, getattr(var, att))
+                if lazy:
+                    v._loader = AttributeLoader(filename, name)
+                else:
+                    copy_attributes(var, v)
 
             # Global attributes
-            for att in fid.ncattrs():
-                nc.createAttribute(att, getattr(fid, att))
+            copy_attributes(fid, nc)
 
         return nc
 
+    def load_all(self):
+        """Load all lazy variable attributes
+
+        The file is opened only once.
+        """
+        pending = [var for var in self.variables.values()
+                   if var._loader is not None]
+        if not pending:
+            return
+        with Dataset(pending[0]._loader.filename) as fid:
+            for var in pending:
+                loader, var._loader = var._loader, None
+                loader.load(fid, var)
+
     @classmethod
-    def from_CDL(cls, filename):
-        """Extract the structure from a CDL file"""
+    def from_CDL(cls, filename, data=False):
+        """Extract the structure from a CDL file
 
-        location, dimensions, variables, attributes = parse_CDL(filename)
+        With data, the arrays in the data section are
+        read into the data of the variables.
+        """
 
-        nc = NCstructure(location)
+        if data:
+            location, dimensions, variables, attributes, values = \
+                parse_CDL(filename, data=True)
+        else:
+            location, dimensions, variables, attributes = parse_CDL(filename)
+            values = {}
+
+        nc = cls.from_items(location, dimensions, variables, attributes)
+
+        for name, data in values.items():
+            v = nc.variables[name]
+            v.data = data
+            # Current length of unlimited dimension
+            for dimname, length in zip(v.shape, data.shape):
+                dim = nc.dimensions[dimname]
+                if dim.isUnlimited:
+                    dim.length = max(dim.length, length)
+
+        return nc
+
+    @classmethod
+    def from_items(cls, location, dimensions, variables, attributes):
+        """Make the structure from the items returned by parse_CDL"""
+
+        nc = cls(location)
 
         for dim in dimensions:
             nc.createDimension(*dim)
 
         for var in variables:
             v = nc.createVariable(*var)
-            for att in attributes[var[0]]:
+            for att in attributes.get(var[0], []):
                 v.createAttribute(att[1], att[2])
 
         for att in attributes[None]:
@@ -207,164 +520,334 @@ class NCstructure(object):
 
     @classmethod
     def from_NcML(cls, filename):
-        """Extract the structure from a NcML file"""
+        """Extract the structure from a NcML file
 
-        # Parse the NcML file
-        with open(filename) as fid:
-            tree = ElementTree.parse(fid)
+        The file is parsed incrementally, elements are
+        cleared when read, so memory use does not grow
+        with the size of the document. Nested <netcdf>
+        elements of an aggregation are skipped.
+        """
 
-        root = tree.getroot()
+        nc = cls()
+        var = None      # The current variable
+        parents = []    # The open elements
 
-        # Create the structure
-        nc = NCstructure()
+        for event, node in ElementTree.iterparse(filename,
+                                                 events=('start', 'end')):
+            tag = node.tag.rsplit('}', 1)[-1]
+            depth = len(parents)
 
-        nc.location = root.attrib['location']
+            if event == 'start':
+                if depth == 0:
+                    nc.location = node.attrib.get('location')
+                elif depth == 1 and tag == 'variable':
+                    shape = tuple(node.attrib.get('shape', '').split())
+                    var = nc.createVariable(node.attrib['name'],
+                                            node.attrib['type'], shape)
+                parents.append(node)
+                continue
+
+            parents.pop()
+            if depth == 2 and tag == 'dimension':
+                isunlimited = 'isUnlimited' in node.attrib
+                nc.createDimension(node.attrib['name'],
+                                   int(node.attrib['length']), isunlimited)
+            elif tag == 'attribute' and (depth == 2 or
+                                         depth == 3 and var is not None):
+                name = node.attrib['name']
+                value = ncml_value(node.attrib.get('value', ''),
+                                   node.attrib.get('type', 'String'))
+                if depth == 2:
+                    nc.createAttribute(name, value)
+                else:
+                    var.createAttribute(name, value)
+            elif depth == 2 and tag == 'variable':
+                var = None
 
-        # Get iterators for the toplevel things,
-        #     dimensions, global attributes and variables
-        main_groups = it.groupby(root, key=lambda s: s.tag.split('}')[1])
+            # The finished children are not needed any more
+            if parents:
+                del parents[-1][:]
 
-        for key, group in main_groups:
+        return nc
 
-            # Dimensions
-            if key == 'dimension':
-                for node in group:
-                    name = node.attrib['name']
-                    length = node.attrib['length']
-                    isunlimited = 'isUnlimited' in node.attrib.keys()
-                    nc.createDimension(name, length, isunlimited)
+    def to_file(self, filename, format='NETCDF4_CLASSIC', compression=None,
+                complevel=4, shuffle=True, chunking=None):
+        """Write the structure to a netCDF file
 
-            # Global attributes
-            elif key == 'attribute':
-                for node in group:
-                    name = node.attrib['name']
-                    value = node.attrib['value']
-                    nctype = node.attrib.get('type', 'String')
-                    if nctype != 'String':
-                        value = np.array([Dtype[nctype](v)
-                                          for v in value.split()])
-                    nc.createAttribute(name, value)
+        The file is defined in one pass, dimensions, global
+        attributes and variables, before any data are written.
+        Variables with data have the data written.
 
-            # Variables
-            elif key == 'variable':
-                for node in group:
-                    shape = tuple(node.attrib['shape'].split())
-                    var = nc.createVariable(node.attrib['name'],
-                                            node.attrib['type'], shape)
-                    # Handle variable attributes, ignore values
-                    for child in node:
-                        if child.tag.split('}')[1] == 'attribute':
-                            name = child.attrib['name']
-                            value = child.attrib['value']
-                            nctype = child.attrib.get('type', 'String')
-                            if nctype != 'String':
-                                value = np.array([Dtype[nctype](v)
-                                                  for v in value.split()])
-                            var.createAttribute(name, value)
+        compression = 'zlib' compresses the variables with
+        the given complevel and shuffle filter. chunking is
+        None for the library default, or the layout 'map' or
+        'timeseries' of packing.choose_chunksizes.
+        Compression and chunking are ignored for the
+        NETCDF3 formats. The structure is not modified.
+        """
 
-        return nc
+        if compression not in (None, 'zlib'):
+            raise ValueError(
+                "Unknown compression: {}".format(compression))
+        netcdf4 = not format.startswith('NETCDF3')
 
-    def write_CDL(self, fid=sys.stdout):
-        """Write Common Data Language
+        with Dataset(filename, mode='w', format=format) as fid:
 
-        Produce identical output as ncdump -h
+            for name, dim in self.dimensions.items():
+                fid.createDimension(name,
+                                    None if dim.isUnlimited else dim.length)
+
+            for attname, att in self.attributes.items():
+                fid.setncattr(attname, att.value)
+
+            written = []
+            for name, var in self.variables.items():
+                if var.nctype == 'char':
+                    dtype = 'S1'
+                else:
+                    dtype = Dtype[var.nctype]
+                options = {}
+                if netcdf4 and var.shape:
+                    if compression == 'zlib':
+                        options.update(zlib=True, complevel=complevel,
+                                       shuffle=shuffle)
+                    if chunking is not None:
+                        options['chunksizes'] = self.chunksizes(
+                            var, chunking)
+                fill = var.attributes.get('_FillValue')
+                if fill is not None:
+                    options['fill_value'] = fill.value[0]
+                v = fid.createVariable(name, dtype, var.shape, **options)
+                for attname, att in var.attributes.items():
+                    if attname != '_FillValue':
+                        v.setncattr(attname, att.value)
+                if var.data is not None:
+                    written.append((v, var.data))
+
+            # Leave define mode once
+            for v, data in written:
+                # The data are stored values, no scaling
+                v.set_auto_maskandscale(False)
+                if v.shape:
+                    v[:] = data
+                else:
+                    v.assignValue(data)
+
+    def chunksizes(self, var, layout='map'):
+        """Chunk shape of a variable for a netCDF-4 file"""
+        shape = [self.dimensions[d].length for d in var.shape]
+        record = bool(var.shape) and self.dimensions[var.shape[0]].isUnlimited
+        if var.nctype in ('char', 'string'):
+            itemsize = 1
+        else:
+            itemsize = np.dtype(Dtype[var.nctype]).itemsize
+        return choose_chunksizes(shape, itemsize, layout, record)
+
+    def to_CDL(self):
+        """Common Data Language as a string
+
+        The same output as ncdump -h. The output is collected
+        in a list and joined once.
         """
         ncname = os.path.basename(self.location)
         ncname = os.path.splitext(ncname)[0]  # Remove ".nc"
-        fid.write('netcdf {} {{\n'.format(ncname))
+        out = ['netcdf {} {{\n'.format(ncname)]
+        append = out.append
 
         if self.dimensions:
-            fid.write('dimensions:\n')
+            append('dimensions:\n')
         for name, dim in self.dimensions.items():
             if dim.isUnlimited:
-                fid.write('\t{} = UNLIMITED ; // ({} currently)\n'.
-                          format(name, dim.length))
+                append('\t{} = UNLIMITED ; // ({} currently)\n'.
+                       format(name, dim.length))
             else:
-                fid.write('\t{} = {} ;\n'.format(name, dim.length))
+                append('\t{} = {} ;\n'.format(name, dim.length))
 
         if self.variables:
-            fid.write('variables:\n')
+            append('variables:\n')
         for varname, var in self.variables.items():
-            fid.write('\t{} {}'.format(var.nctype, varname))
             if var.shape:
-                fid.write('(')
-                for d in var.shape[:-1]:
-                    fid.write('{}, '.format(d))
-                fid.write('{}) ;\n'.format(var.shape[-1]))
+                append('\t{} {}({}) ;\n'.format(var.nctype, varname,
+                                                ', '.join(var.shape)))
             else:
-                fid.write(' ;\n')
-
+                append('\t{} {} ;\n'.format(var.nctype, varname))
             for attname, att in var.attributes.items():
-                if isinstance(att.value, string_type):
-                    fid.write('\t\t{}:{} = "{}" ;\n'.
-                              format(varname, attname, att.value))
-                else:
-                    fid.write('\t\t{}:{} = {} ;\n'.
-                              format(varname, attname, vector2cdl(att.value)))
+                append('\t\t{}:{} = {} ;\n'.
+                       format(varname, attname, att2cdl(att)))
 
         if self.attributes:
-            fid.write('\n// global attributes:\n')
+            append('\n// global attributes:\n')
             for attname, att in self.attributes.items():
-                if isinstance(att.value, string_type):
-                    fid.write('\t\t:{} = "{}" ;\n'.
-                              format(attname, att.value))
-                else:
-                    fid.write('\t\t:{} = {} ;\n'.
-                              format(attname, vector2cdl(att.value)))
+                append('\t\t:{} = {} ;\n'.format(attname, att2cdl(att)))
 
-        fid.write('}\n')
+        append('}\n')
+        return ''.join(out)
 
-    def write_NcML(self, fid=sys.stdout):
-        """Write the structure to a NcML file"""
+    def write_CDL(self, fid=sys.stdout):
+        """Write Common Data Language
 
-        fid.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        fid.write('<netcdf xmlns="http://www.unidata.ucar.edu/')
-        fid.write('namespaces/netcdf/ncml-2.2"')
+        Produce identical output as ncdump -h
+        """
+        fid.write(self.to_CDL())
+
+    def to_NcML(self):
+        """NcML as a string"""
+
+        out = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+               '<netcdf xmlns="http://www.unidata.ucar.edu/',
+               'namespaces/netcdf/ncml-2.2"']
+        append = out.append
         # Determine whether location should include .nc
         location = self.location
         if not location.endswith('.nc'):
             location += '.nc'
-        fid.write(' location="{}">\n'.format(location))
+        append(' location={}>\n'.format(quoteattr(location)))
 
         # Dimensions
         for name, dim in self.dimensions.items():
             if dim.isUnlimited:
-                fid.write('  <dimension name="{}" length="{}"'.
-                          format(name, dim.length))
-                fid.write(' isUnlimited="true" />\n')
+                append('  <dimension name="{}" length="{}"'
+                       ' isUnlimited="true" />\n'.format(name, dim.length))
             else:
-                fid.write('  <dimension name="{}" length="{}" />\n'.
-                          format(name, dim.length))
+                append('  <dimension name="{}" length="{}" />\n'.
+                       format(name, dim.length))
 
         # Global attributes
         for attname, att in self.attributes.items():
-            fid.write('  <attribute name="{}" value="{}" />\n'.
-                      format(attname, att.value))
+            append('  <attribute name="{}"{} />\n'.
+                   format(attname, att2ncml(att)))
 
         # Variables
         for varname, var in self.variables.items():
             if var.shape:
-                fid.write('  <variable name="{}" shape="{}" type="{}">\n'.
-                          format(varname, ' '.join(var.shape), var.nctype))
+                append('  <variable name="{}" shape="{}" type="{}">\n'.
+                       format(varname, ' '.join(var.shape), var.nctype))
             else:
-                fid.write('  <variable name="{}" type="{}">\n'.
-                          format(varname, var.nctype))
+                append('  <variable name="{}" type="{}">\n'.
+                       format(varname, var.nctype))
 
             # Variable attributes
             for attname, att in var.attributes.items():
-                attvalue = att.value
-                if isinstance(attvalue, string_type):
-                    fid.write('    <attribute name="{}" value="{}" />\n'.
-                              format(attname, attvalue))
-                else:
-                    fid.write('    <attribute name=')
-                    fid.write('"{}" type="{}" value="{}" />\n'.
-                              format(attname, att.nctype,
-                                     vector2ncml(att.value)))
+                append('    <attribute name="{}"{} />\n'.
+                       format(attname, att2ncml(att)))
+
+            append('  </variable>\n')
+
+        append('</netcdf>\n')
+        return ''.join(out)
+
+    def write_NcML(self, fid=sys.stdout):
+        """Write the structure to a NcML file"""
+        fid.write(self.to_NcML())
 
-            fid.write('  </variable>\n')
+# --- Comparison ---
+
+StructureDiff = namedtuple('StructureDiff', ['added', 'removed', 'changed'])
+
+
+def schema_items(nc, values=False):
+    """Canonical description of the items of a structure
+
+    Returns a dictionary from (kind, name) to a description,
+    with kind 'dimension', 'variable' or 'attribute' and
+    attribute names as 'var:name' or ':name' for global.
+    """
+    items = {}
+    for name, dim in nc.dimensions.items():
+        items[('dimension', name)] = \
+            'UNLIMITED' if dim.isUnlimited else str(dim.length)
+    for name, var in nc.variables.items():
+        items[('variable', name)] = \
+            '{}({})'.format(var.nctype, ','.join(var.shape))
+        for attname, att in var.attributes.items():
+            items[('attribute', name + ':' + attname)] = \
+                attribute_description(att, values)
+    for attname, att in nc.attributes.items():
+        items[('attribute', ':' + attname)] = \
+            attribute_description(att, values)
+    return items
+
+
+def attribute_description(att, values=False):
+    """The type, and with values the exact value, of an attribute"""
+    if not values:
+        return att.nctype
+    value = att.value
+    if isinstance(value, string_type):
+        return 'String ' + value
+    value = value.astype(value.dtype.newbyteorder('<'))
+    return '{} {}'.format(att.nctype,
+                          binascii.hexlify(value.tobytes()).decode('ascii'))
+
+
+def diff(a, b, values=True):
+    """Differences between two structures
+
+    Returns a StructureDiff of sorted lists of (kind, name)
+    items added in b, removed from a and changed. As for the
+    structure hash, the order and the current length of an
+    unlimited dimension are ignored.
+    """
+    items_a = schema_items(a, values)
+    items_b = schema_items(b, values)
+    added = sorted(key for key in items_b if key not in items_a)
+    removed = sorted(key for key in items_a if key not in items_b)
+    changed = sorted(key for key in items_a
+                     if key in items_b and items_a[key] != items_b[key])
+    return StructureDiff(added, removed, changed)
+
+
+# --- Lazy attributes ---
+
+
+class AttributeLoader(object):
+    """Read the attributes of a variable from a netCDF file"""
+
+    def __init__(self, filename, varname):
+        self.filename = filename
+        self.varname = varname
+        self.renames = []   # Renames to apply after loading
+
+    def __call__(self, var):
+        with Dataset(self.filename) as fid:
+            self.load(fid, var)
+
+    def load(self, fid, var):
+        """Read the attributes from an open netCDF file"""
+        copy_attributes(fid.variables[self.varname], var)
+        for mapping in self.renames:
+            var.attributes.rename_many(mapping)
+
+
+def copy_attributes(source, target):
+    """Copy the attributes of a netCDF4 object to the structure"""
+    for att in source.ncattrs():
+        target.createAttribute(att, getattr(source, att))
+
+
+def storage_options(var):
+    """Chunking and compression of a netCDF4 variable
+
+    As keywords to createVariable, None for a scalar.
+    """
+    if not var.dimensions:
+        return None
+    options = {}
+    chunking = var.chunking()
+    if chunking == 'contiguous':
+        options['contiguous'] = True
+    else:
+        options['chunksizes'] = tuple(chunking)
+    filters = var.filters() or {}
+    if filters.get('zlib'):
+        options.update(zlib=True, complevel=filters['complevel'],
+                       shuffle=bool(filters.get('shuffle')))
+    elif filters.get('shuffle'):
+        options['shuffle'] = True
+    if filters.get('fletcher32'):
+        options['fletcher32'] = True
+    return options
 
-        fid.write('</netcdf>\n')
 
 # --- utility functions ---
 
@@ -386,59 +869,91 @@ def isplit_noloss(predicate, iterator):
     yield accumulator  # Final part of the iterator
 
 
+# Type suffixes for CDL numbers, by numpy dtype.char
+CDL_SUFFIX = dict(b='b', B='ub', h='s', H='us', i='', I='u', l='', L='ull',
+                  q='ll', Q='ull', f='f', d='')
+
+# Mantissas without decimal point, 1e+20 -> 1.e+20
+MANTISSA_RE = re.compile(r'(?<![\w.+-])(-?\d+)(?=e)')
+
+
+def format_vector(vector, sep):
+    """Numbers of a 1D array joined by sep
+
+    Integers are converted by tolist, float32 by numpy for the
+    shortest representation. For floats, the decimal points
+    and special values are fixed on the joined string.
+    """
+    kind = vector.dtype.kind
+    if kind in 'iu':
+        return sep.join(map(str, vector.tolist()))
+    if vector.dtype == np.float32:
+        text = sep.join(map(str, vector))
+    else:
+        text = sep.join(map(repr, vector.tolist()))
+    # Integral values, 1.0 -> 1.
+    text = text.replace('.0' + sep, '.' + sep)
+    if text.endswith('.0'):
+        text = text[:-1]
+    if 'e' in text:
+        text = MANTISSA_RE.sub(r'\1.', text)
+    if 'n' in text:     # nan or inf
+        text = text.replace('nan', 'NaN').replace('inf', 'Infinity')
+    return text
+
+
 def vector2cdl(vector):
     """Make a CDL string representation of a numeric 1D array."""
-    dtype = vector.dtype
-
-    def normalize(x):
-        """Normalize a single value for CDL"""
-        if dtype == 'int16':
-            s = '{}s'.format(x)
-        elif dtype == 'int32':
-            s = str(x)
-        elif dtype == 'float32':
-            s = str(x).rstrip('0')
-            if '.' not in s:  # f.ex. s = 1e18
-                s = s.replace('e', '.e')
-            s = '{}f'.format(s)
-        elif dtype == 'float64':
-            s = str(x).rstrip('0')
-            if '.' not in s:
-                s = s.replace('e', '.e')
-        else:
-            print('Unknown type')
-        return s  # end normalize
-
-    return ', '.join(normalize(a) for a in vector)
+    text = format_vector(vector, ', ')
+    suffix = CDL_SUFFIX[vector.dtype.char]
+    if suffix:
+        text = text.replace(', ', suffix + ', ') + suffix
+    return text
 
 
 def vector2ncml(vector):
     """Make a NcML string representation of a numeric 1D array."""
-    dtype = vector.dtype
-
-    def normalize(x):
-        """Normalize a single value for NcML"""
-
-        if dtype in ['int16', 'int32']:
-            s = '{}'.format(x)
-        elif dtype in ['float32', 'float64']:
-            s = str(x).rstrip('0')  # 1.0 -> 1.
-            if '.' not in s:  # 1e18 -> 1.e18
-                s = s.replace('e', '.e')
-            s = '{}'.format(s)
-        else:
-            print('Unknown type')
-        return s  # end normalize
+    return format_vector(vector, ' ')
 
-    return ' '.join(normalize(a) for a in vector)
+
+def att2cdl(att):
+    """CDL value of an attribute"""
+    value = att.value
+    if isinstance(value, string_type):
+        return '"{}"'.format(value)
+    return vector2cdl(value)
+
+
+def att2ncml(att):
+    """NcML type and value of an attribute, as XML attributes"""
+    value = att.value
+    if isinstance(value, string_type):
+        return ' value={}'.format(quoteattr(value))
+    return ' type="{}" value="{}"'.format(att.nctype, vector2ncml(value))
+
+
+def ncml_value(text, nctype):
+    """Attribute value from a NcML value string
+
+    Numbers are separated by white space and converted
+    in one vectorized call.
+    """
+    if nctype in ('String', 'char'):
+        return text
+    return data_value(','.join(text.split()), NcML_TYPES.get(nctype, nctype))
 
 
 def replace_ordered_key(D, oldkey, newkey):
-    """Replace a key in-place in an OrderedDict"""
-    # Rotate the items, replacing the actual key
-    # From fbstj at stackoverflow
-    for i in range(len(D)):
-        key, value = D.popitem(False)
+    """Replace a key in-place in an ordered dictionary
+
+    A NameMap is renamed directly.
+    """
+    if isinstance(D, NameMap):
+        D.rename(oldkey, newkey)
+        return
+    items = list(D.items())
+    D.clear()
+    for key, value in items:
         if key == oldkey:
             key = newkey
         D[key] = value
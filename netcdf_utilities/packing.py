@@ -0,0 +1,625 @@
+# -*- coding: utf-8 -*-
+
+"""
+packing:
+
+Chunked, parallel engine for converting netCDF variables
+
+Each variable is tiled into chunks under a memory budget.
+The chunks are read and written by the calling thread, while the
+conversion of the values runs on a thread or process pool.
+At most a fixed number of chunks are in flight at any time,
+so the memory use does not depend on the size of the file.
+
+"""
+
+from __future__ import division
+
+import os
+import json
+import math
+import itertools
+import functools
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+from netCDF4 import default_fillvals
+
+# --- Constants ---
+
+UNDEF = -32767  # 1 - 2**15
+
+# Largest packed value in use, UNDEF and -UNDEF are kept free
+MAXPACKED = -UNDEF - 2
+
+# Default memory budget for a single chunk
+DEFAULT_CHUNK_BYTES = 16 * 2**20   # 16 MB
+
+# Default target size of the chunks in the output files
+DEFAULT_STORAGE_CHUNK_BYTES = 2**20   # 1 MB
+
+# Packing parameters of a variable
+Rescale = namedtuple('Rescale', ('scale_factor', 'add_offset'))
+
+# Marker for packing parameters derived from the data
+AUTO = 'auto'
+
+
+class Trim(namedtuple('Trim', ('digits', 'rel_error'))):
+    """Precision trimming of a float variable
+
+    Keep the float type, but only enough mantissa bits for the
+    given number of significant decimal digits, or for the
+    given relative error bound.
+    """
+    __slots__ = ()
+
+    def __new__(cls, digits=None, rel_error=None):
+        if (digits is None) == (rel_error is None):
+            raise ValueError("Trim needs one of digits or rel_error")
+        return super(Trim, cls).__new__(cls, digits, rel_error)
+
+    def keepbits(self):
+        """Number of explicit mantissa bits to keep"""
+        if self.digits is not None:
+            return int(math.ceil(self.digits * math.log(10, 2)))
+        # Rounding to nearest has relative error at most 2**-(keepbits+1)
+        return max(0, int(math.ceil(-math.log(self.rel_error, 2))) - 1)
+
+# --- Chunking ---
+
+
+def chunk_slices(shape, itemsize, max_bytes=DEFAULT_CHUNK_BYTES):
+    """Tile an array into chunks of at most max_bytes
+
+    Returns an iterator of index tuples.
+    The chunks are contiguous in C-order, the array is split
+    along the outermost dimension where a chunk fits the budget.
+    A single element larger than the budget is still one chunk.
+    """
+    shape = tuple(shape)
+    if not shape:   # Scalar variable
+        yield ()
+        return
+    if 0 in shape:  # No elements, for instance no records yet
+        return
+
+    # Move outwards as long as a full slab fits the budget
+    inner = max(1, itemsize)
+    axis = len(shape) - 1
+    while axis > 0 and inner * shape[axis] <= max_bytes:
+        inner *= shape[axis]
+        axis -= 1
+
+    step = max(1, max_bytes // inner)
+    length = shape[axis]
+    for index in itertools.product(*[range(n) for n in shape[:axis]]):
+        for start in range(0, length, step):
+            yield index + (slice(start, min(start + step, length)),)
+
+
+def chunk_grid_slices(shape, chunksizes, itemsize,
+                      max_bytes=DEFAULT_CHUNK_BYTES):
+    """Tile an array on a storage chunk grid
+
+    Returns an iterator of index tuples. Every tile is a block of
+    whole storage chunks, so each chunk is written once. The tiles
+    start as one chunk and are grown along the inner dimensions,
+    by whole chunks, as long as they fit max_bytes.
+    A single chunk larger than the budget is still one tile.
+    """
+    shape = tuple(shape)
+    if not shape:   # Scalar variable
+        yield ()
+        return
+    if 0 in shape:  # No elements
+        return
+
+    block = [min(c, n) for c, n in zip(chunksizes, shape)]
+    size = max(1, itemsize) * int(np.prod(block))
+    for axis in range(len(shape) - 1, -1, -1):
+        count = max(1, max_bytes // size)
+        length = min(shape[axis], block[axis] * count)
+        size = size // block[axis] * length
+        block[axis] = length
+        if length < shape[axis]:
+            break
+
+    for start in itertools.product(*[range(0, n, b)
+                                     for n, b in zip(shape, block)]):
+        yield tuple(slice(i, min(i + b, n))
+                    for i, b, n in zip(start, block, shape))
+
+
+def choose_chunksizes(shape, itemsize, layout='map', record=True,
+                      target_bytes=DEFAULT_STORAGE_CHUNK_BYTES):
+    """Chunk shape for storing a variable in a netCDF-4 file
+
+    layout = 'map': a record variable is chunked one record at a time,
+        fast reading of horizontal fields.
+    layout = 'timeseries': a record variable is chunked with all
+        records and a small spatial tile, fast reading of time series.
+    Variables without records, or with a single dimension, are
+    chunked as whole as possible. The chunks are within target_bytes.
+    """
+    shape = [max(1, n) for n in shape]
+    if not shape:
+        return None
+    target = max(1, target_bytes // max(1, itemsize))  # In elements
+
+    if not record or len(shape) == 1:
+        chunks = list(shape)
+        _shrink(chunks, range(len(chunks)), target)
+    elif layout == 'map':
+        chunks = [1] + shape[1:]
+        _shrink(chunks, range(1, len(chunks)), target)
+    elif layout == 'timeseries':
+        chunks = [min(shape[0], target)] + [1] * (len(shape) - 1)
+        _grow(chunks, shape, range(len(shape) - 1, 0, -1), target)
+    else:
+        raise ValueError("Unknown chunk layout: {}".format(layout))
+    return tuple(chunks)
+
+
+def _shrink(chunks, axes, target):
+    """Halve the largest chunk lengths until the chunk fits"""
+    axes = list(axes)
+    while np.prod(chunks) > target:
+        i = max(axes, key=lambda k: chunks[k])
+        if chunks[i] == 1:
+            break
+        chunks[i] = (chunks[i] + 1) // 2
+
+
+def _grow(chunks, shape, axes, target):
+    """Double the chunk lengths in turn while the chunk fits"""
+    axes = list(axes)
+    while axes:
+        for i in list(axes):
+            if 2 * np.prod(chunks) > target or chunks[i] >= shape[i]:
+                axes.remove(i)
+            else:
+                chunks[i] = min(2 * chunks[i], shape[i])
+
+
+def variable_tasks(source, target, transform=None,
+                   max_bytes=DEFAULT_CHUNK_BYTES, chunksizes=None):
+    """Conversion tasks for copying a variable chunk by chunk
+
+    transform is applied to the values of every chunk,
+    it must be picklable for use with a process pool.
+    None means a plain copy.
+    With the chunksizes of the target storage, the tasks
+    follow the chunk grid, see chunk_grid_slices.
+    """
+    itemsize = np.dtype(source.dtype).itemsize
+    if chunksizes is None:
+        slices = chunk_slices(source.shape, itemsize, max_bytes)
+    else:
+        slices = chunk_grid_slices(source.shape, chunksizes, itemsize,
+                                   max_bytes)
+    for index in slices:
+        yield source, target, index, transform
+
+# --- Conversion functions ---
+
+
+def quantize(values, scale_factor, add_offset, out=None,
+             work=None, mask=None):
+    """Convert float values to packed 16-bit integers
+
+    Values outside the 16-bit range, including NaN,
+    are set to UNDEF.
+
+    The conversion is done in place by ufuncs, in a float work
+    array and a boolean mask array of the same shape as values.
+    These, and the int16 out array, can be given to avoid any
+    allocation. The input values are not modified.
+    """
+    values = np.asarray(values)
+    if work is None:
+        work = np.empty(values.shape, dtype=_work_dtype(values.dtype))
+    if mask is None:
+        mask = np.empty(values.shape, dtype=bool)
+    if out is None:
+        out = np.empty(values.shape, dtype='int16')
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        np.subtract(values, add_offset, out=work)
+        np.divide(work, scale_factor, out=work)
+    np.rint(work, out=work)
+
+    # Above the range or NaN
+    np.less_equal(work, -UNDEF, out=mask)
+    np.logical_not(mask, out=mask)
+    np.copyto(work, UNDEF, where=mask)
+    # Below the range
+    np.less(work, UNDEF, out=mask)
+    np.copyto(work, UNDEF, where=mask)
+
+    np.copyto(out, work, casting='unsafe')
+    return out
+
+
+def _work_dtype(dtype):
+    """Float type for the quantization arithmetic"""
+    if dtype == np.float32:
+        return np.dtype('float32')
+    return np.dtype('float64')
+
+
+# Work buffers for the quantization, one set for each thread
+_buffers = threading.local()
+
+
+def _thread_buffer(shape, dtype):
+    """Reusable array of a given dtype for the calling thread
+
+    The buffer is grown as needed and returned as
+    a view of the given shape.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buf = getattr(_buffers, dtype.name, None)
+    if buf is None or buf.size < size:
+        buf = np.empty(size, dtype=dtype)
+        setattr(_buffers, dtype.name, buf)
+    return buf[:size].reshape(shape)
+
+
+def quantize_chunk(values, scale_factor, add_offset):
+    """Quantize with the work buffers of the calling thread
+
+    Only the int16 result is allocated, as it is
+    handed over to the writer.
+    """
+    values = np.asarray(values)
+    work = _thread_buffer(values.shape, _work_dtype(values.dtype))
+    mask = _thread_buffer(values.shape, bool)
+    return quantize(values, scale_factor, add_offset, work=work, mask=mask)
+
+
+def quantizer(scale_factor, add_offset):
+    """Picklable quantize transform for a given packing"""
+    return functools.partial(quantize_chunk, scale_factor=scale_factor,
+                             add_offset=add_offset)
+
+def dequantize(values, scale_factor, add_offset, fill_values=(),
+               fill=np.nan, dtype='float32', out=None, work=None, mask=None):
+    """Convert packed integers to float values
+
+    Packed values equal to one of fill_values are set to fill.
+    The arithmetic is done in double precision in the work array,
+    avoiding loss of precision when add_offset is large.
+    The out, work and boolean mask arrays can be given
+    to avoid any allocation.
+    """
+    values = np.asarray(values)
+    if out is None:
+        out = np.empty(values.shape, dtype=dtype)
+    if work is None:
+        work = out if out.dtype == np.float64 else np.empty(values.shape)
+    if mask is None and len(fill_values):
+        mask = np.empty(values.shape, dtype=bool)
+
+    np.multiply(values, scale_factor, out=work)
+    np.add(work, add_offset, out=work)
+    if work is not out:
+        np.copyto(out, work, casting='same_kind')
+    for value in fill_values:
+        np.equal(values, value, out=mask)
+        np.copyto(out, fill, where=mask, casting='unsafe')
+    return out
+
+
+def dequantize_chunk(values, scale_factor, add_offset, fill_values=(),
+                     fill=np.nan, dtype='float32'):
+    """Dequantize with the work buffers of the calling thread"""
+    values = np.asarray(values)
+    out = np.empty(values.shape, dtype=dtype)
+    work = out
+    if out.dtype != np.float64:
+        work = _thread_buffer(values.shape, np.float64)
+    mask = _thread_buffer(values.shape, bool)
+    return dequantize(values, scale_factor, add_offset, fill_values,
+                      fill, dtype, out=out, work=work, mask=mask)
+
+
+def dequantizer(scale_factor, add_offset, fill_values=(), fill=np.nan,
+                dtype='float32'):
+    """Picklable dequantize transform for a given packing"""
+    return functools.partial(dequantize_chunk, scale_factor=scale_factor,
+                             add_offset=add_offset,
+                             fill_values=tuple(fill_values), fill=fill,
+                             dtype=dtype)
+
+# Unsigned integer type and number of mantissa bits of the float types
+_MANTISSA = {np.dtype('float32'): (np.dtype('uint32'), 23),
+             np.dtype('float64'): (np.dtype('uint64'), 52)}
+
+
+def bitround(values, keepbits, fill_values=(), out=None, mask=None):
+    """Round float values to keepbits mantissa bits
+
+    The low mantissa bits are set to zero, rounding to nearest
+    with ties to even. The result compresses much better with
+    zlib and shuffle. NaN and the fill_values are kept unchanged.
+    The out array and the boolean mask array can be given
+    to avoid any allocation.
+    """
+    values = np.asarray(values)
+    utype, nbits = _MANTISSA[values.dtype]
+    if out is None:
+        out = np.empty(values.shape, dtype=values.dtype)
+    drop = nbits - keepbits
+    if drop <= 0:
+        np.copyto(out, values)
+        return out
+    if mask is None:
+        mask = np.empty(values.shape, dtype=bool)
+
+    ivalues = values.view(utype)
+    iout = out.view(utype)
+    half = utype.type((1 << (drop - 1)) - 1)
+    keep = utype.type(~((1 << drop) - 1) & ((1 << 8*utype.itemsize) - 1))
+
+    # Round half to even: add half, plus one if the last kept bit is set
+    np.right_shift(ivalues, utype.type(drop), out=iout)
+    np.bitwise_and(iout, utype.type(1), out=iout)
+    np.add(iout, half, out=iout)
+    np.add(iout, ivalues, out=iout)
+    np.bitwise_and(iout, keep, out=iout)
+
+    # Keep NaN and fill values
+    np.isnan(values, out=mask)
+    np.copyto(out, values, where=mask)
+    for value in fill_values:
+        np.equal(values, value, out=mask)
+        np.copyto(out, values, where=mask)
+    return out
+
+
+def bitround_chunk(values, keepbits, fill_values=()):
+    """Bitround with the mask buffer of the calling thread"""
+    values = np.asarray(values)
+    mask = _thread_buffer(values.shape, bool)
+    return bitround(values, keepbits, fill_values, mask=mask)
+
+
+def bitrounder(keepbits, fill_values=()):
+    """Picklable bitround transform"""
+    return functools.partial(bitround_chunk, keepbits=keepbits,
+                             fill_values=tuple(fill_values))
+
+# --- Statistics ---
+
+
+class RangeStatistics(object):
+    """Streaming range of the valid values of a variable
+
+    Values that are not finite or equal to a fill value are ignored.
+    With quantiles, a bounded, evenly spaced sample of the values
+    is kept and the range is given by the sample quantiles.
+    With limits, (low, high), the valid values outside are counted.
+    """
+
+    def __init__(self, fill_values=(), quantiles=None, sample_size=100000,
+                 limits=None):
+        self.fill_values = fill_values
+        self.quantiles = quantiles
+        self.sample_size = sample_size
+        self.limits = limits
+        self.outside = 0     # Number of values outside the limits
+        self.vmin = None
+        self.vmax = None
+        self._samples = []
+        self._stride = 1
+
+    def update(self, values):
+        """Include a chunk of values"""
+        values = np.asarray(values).ravel()
+        valid = np.isfinite(values)
+        for fill in self.fill_values:
+            valid &= values != fill
+        values = values[valid]
+        if not values.size:
+            return
+        vmin, vmax = values.min(), values.max()
+        if self.limits is not None:
+            low, high = self.limits
+            if vmin < low or vmax > high:
+                self.outside += int(np.count_nonzero(values < low) +
+                                    np.count_nonzero(values > high))
+        if self.vmin is None:
+            self.vmin, self.vmax = vmin, vmax
+        else:
+            self.vmin, self.vmax = min(self.vmin, vmin), max(self.vmax, vmax)
+
+        if self.quantiles is not None:
+            self._samples.append(values[::self._stride].copy())
+            # Thin out the sample when it grows too large
+            if sum(len(a) for a in self._samples) > self.sample_size:
+                self._samples = [np.concatenate(self._samples)[::2]]
+                self._stride *= 2
+
+    def range(self):
+        """The (vmin, vmax) of the values seen, None if no valid values"""
+        if self.vmin is None:
+            return None
+        if self.quantiles is not None:
+            sample = np.concatenate(self._samples)
+            vmin, vmax = np.quantile(sample, self.quantiles)
+            return float(vmin), float(vmax)
+        return float(self.vmin), float(self.vmax)
+
+
+def variable_fill_values(var):
+    """The values meaning undefined in a netCDF variable
+
+    The _FillValue, or the netCDF default fill value,
+    and any missing_value, in the type of the variable.
+    """
+    attrs = var.ncattrs()
+    if '_FillValue' in attrs:
+        values = [var._FillValue]
+    else:
+        values = [default_fillvals.get(var.dtype.str[1:])]
+    if 'missing_value' in attrs:
+        values.append(var.missing_value)
+    return tuple(np.concatenate([np.ravel(v).astype(var.dtype)
+                                 for v in values if v is not None]))
+
+
+def variable_range(var, max_bytes=DEFAULT_CHUNK_BYTES, quantiles=None):
+    """Range of the valid values of a netCDF variable
+
+    The variable is read chunk by chunk, ignoring the fill values.
+    """
+    stats = RangeStatistics(variable_fill_values(var), quantiles)
+
+    var.set_auto_maskandscale(False)
+    itemsize = var.dtype.itemsize
+    for index in chunk_slices(var.shape, itemsize, max_bytes):
+        stats.update(var[index])
+    return stats.range()
+
+
+class ObservedSource(object):
+    """A variable passing the chunks read to a RangeStatistics
+
+    Used as the source of variable_tasks, so the statistics
+    are collected in the conversion pass.
+    """
+
+    def __init__(self, var, stats):
+        self.var = var
+        self.stats = stats
+        self.shape = var.shape
+        self.dtype = var.dtype
+
+    def __getitem__(self, index):
+        values = self.var[index]
+        self.stats.update(values)
+        return values
+
+
+def packed_limits(scale_factor, add_offset):
+    """The range of values that quantize does not set to UNDEF"""
+    return (add_offset + scale_factor * (UNDEF + 0.5),
+            add_offset - scale_factor * (UNDEF - 0.5))
+
+
+def auto_rescale(vmin, vmax):
+    """Packing parameters for values in the range [vmin, vmax]
+
+    The range is mapped onto [-MAXPACKED, MAXPACKED],
+    keeping well clear of UNDEF.
+    """
+    add_offset = 0.5 * (vmin + vmax)
+    scale_factor = 0.5 * (vmax - vmin) / MAXPACKED
+    if scale_factor <= 0:   # Constant field
+        scale_factor = 1.0
+    return Rescale(scale_factor, add_offset)
+
+
+class StatisticsCache(object):
+    """Value ranges of variables, stored in a JSON file
+
+    Used to reuse the ranges from a previous file
+    in the same series.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.ranges = self.read()
+        self.changed = set()
+
+    def read(self):
+        """The ranges in the file"""
+        if not os.path.exists(self.filename):
+            return {}
+        with open(self.filename) as fid:
+            return dict((k, tuple(v)) for k, v in json.load(fid).items())
+
+    def __contains__(self, name):
+        return name in self.ranges
+
+    def __getitem__(self, name):
+        return self.ranges[name]
+
+    def __setitem__(self, name, vrange):
+        vrange = tuple(vrange)
+        if self.ranges.get(name) != vrange:
+            self.ranges[name] = vrange
+            self.changed.add(name)
+
+    def save(self):
+        """Write the cache to file, if changed
+
+        Several processes may share the cache. The ranges in
+        the file are merged in, keeping the widest range, and
+        the file is replaced atomically.
+        """
+        if not self.changed:
+            return
+        for name, (vmin, vmax) in self.read().items():
+            if name in self.ranges:
+                vmin = min(vmin, self.ranges[name][0])
+                vmax = max(vmax, self.ranges[name][1])
+            self.ranges[name] = (vmin, vmax)
+        tmpname = '{}.{}.tmp'.format(self.filename, os.getpid())
+        with open(tmpname, 'w') as fid:
+            json.dump(self.ranges, fid, indent=2, sort_keys=True)
+        os.replace(tmpname, self.filename)
+        self.changed.clear()
+
+# --- Pipeline ---
+
+
+def make_executor(workers=1, processes=False):
+    """Make a pool for the conversions
+
+    Returns None for serial conversion in the calling thread.
+    """
+    if workers is None or workers > 1:
+        if processes:
+            return ProcessPoolExecutor(workers)
+        return ThreadPoolExecutor(workers)
+    return None
+
+
+def convert(tasks, executor=None, max_pending=4):
+    """Run conversion tasks through a bounded pipeline
+
+    tasks is an iterable of (source, target, index, transform).
+    Reading source[index] and writing target[index] is done by the
+    calling thread, so the netCDF library is never entered concurrently.
+    The transforms run on the executor while the next chunks are read.
+    At most max_pending chunks are waiting for conversion.
+    """
+
+    if executor is None:
+        for source, target, index, transform in tasks:
+            values = source[index]
+            if transform is not None:
+                values = transform(values)
+            target[index] = values
+        return
+
+    pending = deque()
+    for source, target, index, transform in tasks:
+        values = source[index]
+        if transform is None:
+            target[index] = values
+            continue
+        pending.append((target, index, executor.submit(transform, values)))
+        if len(pending) >= max_pending:
+            target_, index_, future = pending.popleft()
+            target_[index_] = future.result()
+
+    # Drain the pipeline
+    while pending:
+        target_, index_, future = pending.popleft()
+        target_[index_] = future.result()
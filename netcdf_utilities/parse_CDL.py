@@ -1,175 +1,508 @@
 # -*- coding: utf-8 -*-
 
-"""A parser for Common Data Language"""
+"""A parser for Common Data Language
+
+The CDL text is split into tokens by a single regular expression
+per line, and the tokens are parsed in one pass by a small state
+machine. The parser is available as a stream of events by
+cdl_events, and parse_CDL collects the events.
+
+The data section is not tokenized. The text of each data
+statement is converted to a typed NumPy array in one call
+to np.fromstring.
+"""
 
 from __future__ import print_function
 
+import re
 import codecs
 import itertools
+import warnings
 
 import numpy as np
 
-# Must add something on text types
-nctypes = ['short', 'int', 'long', 'float', 'double']
+# The netCDF types in CDL
+nctypes = ['char', 'byte', 'ubyte', 'short', 'ushort', 'int', 'uint',
+           'long', 'int64', 'uint64', 'float', 'real', 'double', 'string']
+
+# Section keywords
+SECTIONS = ['dimensions', 'variables', 'data']
+
+# An attribute name right after the ':', followed by '=',
+# as in data:units = "m", for a variable named as a section
+ATTRIBUTE_AHEAD_RE = re.compile(r'(?:[^\s{}(),;=:"/]|/(?!/))+\s*=')
+
+# Tokens: strings, punctuation or words, whitespace and comments skipped.
+# A word is anything else, names, numbers and keywords.
+TOKEN_RE = re.compile(r'''
+    \s+ | //.*                          # Skip whitespace and comments
+    | ( "(?:[^"\\]|\\.)*"               # String with escapes
+      | [{}(),;=:]                      # Punctuation
+      | (?:[^\s{}(),;=:"/]|/(?!/))+ )   # Word
+    ''', re.VERBOSE)
+
+# NumPy types of the netCDF types
+DTYPES = dict(char='S1', byte='i1', ubyte='u1', short='i2', ushort='u2',
+              int='i4', long='i4', uint='u4', int64='i8', uint64='u8',
+              float='f4', real='f4', double='f8', string=object)
 
+# netCDF type of numeric numpy types
+NCTYPES = dict((dtype, nctype) for nctype, dtype in DTYPES.items()
+               if nctype not in ('char', 'long', 'real', 'string'))
 
-def logical_lines(lines):
-    """Iterator of logical lines in a CDL file"""
+# Default netCDF fill values, used for '_' in the data section
+FILL_VALUES = dict(char=b'\0', byte=-127, ubyte=255, short=-32767,
+                   ushort=65535, int=-2147483647, long=-2147483647,
+                   uint=4294967295, int64=-9223372036854775806,
+                   uint64=18446744073709551614,
+                   float=9.9692099683868690e+36, real=9.9692099683868690e+36,
+                   double=9.9692099683868690e+36, string='')
 
-    # Strip line-shifts and trailing blanks
-    lines = (line.rstrip() for line in lines)
+# Type suffixes of CDL numbers
+SUFFIXES = dict(b='byte', ub='ubyte', s='short', us='ushort',
+                l='int', u='uint', ul='uint', ll='int64', ull='uint64',
+                f='float', d='double')
 
-    # Remove comments
-    lines = (line.split('//')[0] for line in lines)
+# Data values needing a fix before np.fromstring:
+# type suffixes and the fill value '_'
+SUFFIX_CHARS = 'bBsSlLfFdDuU'
+SUFFIX_RE = re.compile(r'(?<=[0-9.NnYy])[bBsSlLfFdDuU]{1,3}\b')
+FILL_RE = re.compile(r'(?<![\w.])_(?![\w.])')
 
-    # Ignore empty lines
-    lines = (line for line in lines if line)
+# Strings, semicolons and comments in data lines
+DATA_RE = re.compile(r'"(?:[^"\\]|\\.)*"|;|//.*')
 
-    # Use logical lines
-    lines = split_lines(join_lines(lines))
+# Escape sequences in CDL strings
+ESCAPE_RE = re.compile(r'\\(.)')
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0'}
 
-    return lines
 
+# --- Tokenizer ---
 
-def join_lines(lines):
-    """Make an iterator of logical lines from an iterator of lines"""
-    joined_line = []
+
+def tokenize(lines):
+    """Iterator of tokens from an iterator of lines
+
+    Strings keep their double quotes, other tokens
+    are punctuation characters or words.
+    """
+    findall = TOKEN_RE.findall
     for line in lines:
-        if line[-1] in [';', '{', ':']:   # End symbols for logical lines
-            joined_line.append(line[:-1])
-            yield ' '.join(joined_line)
-            joined_line = []
+        for token in findall(line):
+            if token:
+                yield token
+
+
+def unquote(token):
+    """Text of a string token, with escapes resolved"""
+    return ESCAPE_RE.sub(lambda m: ESCAPES.get(m.group(1), m.group(1)),
+                         token[1:-1])
+
+
+# --- Parser ---
+
+
+def cdl_events(lines, data=False):
+    """Parse CDL as a stream of events
+
+    Reads the lines incrementally. Stops at the data section,
+    unless data is True. Yields tuples (kind, item) where
+    kind and item are
+
+      'location',  name
+      'dimension', (name, length, isUnlimited)
+      'variable',  (name, nctype, shape)
+      'attribute', (variable name or None, name, value)
+      'data',      (variable name, array)
+    """
+    lines = iter(lines)
+    header = []
+    section = None
+    statement = []
+    # Declarations, needed for the data section
+    dimensions = {}
+    variables = {}
+    fill_values = {}
+
+    for line in lines:
+        for match in TOKEN_RE.finditer(line):
+            token = match.group(1)
+            if not token:
+                continue
+
+            # Header: netcdf <location> {
+            if len(header) < 3:
+                header.append(token)
+                if len(header) == 3:
+                    if header[0] != 'netcdf' or header[2] != '{':
+                        raise ValueError(
+                            "Not a CDL file, starts with {}".format(header))
+                    yield 'location', header[1]
+                continue
+
+            if token == ';':
+                for event in statement_events(section, statement):
+                    if data:
+                        kind, item = event
+                        if kind == 'dimension':
+                            dimensions[item[0]] = item[1]
+                        elif kind == 'variable':
+                            variables[item[0]] = item[1:]
+                        elif item[1] == '_FillValue':
+                            fill_values[item[0]] = item[2]
+                    yield event
+                statement = []
+            elif token == ':' and len(statement) == 1 and \
+                    statement[0] in SECTIONS and \
+                    not ATTRIBUTE_AHEAD_RE.match(line, match.end()):
+                section = statement[0]
+                statement = []
+                if section == 'data':
+                    if data:
+                        rest = itertools.chain([line[match.end():]], lines)
+                        for event in data_events(rest, dimensions,
+                                                 variables, fill_values):
+                            yield event
+                    return
+            elif token == '}' and not statement:
+                return
+            else:
+                statement.append(token)
+
+
+def statement_events(section, statement):
+    """Events from the tokens of a statement, without the ';'"""
+    if not statement:
+        return
+    if section == 'dimensions':
+        for item in split_commas(statement):
+            yield 'dimension', dimension_item(item)
+    elif section == 'variables':
+        if ':' in statement[:3]:
+            yield 'attribute', attribute_item(statement)
+        else:
+            for item in variable_items(statement):
+                yield 'variable', item
+    else:
+        raise ValueError("Statement outside section: {}".format(
+            ' '.join(statement)))
+
+
+def split_commas(tokens):
+    """Split a token list at the commas"""
+    item = []
+    for token in tokens:
+        if token == ',':
+            yield item
+            item = []
         else:
-            joined_line.append(line)
+            item.append(token)
+    if item:
+        yield item
+
+
+def dimension_item(tokens):
+    """(name, length, isUnlimited) from dimension tokens"""
+    name, equal, value = tokens
+    if value.upper() == 'UNLIMITED':
+        return name, 0, True
+    return name, int(value), False
+
+
+def variable_items(tokens):
+    """(name, nctype, shape) items from a variable declaration
+
+    A declaration may define several variables of the same type.
+    """
+    nctype = tokens[0]
+    i = 1
+    while i < len(tokens):
+        name = tokens[i]
+        i += 1
+        shape = []
+        if i < len(tokens) and tokens[i] == '(':
+            close = tokens.index(')', i)
+            shape = [t for t in tokens[i+1:close] if t != ',']
+            i = close + 1
+        yield name, nctype, tuple(shape)
+        i += 1  # Skip comma
+
+
+def attribute_item(tokens):
+    """(variable, name, value) from attribute tokens
+
+    Forms:  var:name = values,  :name = values
+    and typed:  type var:name = values,  type :name = values
+    """
+    nctype = None
+    if tokens[0] in nctypes and ':' in tokens[1:3] and tokens[2] != '=':
+        nctype = tokens[0]
+        tokens = tokens[1:]
+    if tokens[0] == ':':    # Global attribute
+        var = None
+        name = tokens[1]
+        values = tokens[3:]
+    else:
+        var = tokens[0]
+        name = tokens[2]
+        values = tokens[4:]
+    values = [v for v in values if v != ',']
+    return var, name, attribute_value(values, nctype)
+
 
+def attribute_value(values, nctype=None):
+    """Value of an attribute from its tokens, infer type
 
-def split_lines(lines):
-    """Split lines at ';' """
+    Strings are concatenated. For numbers without a type
+    the type is the widest type of the values, by values_type.
+    The numbers are decoded together by data_value.
+    """
+    v0 = values[0]
+    # text
+    if v0.startswith('"'):
+        return ''.join(unquote(v) for v in values)
+    if nctype is None:
+        nctype = values_type(values)
+    return data_value(','.join(values), nctype)
+
+
+def values_type(tokens):
+    """The netCDF type holding all the CDL numbers
+
+    The widest of the types given by suffixes. Numbers
+    without suffix, int or double, take this type, but a
+    double makes an integer type double. Without any
+    suffix the type is int or double.
+    """
+    suffixed = set()
+    plain = set()
+    for token in tokens:
+        nctype = number_type(token)
+        if SUFFIX_RE.search(token):
+            suffixed.add(nctype)
+        else:
+            plain.add(nctype)
+    if not suffixed:
+        return 'double' if 'double' in plain else 'int'
+    if len(suffixed) == 1 and 'double' not in plain:
+        return suffixed.pop()
+    dtype = np.result_type(*[DTYPES[nctype] for nctype in suffixed])
+    if 'double' in plain and dtype.kind != 'f':
+        return 'double'
+    return NCTYPES[dtype.str[1:]]
+
+
+def number_type(token):
+    """The netCDF type of a CDL number, from its suffix"""
+    match = SUFFIX_RE.search(token)
+    if match:
+        try:
+            return SUFFIXES[match.group().lower()]
+        except KeyError:
+            raise ValueError("Bad number: {}".format(token))
+    token = token.lower()
+    if '.' in token or 'e' in token or 'nan' in token or 'inf' in token:
+        return 'double'
+    return 'int'
+
+
+# --- Data section ---
+
+
+def data_statements(lines):
+    """Iterator of (name, text) for the statements of a data section
+
+    Only lines with strings are tokenized,
+    the numerical lines are split at the semicolons.
+    """
+    buffer = []
     for line in lines:
-        sublines = line.split(';')
-        for subline in sublines:
-            yield subline
+        if '"' in line:
+            pieces = []
+            start = 0
+            for match in DATA_RE.finditer(line):
+                token = match.group()
+                if token == ';':
+                    pieces.append(line[start:match.start()])
+                    start = match.end()
+                elif token.startswith('//'):
+                    line = line[:match.start()]
+                    break
+            pieces.append(line[start:])
+        else:
+            if '//' in line:
+                line = line.split('//', 1)[0]
+            pieces = line.split(';')
+        buffer.append(pieces[0])
+        for piece in pieces[1:]:
+            name, equal, text = ''.join(buffer).partition('=')
+            if not equal:
+                raise ValueError("Bad data statement: {}".format(name))
+            yield name.strip(), text
+            buffer = [piece]
+    rest = ''.join(buffer).strip()
+    if rest and rest != '}':
+        raise ValueError("Unterminated data statement: {}".format(rest[:40]))
+
+
+def data_events(lines, dimensions, variables, fill_values=None):
+    """Events ('data', (name, array)) from the data section
+
+    dimensions gives the length of the dimensions,
+    variables gives nctype and shape for the variables,
+    fill_values gives the _FillValue attributes.
+    """
+    fill_values = fill_values or {}
+    for name, text in data_statements(lines):
+        try:
+            nctype, shape = variables[name]
+        except KeyError:
+            raise ValueError("Data for undeclared variable {}".format(name))
+        fill = fill_values.get(name, FILL_VALUES.get(nctype))
+        width = dimensions[shape[-1]] if shape else 0
+        value = data_value(text, nctype, fill, width)
+        yield 'data', (name, reshape_data(value, name, shape, dimensions))
+
+
+def data_value(text, nctype, fill=None, width=0):
+    """1D array from the text of a data statement
+
+    Strings for char variables are padded with null bytes
+    to a multiple of the width, the last dimension.
+    Numbers are parsed by np.fromstring, with the '_' fill
+    values and type suffixes fixed by regular expressions
+    only when needed.
+    """
+    if nctype == 'char':
+        # Each string fills a whole number of rows
+        chars = []
+        for token in DATA_RE.findall(text):
+            if token.startswith('"'):
+                string = unquote(token).encode('utf-8')
+                if width:
+                    rows = max(1, -(-len(string) // width))
+                    string = string.ljust(rows * width, b'\0')
+                chars.append(string)
+        return np.frombuffer(b''.join(chars), dtype='S1').copy()
+    if nctype == 'string':
+        return np.array([unquote(s) for s in DATA_RE.findall(text)
+                         if s.startswith('"')], dtype=object)
+
+    if '_' in text:
+        if fill is None:
+            fill = FILL_VALUES[nctype]
+        fill = np.asarray(fill).ravel()[0]
+        text = FILL_RE.sub(str(fill.item()), text)
+    # Substring tests are much faster than a regular expression search
+    if any(c in text for c in SUFFIX_CHARS):
+        text = SUFFIX_RE.sub('', text)
+
+    dtype = np.dtype(DTYPES[nctype])
+    if dtype.kind == 'f':
+        parse_dtype = np.float64
+    elif dtype == np.uint64:
+        parse_dtype = np.uint64
+    else:
+        parse_dtype = np.int64
+    with warnings.catch_warnings():
+        # Unmatched data, a ValueError in later NumPy versions
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            value = np.fromstring(text, dtype=parse_dtype, sep=',')
+        except (DeprecationWarning, ValueError):
+            value = None
+    if value is None or len(value) != text.count(',') + 1:
+        raise ValueError("Bad numerical data: {}...".format(
+            text.strip()[:40]))
+    return value.astype(dtype)
+
+
+def reshape_data(value, name, shape, dimensions):
+    """Shape the data of a variable
+
+    The length of an unlimited dimension is taken from the data.
+    """
+    lengths = [dimensions[d] for d in shape]
+    if 0 in lengths:     # Unlimited dimension
+        i = lengths.index(0)
+        size = int(np.prod(lengths[:i] + lengths[i+1:]))
+        lengths[i] = len(value) // size if size else 0
+    if int(np.prod(lengths)) != len(value):
+        raise ValueError("Data for {} has {} values, expected shape {}".
+                         format(name, len(value), tuple(lengths)))
+    return value.reshape(lengths)
+
+
+# --- Single line parsers ---
 
 
 def parse_dimension(line):
     """Parse a dimension line from CDL"""
-    line = line.replace('=', ' ')
-    words = line.split()
-    name = words[0]
-    if words[1].upper() == "UNLIMITED":
-        length = 0
-        isUnlimited = True
-    else:
-        length = int(words[1])
-        isUnlimited = False
-    return name, length, isUnlimited
+    tokens = [t for t in tokenize([line]) if t != ';']
+    return dimension_item(tokens)
 
 
 def parse_variable(line):
     """Parse a variable line from CDL"""
-    line = line.replace('(', ' ')
-    line = line.replace(')', ' ')
-    line = line.replace(',', ' ')
-    words = line.split()
-    nctype = words[0]
-    name = words[1]
-    shape = tuple(words[2:])
-    return name, nctype, shape
+    tokens = [t for t in tokenize([line]) if t != ';']
+    return next(variable_items(tokens))
 
 
 def parse_attribute(line):
     """Parse an attribute line from CDL, infer type"""
+    tokens = [t for t in tokenize([line]) if t != ';']
+    return attribute_item(tokens)
 
-    if line.lstrip()[0] == ':':  # Global attribute
-        var = None
-    else:                        # Variable attribute
-        var = True
 
-    # Split the line
-    line = line.replace(':', ' ')
-    line = line.replace('=', ' ')
-    words = line.split()
-    if var:
-        var = words[0]
-        words[0:1] = []
+# --- Main parser ---
 
-    words = [w.rstrip(',') for w in words]  # Strip trailing commas
 
-    name = words[0]
-    values = words[1:]  # Between = and ;
-    v0 = values[0]
-    # text
-    if v0.startswith('"'):
-        value = line[line.index('"') + 1: line.rindex('"')]  # Between ""
-    # short
-    elif v0.endswith('s'):
-        # nctype = 'short'
-        value = np.array([int(v.rstrip('s')) for v in values],
-                         dtype='int16')
-    # float
-    elif v0.endswith('f'):
-        # nctype = 'float'
-        value = np.array([float(v.rstrip('f')) for v in values],
-                         dtype='float32')
-    # double
-    elif "." in v0:
-        # nctype = 'double'
-        value = np.array([float(v) for v in values],
-                         dtype='float64')
-    # integer
-    else:  # integer
-        # nctype = 'int'
-        value = np.array([int(v) for v in values],
-                         dtype='int32')
-    # Make exception for bad entry
-    return var, name, value
-
-
-def parse_CDL(cdl_file):
-
-    # Open the file
-    with codecs.open(cdl_file, encoding='utf-8') as fid:
-
-        # Remove data lines, anything after "data:"
-        lines = itertools.takewhile(lambda x:
-                                    not x.lstrip().startswith('data:'), fid)
-
-        # Consider logical lines
-        lines = logical_lines(lines)
-
-        location = next(lines).split()[1]  # netcdf <location- {
-
-        # Accumulators
-        att_lines = []
-        dim_lines = []
-        var_lines = []
-
-        for line in lines:
-
-            # Attribute lines
-            if ':' in line:
-                att_lines.append(line)
-
-            # Dimension lines
-            elif '=' in line:
-                dim_lines.append(line)
-
-            # Variable lines
-            else:
-                words = line.split()
-                if words[0] in nctypes:
-                    var_lines.append(line)
+def parse_CDL(cdl_file, data=False):
+    """Parse a CDL file
+
+    cdl_file is a file name or an open file.
+    Returns location, dimensions, variables and attributes,
+    where attributes is a dictionary from variable name
+    (None for global attributes) to a list of attributes.
+    With data, the data section is read and a dictionary
+    from variable name to array is returned in addition.
+    """
+
+    if hasattr(cdl_file, 'read'):
+        result = collect_events(cdl_events(cdl_file, data))
+    else:
+        with codecs.open(cdl_file, encoding='utf-8') as fid:
+            result = collect_events(cdl_events(fid, data))
+
+    if data:
+        return result
+    return result[:4]
+
+
+def collect_events(events):
+    """Collect the events of a CDL file"""
+
+    location = None
+    dimensions = []
+    variables = []
+    attributes = {None: []}   # None for global attributes
+    data = {}
+
+    for kind, item in events:
+        if kind == 'attribute':
+            attributes.setdefault(item[0], []).append(item)
+        elif kind == 'variable':
+            variables.append(item)
+            attributes.setdefault(item[0], [])
+        elif kind == 'dimension':
+            dimensions.append(item)
+        elif kind == 'data':
+            data[item[0]] = item[1]
+        elif kind == 'location':
+            location = item
 
-            # Parse the lines
-            dimensions = [parse_dimension(line) for line in dim_lines]
-            variables = [parse_variable(line) for line in var_lines]
-            attributes = {var[0]: [] for var in variables}
-            attributes[None] = []   # Global attributes
-            for line in att_lines:
-                att = parse_attribute(line)
-                attributes[att[0]].append(att)
+    return location, dimensions, variables, attributes, data
 
-        return location, dimensions, variables, attributes
 
 if __name__ == '__main__':
 
@@ -184,7 +517,7 @@ if __name__ == '__main__':
     print("\n--- Variables")
     for var in variables:
         print(var)
-        for att in attributes[var[1]]:
+        for att in attributes[var[0]]:
             print("   ", att[1:])
 
     # print global attribures
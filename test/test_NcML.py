@@ -6,6 +6,8 @@ import subprocess
 import filecmp
 import codecs
 
+import numpy as np
+
 from netcdf_utilities.ncstructure import NCstructure
 
 
@@ -32,5 +34,67 @@ class TestNcML(unittest.TestCase):
         os.remove('mytest.ncml')
 
 
+class TestReadNcML(unittest.TestCase):
+
+    def test_roundtrip(self):
+        """to_NcML followed by from_NcML restores the structure"""
+        nc = NCstructure.from_CDL('test.cdl', data=False)
+        with codecs.open('mytest.ncml', 'w', encoding='utf-8') as fid:
+            nc.write_NcML(fid)
+        nc2 = NCstructure.from_NcML('mytest.ncml')
+        self.assertEqual(nc2.to_NcML(), nc.to_NcML())
+
+    def test_aggregation(self):
+        """Members of an aggregation are skipped"""
+        text = """<?xml version="1.0" encoding="UTF-8"?>
+<netcdf xmlns="http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2"
+        location="agg.nc">
+  <dimension name="time" length="0" isUnlimited="true" />
+  <attribute name="sizes" type="short" value="1 2  3" />
+  <variable name="temp" shape="time" type="float">
+    <attribute name="scale" type="float" value="0.5" />
+    <values>1 2 3</values>
+  </variable>
+  <aggregation type="joinExisting" dimName="time">
+    <netcdf location="a.nc">
+      <attribute name="member" value="a" />
+    </netcdf>
+    <netcdf location="b.nc" />
+  </aggregation>
+</netcdf>
+"""
+        with codecs.open('mytest.ncml', 'w', encoding='utf-8') as fid:
+            fid.write(text)
+        nc = NCstructure.from_NcML('mytest.ncml')
+        self.assertEqual(nc.location, 'agg.nc')
+        self.assertEqual(list(nc.attributes), ['sizes'])
+        self.assertEqual(nc.attributes['sizes'].value.dtype, np.int16)
+        self.assertEqual(list(nc.attributes['sizes'].value), [1, 2, 3])
+        var = nc.variables['temp']
+        self.assertEqual(var.shape, ('time',))
+        self.assertEqual(var.attributes['scale'].value[0], np.float32(0.5))
+        self.assertTrue(nc.dimensions['time'].isUnlimited)
+
+    def test_aggregation_location(self):
+        """The root of an aggregation may have no location"""
+        text = """<?xml version="1.0" encoding="UTF-8"?>
+<netcdf xmlns="http://www.unidata.ucar.edu/namespaces/netcdf/ncml-2.2">
+  <attribute name="title" value="Joined" />
+  <aggregation type="joinExisting" dimName="time">
+    <netcdf location="a.nc" />
+    <netcdf location="b.nc" />
+  </aggregation>
+</netcdf>
+"""
+        with codecs.open('mytest.ncml', 'w', encoding='utf-8') as fid:
+            fid.write(text)
+        nc = NCstructure.from_NcML('mytest.ncml')
+        self.assertIsNone(nc.location)
+        self.assertEqual(nc.attributes['title'].value, 'Joined')
+
+    def tearDown(self):
+        os.remove('mytest.ncml')
+
+
 if __name__ == '__main__':
     unittest.main()
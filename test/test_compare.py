@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from netcdf_utilities.ncstructure import NCstructure, diff
+
+
+def make_structure(nrec=10):
+    struc = NCstructure('test')
+    struc.createDimension('time', nrec, isUnlimited=True)
+    struc.createDimension('lon', 360)
+    var = struc.createVariable('lon', 'double', ('lon',))
+    var.createAttribute('units', 'degrees_east')
+    var = struc.createVariable('temp', 'float', ('time', 'lon'))
+    var.createAttribute('units', 'Celsius')
+    var.createAttribute('valid_range', np.array([-2, 40], dtype='float32'))
+    struc.createAttribute('history', 'Created')
+    return struc
+
+
+class TestHash(unittest.TestCase):
+
+    def test_same(self):
+        """Independent of order and number of records"""
+        a = make_structure(10)
+        b = make_structure(20)
+        b.renameVariable('lon', 'x')
+        b.renameVariable('x', 'lon')
+        self.assertEqual(a.structure_hash(), b.structure_hash())
+        self.assertEqual(a.structure_hash(values=True),
+                         b.structure_hash(values=True))
+
+    def test_values(self):
+        a = make_structure()
+        b = make_structure()
+        b.createAttribute('history', 'Modified')
+        self.assertEqual(a.structure_hash(), b.structure_hash())
+        self.assertNotEqual(a.structure_hash(values=True),
+                            b.structure_hash(values=True))
+
+    def test_shape(self):
+        a = make_structure()
+        b = make_structure()
+        b.createVariable('temp', 'float', ('lon',))
+        self.assertNotEqual(a.structure_hash(), b.structure_hash())
+
+
+class TestDiff(unittest.TestCase):
+
+    def test_no_diff(self):
+        a, b = make_structure(1), make_structure(5)
+        self.assertEqual(diff(a, b), ([], [], []))
+
+    def test_diff(self):
+        a = make_structure()
+        b = make_structure()
+        b.createDimension('lat', 180)
+        b.createVariable('lat', 'double', ('lat',))
+        b.variables['temp'].createAttribute(
+            'valid_range', np.array([-2, 35], dtype='float32'))
+        b.variables['temp'].createAttribute('units', 'K')
+        b.renameAttribute('history', 'source')
+        added, removed, changed = diff(a, b)
+        self.assertEqual(added, [('attribute', ':source'),
+                                 ('dimension', 'lat'),
+                                 ('variable', 'lat')])
+        self.assertEqual(removed, [('attribute', ':history')])
+        self.assertEqual(changed, [('attribute', 'temp:units'),
+                                   ('attribute', 'temp:valid_range')])
+        # Without values only the type matters
+        self.assertEqual(diff(a, b, values=False).changed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
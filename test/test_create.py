@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import pickle
 import unittest
 
+import numpy as np
+
 from netcdf_utilities.ncstructure import NCstructure
 
 
@@ -46,6 +49,77 @@ class TestCreate(unittest.TestCase):
             # struc does not have a latitude dimension
             struc.createVariable('temperature', 'float', ('lat', 'lon'))
 
+    def test_compact(self):
+        """Compact storage with the same interface"""
+        struc = NCstructure('test')
+        struc.createDimension('lon', 360)
+        var = struc.createVariable('u', 'float', ('lon',))
+        var.createAttribute('scale_factor', np.float32(0.01))
+        var.createAttribute('valid_range', [-1.0, 1.0])
+        att = var.attributes['scale_factor']
+        self.assertFalse(hasattr(att, '__dict__'))
+        self.assertFalse(hasattr(var, '__dict__'))
+        self.assertEqual(att.value.shape, (1,))
+        self.assertEqual(att.value.dtype, np.dtype('float32'))
+        self.assertEqual(att.nctype, 'float')
+        self.assertEqual(list(var.attributes['valid_range'].value),
+                         [-1.0, 1.0])
+        self.assertEqual(var.attributes['valid_range'].nctype, 'double')
+        # Names shared between structures
+        other = NCstructure('other')
+        other.createDimension(''.join('lon'), 10)
+        self.assertIs(other.dimensions['lon'].name, var.shape[0])
+        # Pickled, as in the scan cache
+        copy = pickle.loads(pickle.dumps(struc, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.variables['u'].attributes['scale_factor'].value,
+                         att.value)
+
+
+class TestDimensionIndex(unittest.TestCase):
+
+    def setUp(self):
+        struc = NCstructure('test')
+        struc.createDimension('time', None)
+        struc.createDimension('lat', 180)
+        struc.createDimension('lon', 360)
+        struc.createDimension('bounds', 2)
+        struc.createVariable('lon', 'double', ('lon',))
+        struc.createVariable('temp', 'float', ('time', 'lat', 'lon'))
+        struc.createVariable('mask', 'byte', ('lat', 'lon'))
+        self.struc = struc
+
+    def test_query(self):
+        struc = self.struc
+        self.assertEqual(struc.variables_using('lon'), ['lon', 'temp', 'mask'])
+        self.assertEqual(struc.variables_using('time'), ['temp'])
+        self.assertTrue(struc.is_used('lat'))
+        self.assertEqual(struc.unused_dimensions(), ['bounds'])
+
+    def test_delete(self):
+        struc = self.struc
+        with self.assertRaises(ValueError):
+            struc.deleteDimension('time')
+        struc.deleteVariable('temp')
+        self.assertFalse(struc.is_used('time'))
+        struc.deleteDimension('time')
+        self.assertNotIn('time', struc.dimensions)
+
+    def test_rename(self):
+        struc = self.struc
+        struc.renameVariable('mask', 'land')
+        struc.renameDimension('lon', 'x')
+        self.assertEqual(struc.variables_using('x'), ['lon', 'temp', 'land'])
+        self.assertEqual(struc.variables['land'].shape, ('lat', 'x'))
+        struc.rename_many({'lat': 'x', 'x': 'lat'})
+        self.assertEqual(struc.variables['temp'].shape, ('time', 'x', 'lat'))
+        self.assertEqual(struc.variables_using('lat'), ['lon', 'temp', 'land'])
+
+    def test_redefine(self):
+        """A redefined variable replaces the old uses"""
+        self.struc.createVariable('mask', 'byte', ('bounds',))
+        self.assertEqual(self.struc.variables_using('lat'), ['temp'])
+        self.assertEqual(self.struc.variables_using('bounds'), ['mask'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+from netCDF4 import Dataset
+
+from netcdf_utilities.packing import UNDEF, MAXPACKED, AUTO, StatisticsCache
+from netcdf_utilities.float2int16 import Rescale, Trim, Packer, pack_file
+
+
+def make_input(filename):
+    """Make a small ROMS-like netCDF file"""
+    with Dataset(filename, mode='w', format='NETCDF3_CLASSIC') as fid:
+        fid.createDimension('ocean_time', None)
+        fid.createDimension('s_rho', 3)
+        fid.createDimension('xi_rho', 20)
+        fid.title = 'Test file'
+        v = fid.createVariable('ocean_time', 'd', ('ocean_time',))
+        v.units = 'seconds since 2000-01-01'
+        v[:] = 3600.0 * np.arange(5)
+        v = fid.createVariable('h', 'd', ('xi_rho',), fill_value=-1.0)
+        v[:] = np.linspace(10, 100, 20)
+        v = fid.createVariable('temp', 'f', ('ocean_time', 's_rho', 'xi_rho'),
+                               fill_value=1.0e37)
+        v.long_name = 'temperature'
+        v[:] = np.random.uniform(-2, 20, (5, 3, 20))
+        v[0, 0, 0] = 1.0e37
+        v = fid.createVariable('omega', 'f', ('ocean_time', 'xi_rho'))
+        v[:] = 0.0
+
+
+class TestPackFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, 'in.nc')
+        self.outfile = os.path.join(self.tmpdir, 'out.nc')
+        make_input(self.infile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_pack_file(self):
+        pack_file(self.infile, self.outfile,
+                  rescale_map=dict(temp=Rescale(0.001, 10.0)),
+                  exclude=['omega'])
+        with Dataset(self.infile) as f0, Dataset(self.outfile) as f1:
+            self.assertEqual(f1.title, 'Test file')
+            self.assertNotIn('omega', f1.variables)
+            self.assertEqual(len(f1.dimensions['ocean_time']), 5)
+            self.assertTrue(f1.dimensions['ocean_time'].isunlimited())
+            # Unpacked variables, with fill value
+            self.assertEqual(f1.variables['h']._FillValue, -1.0)
+            self.assertTrue(np.all(f1.variables['h'][:] ==
+                                   f0.variables['h'][:]))
+            # Packed variable
+            v1 = f1.variables['temp']
+            self.assertEqual(v1.dtype, np.dtype('int16'))
+            self.assertEqual(v1.long_name, 'temperature')
+            self.assertEqual(v1.scale_factor, 0.001)
+            self.assertEqual(v1.add_offset, 10.0)
+            v1.set_auto_maskandscale(False)
+            self.assertEqual(v1[0, 0, 0], UNDEF)
+            v1.set_auto_maskandscale(True)
+            error = np.abs(v1[:] - f0.variables['temp'][:])
+            self.assertTrue(np.ma.is_masked(v1[0, 0, 0]))
+            self.assertLessEqual(error.max(), 0.0005 + 1e-6)
+
+    def test_reuse(self):
+        """A Packer can convert several files"""
+        outfile2 = os.path.join(self.tmpdir, 'out2.nc')
+        with Packer(dict(temp=Rescale(0.01, 0.0)), workers=2,
+                    max_bytes=100) as packer:
+            packer.pack(self.infile, self.outfile)
+            packer.pack(self.infile, outfile2)
+        with Dataset(self.outfile) as f1, Dataset(outfile2) as f2:
+            self.assertNotIn('omega', f1.variables)  # dont_copy default
+            self.assertTrue(np.all(f1.variables['temp'][:] ==
+                                   f2.variables['temp'][:]))
+
+    def test_auto(self):
+        """Derive the packing from the data, cache the range"""
+        cachefile = os.path.join(self.tmpdir, 'stats.json')
+        pack_file(self.infile, self.outfile, dict(temp=AUTO),
+                  stats_cache=cachefile)
+        with Dataset(self.infile) as f0, Dataset(self.outfile) as f1:
+            f0.set_auto_mask(False)
+            temp0 = f0.variables['temp'][:]
+            temp1 = f1.variables['temp'][:]
+            # The fill value stays undefined, and only that
+            self.assertEqual(np.ma.count_masked(temp1), 1)
+            error = np.abs(temp1 - temp0).max()
+            scale_factor = f1.variables['temp'].scale_factor
+            self.assertLessEqual(error, 0.51 * scale_factor)
+        cache = StatisticsCache(cachefile)
+        vmin, vmax = cache['temp']
+        self.assertEqual(vmin, temp0.min())
+        self.assertEqual(vmax, temp0[temp0 < 1.0e30].max())
+
+        # Reuse the cached range, widened by the headroom
+        with open(cachefile, 'w') as fid:
+            json.dump(dict(temp=[0.0, 10.0]), fid)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            pack_file(self.infile, self.outfile, dict(temp=AUTO),
+                      stats_cache=cachefile, headroom=0.5)
+        with Dataset(self.outfile) as f1:
+            self.assertAlmostEqual(f1.variables['temp'].add_offset, 5.0)
+            self.assertAlmostEqual(f1.variables['temp'].scale_factor,
+                                   10.0 / MAXPACKED)
+            # Values outside -5 .. 15 are lost, and reported
+            lost = np.ma.count_masked(f1.variables['temp'][:]) - 1
+        self.assertEqual(lost, np.count_nonzero(
+            (temp0 > 15.0 + 1.0e-3) & (temp0 < 1.0e30)))
+        self.assertGreater(lost, 0)
+        self.assertEqual(len(caught), 1)
+        self.assertIn('{} values of temp'.format(lost),
+                      str(caught[0].message))
+
+        # The cached range is widened for the next file
+        cache = StatisticsCache(cachefile)
+        self.assertEqual(cache['temp'],
+                         (float(temp0.min()),
+                          float(temp0[temp0 < 1.0e30].max())))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            pack_file(self.infile, self.outfile, dict(temp=AUTO),
+                      stats_cache=cachefile)
+        self.assertEqual(len(caught), 0)
+        with Dataset(self.outfile) as f1:
+            self.assertEqual(np.ma.count_masked(f1.variables['temp'][:]), 1)
+
+    def test_shared_cache(self):
+        """Processes sharing a cache do not lose ranges"""
+        cachefile = os.path.join(self.tmpdir, 'stats.json')
+        cache1 = StatisticsCache(cachefile)
+        cache2 = StatisticsCache(cachefile)
+        cache1['temp'] = (0.0, 10.0)
+        cache1.save()
+        cache2['salt'] = (30.0, 35.0)
+        cache2['temp'] = (-1.0, 5.0)
+        cache2.save()
+        cache = StatisticsCache(cachefile)
+        self.assertEqual(cache.ranges, dict(temp=(-1.0, 10.0),
+                                            salt=(30.0, 35.0)))
+
+        # Unchanged, the file is not written
+        os.remove(cachefile)
+        cache['temp'] = (-1.0, 10.0)
+        cache.save()
+        self.assertFalse(os.path.exists(cachefile))
+
+    def test_storage(self):
+        """Compression and chunk layout of the output"""
+        pack_file(self.infile, self.outfile, dict(temp=Rescale(0.001, 10.0)),
+                  complevel=6, shuffle=False, compress_all=True,
+                  chunking='timeseries', chunksizes=dict(h=(5,)))
+        with Dataset(self.outfile) as f1:
+            temp = f1.variables['temp']
+            self.assertEqual(temp.filters()['complevel'], 6)
+            self.assertFalse(temp.filters()['shuffle'])
+            self.assertEqual(temp.chunking(), [5, 3, 20])
+            self.assertTrue(f1.variables['h'].filters()['zlib'])
+            self.assertEqual(f1.variables['h'].chunking(), [5])
+
+    def test_trim(self):
+        """Precision trimming keeps float and the fill value"""
+        pack_file(self.infile, self.outfile, dict(temp=Trim(digits=3)))
+        with Dataset(self.infile) as f0, Dataset(self.outfile) as f1:
+            v1 = f1.variables['temp']
+            self.assertEqual(v1.dtype, np.dtype('float32'))
+            self.assertEqual(v1.bitround_keepbits, 10)
+            self.assertTrue(v1.filters()['zlib'])
+            self.assertTrue(v1.filters()['shuffle'])
+            temp0 = f0.variables['temp'][:]
+            temp1 = v1[:]
+            self.assertTrue(np.ma.is_masked(temp1[0, 0, 0]))
+            error = np.abs(temp1 - temp0) / np.abs(temp0)
+            self.assertLessEqual(error.max(), 2.0**-11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from netCDF4 import Dataset
+
+from netcdf_utilities.float2int16 import Rescale
+from netcdf_utilities.float2int16_batch import Manifest, file_checksum
+from netcdf_utilities.float2int16_batch import output_name, pack_many
+
+
+def make_input(filename, nrec):
+    with Dataset(filename, mode='w', format='NETCDF3_CLASSIC') as fid:
+        fid.createDimension('ocean_time', None)
+        fid.createDimension('xi_rho', 100)
+        v = fid.createVariable('temp', 'f', ('ocean_time', 'xi_rho'))
+        v[:] = np.random.uniform(0, 20, (nrec, 100))
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outdir = os.path.join(self.tmpdir, 'packed')
+        self.infiles = []
+        for i in range(3):
+            infile = os.path.join(self.tmpdir, 'ocean_his_{:04d}.nc'.format(i))
+            make_input(infile, 10 * (i + 1))
+            self.infiles.append(infile)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_output_name(self):
+        self.assertEqual(output_name('a/b.nc'), 'a/b_int16.nc')
+        self.assertEqual(output_name('a/b.nc', outdir='c'), 'c/b.nc')
+
+    def test_resume(self):
+        options = dict(rescale_map=dict(temp=Rescale(0.001, 10.0)))
+        done, failed = pack_many(self.infiles, self.outdir, workers=2,
+                                 **options)
+        self.assertEqual(len(done), 3)
+        self.assertFalse(failed)
+
+        manifest = Manifest(os.path.join(self.outdir,
+                                         'float2int16_manifest.jsonl'))
+        for infile in self.infiles:
+            outfile = output_name(infile, self.outdir)
+            self.assertTrue(manifest.is_done(infile, outfile))
+            self.assertEqual(manifest.entries[outfile]['md5'],
+                             file_checksum(outfile))
+
+        # Rerun only redoes the missing output
+        os.remove(output_name(self.infiles[1], self.outdir))
+        done, failed = pack_many(self.infiles, self.outdir, workers=2,
+                                 **options)
+        self.assertEqual([e['infile'] for e in done], [self.infiles[1]])
+
+    def test_failure(self):
+        """A bad file is reported and not recorded"""
+        bad = os.path.join(self.tmpdir, 'bad.nc')
+        with open(bad, 'w') as fid:
+            fid.write('not netCDF')
+        done, failed = pack_many(self.infiles + [bad], self.outdir)
+        self.assertEqual(len(done), 3)
+        self.assertEqual([f[0] for f in failed], [bad])
+
+    def test_missing(self):
+        """A missing file is a failure, not the end of the batch"""
+        missing = os.path.join(self.tmpdir, 'missing.nc')
+        done, failed = pack_many(self.infiles + [missing], self.outdir)
+        self.assertEqual(len(done), 3)
+        self.assertEqual([f[0] for f in failed], [missing])
+
+    def test_duplicates(self):
+        """A file given twice is converted once"""
+        infile = self.infiles[0]
+        again = os.path.join(os.path.dirname(infile), '.',
+                             os.path.basename(infile))
+        done, failed = pack_many([infile, again], self.outdir)
+        self.assertEqual([e['infile'] for e in done], [infile])
+        self.assertFalse(failed)
+
+    def test_overwrite_input(self):
+        """The output directory may not hold the input file"""
+        infile = self.infiles[0]
+        with open(infile, 'rb') as fid:
+            data = fid.read()
+        done, failed = pack_many([infile], self.tmpdir)
+        self.assertFalse(done)
+        self.assertEqual([f[0] for f in failed], [infile])
+        with open(infile, 'rb') as fid:
+            self.assertEqual(fid.read(), data)
+
+    def test_same_output(self):
+        """Input files with the same output file are failures"""
+        subdir = os.path.join(self.tmpdir, 'sub')
+        os.mkdir(subdir)
+        other = os.path.join(subdir, os.path.basename(self.infiles[0]))
+        make_input(other, 5)
+        done, failed = pack_many(self.infiles + [other], self.outdir)
+        self.assertEqual(sorted(e['infile'] for e in done), self.infiles[1:])
+        self.assertEqual([f[0] for f in failed], [self.infiles[0], other])
+
+
+if __name__ == '__main__':
+    unittest.main()
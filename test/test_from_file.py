@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shutil
+import tempfile
 import unittest
 import subprocess
 import filecmp
 import codecs
 
+import numpy as np
+from netCDF4 import Dataset
+
 from netcdf_utilities.ncstructure import NCstructure
 
 
@@ -34,5 +39,52 @@ class TestFromFile(unittest.TestCase):
         os.remove('test0.cdl')
         os.remove('mytest.cdl')
 
+
+class TestLazy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ncfile = os.path.join(self.tmpdir, 'lazy.nc')
+        with Dataset(self.ncfile, mode='w') as fid:
+            fid.createDimension('x', 3)
+            fid.title = 'Lazy'
+            for i in range(5):
+                v = fid.createVariable('v{}'.format(i), 'f', ('x',))
+                v.units = 'm'
+                v.index = np.int32(i)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lazy(self):
+        """Attributes are read at first access"""
+        nc = NCstructure.from_file(self.ncfile, lazy=True)
+        self.assertEqual(nc.attributes['title'].value, 'Lazy')
+        self.assertEqual(nc.variables['v0'].shape, ('x',))
+        self.assertFalse(nc.variables['v2'].isLoaded)
+        self.assertEqual(nc.variables['v2'].attributes['index'].value, [2])
+        self.assertTrue(nc.variables['v2'].isLoaded)
+        self.assertFalse(nc.variables['v3'].isLoaded)
+
+    def test_load_all(self):
+        nc = NCstructure.from_file(self.ncfile, lazy=True)
+        nc.renameVariable('v4', 'w')
+        nc.load_all()
+        eager = NCstructure.from_file(self.ncfile)
+        for var in nc.variables.values():
+            self.assertTrue(var.isLoaded)
+        self.assertEqual(nc.variables['w'].attributes['index'].value, [4])
+        self.assertEqual(list(nc.variables['v1'].attributes),
+                         list(eager.variables['v1'].attributes))
+
+    def test_lazy_rename(self):
+        """Attribute renames wait for the loading"""
+        nc = NCstructure.from_file(self.ncfile, lazy=True)
+        nc.rename_many({'units': 'unit', 'index': 'units'})
+        self.assertFalse(nc.variables['v0'].isLoaded)
+        self.assertEqual(list(nc.variables['v0'].attributes),
+                         ['unit', 'units'])
+
+
 if __name__ == '__main__':
     unittest.main()
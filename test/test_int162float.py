@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from netCDF4 import Dataset, default_fillvals
+
+from netcdf_utilities.packing import UNDEF, dequantize
+from netcdf_utilities.int162float import unpack_file
+
+
+class TestDequantize(unittest.TestCase):
+
+    def test_values(self):
+        packed = np.array([0, 1, -1, UNDEF], dtype='int16')
+        values = dequantize(packed, 0.5, 10.0, fill_values=(UNDEF,))
+        self.assertEqual(values.dtype, np.dtype('float32'))
+        self.assertEqual(list(values[:3]), [10.0, 10.5, 9.5])
+        self.assertTrue(np.isnan(values[3]))
+
+
+class TestUnpackFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.infile = os.path.join(self.tmpdir, 'packed.nc')
+        self.outfile = os.path.join(self.tmpdir, 'unpacked.nc')
+        with Dataset(self.infile, mode='w') as fid:
+            fid.createDimension('time', None)
+            fid.createDimension('x', 30)
+            fid.history = 'packed'
+            v = fid.createVariable('temp', 'i2', ('time', 'x'),
+                                   fill_value=UNDEF)
+            v.scale_factor = 0.001
+            v.add_offset = 10.0
+            v.valid_range = np.array([-10000, 10000], dtype='int16')
+            v.units = 'Celsius'
+            v.set_auto_maskandscale(False)
+            v[:] = np.random.randint(-10000, 10000, (4, 30))
+            v[0, 0] = UNDEF
+            v = fid.createVariable('x', 'd', ('x',))
+            v[:] = np.arange(30)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_unpack(self):
+        unpack_file(self.infile, self.outfile, workers=2, max_bytes=64)
+        with Dataset(self.infile) as f0, Dataset(self.outfile) as f1:
+            self.assertEqual(f1.history, 'packed')
+            v1 = f1.variables['temp']
+            self.assertEqual(v1.dtype, np.dtype('float32'))
+            self.assertEqual(v1.units, 'Celsius')
+            self.assertNotIn('scale_factor', v1.ncattrs())
+            self.assertEqual(v1._FillValue, np.float32(default_fillvals['f4']))
+            self.assertTrue(np.allclose(v1.valid_range, [0.0, 20.0]))
+            # Same as the library unpacking
+            temp0 = f0.variables['temp'][:]
+            temp1 = v1[:]
+            self.assertTrue(np.all(temp1.mask == temp0.mask))
+            self.assertTrue(np.allclose(temp1, temp0))
+            self.assertTrue(np.all(f1.variables['x'][:] == np.arange(30)))
+
+    def test_nan(self):
+        unpack_file(self.infile, self.outfile, nan=True, dtype='float64')
+        with Dataset(self.outfile) as f1:
+            v1 = f1.variables['temp']
+            v1.set_auto_maskandscale(False)
+            self.assertEqual(v1.dtype, np.dtype('float64'))
+            self.assertTrue(np.isnan(v1[0, 0]))
+            self.assertEqual(np.isnan(v1[:]).sum(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from netCDF4 import Dataset
+
+from netcdf_utilities import ncdate
+from netcdf_utilities.ncdate import (find_time_variable, find_records,
+                                     date_records, date_values, main,
+                                     time_span, time_spans, print_spans)
+
+
+def make_file(filename, times, calendar=None,
+              units='hours since 2000-01-01'):
+    with Dataset(filename, mode='w', format='NETCDF3_CLASSIC') as fid:
+        fid.createDimension('time', None)
+        fid.createDimension('x', 2)
+        v = fid.createVariable('time', 'd', ('time',))
+        v.units = units
+        if calendar is not None:
+            v.calendar = calendar
+        v[:] = times
+        fid.createVariable('x', 'd', ('x',))
+
+
+class TestRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ncfile = os.path.join(self.tmpdir, 'time.nc')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_records(self):
+        times = np.array([0.0, 6.0, 12.0, 12.0, 18.0])
+        self.assertEqual(list(find_records(times, 12.0)), [2, 3])
+        self.assertEqual(list(find_records(times, 5.0, 12.0)), [1, 2, 3])
+        self.assertEqual(list(find_records(times, 7.0)), [])
+        # Not increasing
+        times = np.array([18.0, 0.0, 12.0])
+        self.assertEqual(list(find_records(times, 0.0, 12.0)), [1, 2])
+
+    def test_date_records(self):
+        make_file(self.ncfile, 6.0 * np.arange(4 * 365))
+        with Dataset(self.ncfile) as fid:
+            tvar = find_time_variable(fid)
+            self.assertEqual(list(date_records(tvar, '2000-01-02T06')),
+                             [5])
+            self.assertEqual(list(date_records(tvar, '2000-02-01',
+                                               '2000-02-02 03:00')),
+                             [124, 125, 126, 127, 128])
+
+    def test_calendar(self):
+        make_file(self.ncfile, 24.0 * np.arange(400), calendar='360_day')
+        with Dataset(self.ncfile) as fid:
+            tvar = find_time_variable(fid)
+            self.assertEqual(list(date_records(tvar, '2001-01-01')), [360])
+
+    def test_date_values(self):
+        units = 'hours since 2000-01-01 00:00 +01:00'
+        self.assertEqual(list(date_values(['2000-01-03'], units)), [49.0])
+        self.assertEqual(list(date_values(['2000-01-01', '2000-01-02T06'],
+                                          units)), [1.0, 31.0])
+        self.assertEqual(list(date_values(['2000-02-01'],
+                                          'days since 2000-01-01',
+                                          '360_day')), [30.0])
+        self.assertEqual(list(date_values(['2000-01-01T00:00:02'],
+                                          'milliseconds since 2000-01-01')),
+                         [2000.0])
+
+    def test_milliseconds(self):
+        make_file(self.ncfile, 500.0 * np.arange(10),
+                  units='milliseconds since 2000-01-01')
+        with Dataset(self.ncfile) as fid:
+            tvar = find_time_variable(fid)
+            self.assertEqual(list(date_records(tvar, '2000-01-01T00:00:01',
+                                               '2000-01-01T00:00:02')),
+                             [2, 3, 4])
+        self.assertEqual(main(['-d', '2000-01-01T00:00:03', self.ncfile]), 0)
+
+    def test_time_variable(self):
+        make_file(self.ncfile, [0.0])
+        with Dataset(self.ncfile) as fid:
+            self.assertRaises(ValueError, find_time_variable, fid, 'x')
+            self.assertRaises(ValueError, find_time_variable, fid, 'y')
+
+    def test_main(self):
+        make_file(self.ncfile, 6.0 * np.arange(10))
+        self.assertEqual(main([self.ncfile, '-r', '-1']), 0)
+        self.assertEqual(main([self.ncfile, '-d', '2000-01-02']), 0)
+        self.assertEqual(main([self.ncfile, '-d', '2001-01-02']), 1)
+        self.assertEqual(main(['-d', '2000-01-01T06', self.ncfile]), 0)
+        self.assertEqual(main(['-d', '2000-01-01T06', '--to', '2000-01-02',
+                               self.ncfile]), 0)
+        self.assertEqual(main(['-d', '2000-01-01T07', '--to',
+                               '2000-01-01T08', self.ncfile]), 1)
+        self.assertRaises(SystemExit, main, ['--to', '2000-01-02',
+                                             self.ncfile])
+        self.assertEqual(main([self.ncfile, '-r', '10']), 1)
+        self.assertEqual(main([self.ncfile, '-t', 'x']), 1)
+
+
+class TestSummary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(4):
+            filename = os.path.join(self.tmpdir, 'day{}.nc'.format(i))
+            make_file(filename, 24 * i + 6.0 * np.arange(4))
+            self.files.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_time_span(self):
+        start, end, nrecords, step = time_span(self.files[1])
+        self.assertEqual(str(start), '2000-01-02 00:00:00')
+        self.assertEqual(str(end), '2000-01-02 18:00:00')
+        self.assertEqual(nrecords, 4)
+        self.assertEqual(step, '6 hours')
+
+    def test_schema_cache(self):
+        ncdate._time_variables.clear()
+        time_span(self.files[0])
+        time_span(self.files[1])
+        self.assertEqual(list(ncdate._time_variables.values()), ['time'])
+
+        # Same names, but a second time variable
+        with Dataset(self.files[2], mode='a') as fid:
+            fid.variables['x'].units = 'days since 2000-01-01'
+        self.assertRaises(ValueError, time_span, self.files[2])
+
+    def test_time_spans(self):
+        empty = os.path.join(self.tmpdir, 'empty.nc')
+        make_file(empty, [])
+        missing = os.path.join(self.tmpdir, 'missing.nc')
+        for workers in 1, 2:
+            spans = time_spans(self.files + [empty, missing],
+                               workers=workers)
+            self.assertEqual([span[0] for span in spans],
+                             self.files + [empty, missing])
+            self.assertEqual([str(span[1][0]) for span in spans[:4]],
+                             ['2000-01-0{} 00:00:00'.format(i + 1)
+                              for i in range(4)])
+            self.assertEqual(spans[4][1], (None, None, 0, None))
+            self.assertIsNone(spans[5][1])
+            self.assertIsNotNone(spans[5][2])
+
+        out = io.StringIO()
+        print_spans(spans, out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['file', 'start', 'end', 'records', 'step'])
+        self.assertTrue(lines[1].endswith('4  6 hours'))
+        self.assertIn('ERROR', lines[6])
+
+    def test_main(self):
+        self.assertEqual(main(['-j', '1', self.tmpdir]), 0)
+        self.assertEqual(main(['-s', self.files[0]]), 0)
+        self.assertRaises(SystemExit, main, ['-s', '-r', '1', self.files[0]])
+        self.assertRaises(SystemExit, main, ['-d', '2000-01-01',
+                                             self.tmpdir])
+
+
+if __name__ == '__main__':
+    unittest.main()
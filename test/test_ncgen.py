@@ -1,33 +1,231 @@
 # -*- coding: utf-8 -*-
 
+import io
 import os
+import sys
+import shutil
+import tempfile
 # import unittest
 import subprocess
 # import filecmp
 # import codecs
 
+import numpy as np
+from netCDF4 import Dataset
+
 from netcdf_utilities.ncstructure import NCstructure
-from netcdf_utilities.ncgen import ncgen
+from netcdf_utilities.ncgen import ncgen, DefinitionCache
 
 def test_ncgen():
 
-    ncstruc = NCstructure.from_CDL('test.cdl')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        shutil.copy('test.cdl', tmpdir)
+        ncstruc = NCstructure.from_CDL('test.cdl')
+
+        with open(os.path.join(tmpdir, 'a.py'), mode='w') as f:
+            ncgen(ncstruc, f)
+
+        # Use a.py to generate a.nc
+        subprocess.check_call([sys.executable, 'a.py'], cwd=tmpdir)
+        os.rename(os.path.join(tmpdir, 'test.nc'),
+                  os.path.join(tmpdir, 'a.nc'))
+
+        # Generate test.nc directly from test.cdl
+        subprocess.check_call(['ncgen', '-b', 'test.cdl'], cwd=tmpdir)
+
+        # Check that the files are identical
+        return_code = subprocess.call(['cmp', 'a.nc', 'test.nc'], cwd=tmpdir)
+        assert(return_code == 0)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_definition_cache():
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = DefinitionCache(maxsize=2)
+        ncstruc = NCstructure.from_CDL('test.cdl')
+
+        for i in range(3):
+            filename = os.path.join(tmpdir, 'a{}.nc'.format(i))
+            cache.create(ncstruc, filename).close()
+        assert (cache.hits, cache.misses) == (2, 1)
+
+        with Dataset(filename) as fid:
+            assert list(fid.dimensions) == ['time', 'X']
+            assert fid.variables['A']._FillValue == -99
+            assert fid.type == 'Handwritten input for testing'
+
+        # A new attribute value is a new definition
+        other = NCstructure.from_CDL('test.cdl')
+        other.createAttribute('type', 'Other')
+        cache.function(other)
+        assert (cache.hits, cache.misses) == (2, 2)
+
+        # Least recently used is dropped
+        third = NCstructure.from_CDL('test.cdl')
+        third.deleteVariable('A')
+        cache.function(third)
+        cache.function(other)
+        cache.function(ncstruc)
+        assert len(cache) == 2
+        assert (cache.hits, cache.misses) == (3, 4)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_escaped_names():
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        ncstruc = NCstructure.from_CDL('test.cdl')
+        var = ncstruc.variables['A']
+        texts = ["Bj\u00f8rn's data", 'line 1\nline 2',
+                 "x'; print('INJECTED'); #"]
+        var.createAttribute('valid-min.x+y', 'text')
+        for i, text in enumerate(texts):
+            var.createAttribute('text{}'.format(i), text)
+        var.createAttribute('missing', np.array([np.nan, -np.inf], 'f4'))
+        ncstruc.createAttribute('title.global', texts[2])
+
+        filename = os.path.join(tmpdir, 'escaped.nc')
+        out = io.StringIO()
+        sys.stdout, stdout = out, sys.stdout
+        try:
+            DefinitionCache().create(ncstruc, filename).close()
+        finally:
+            sys.stdout = stdout
+        assert 'INJECTED' not in out.getvalue()
+
+        with Dataset(filename) as fid:
+            A = fid.variables['A']
+            assert A.getncattr('valid-min.x+y') == 'text'
+            for i, text in enumerate(texts):
+                assert A.getncattr('text{}'.format(i)) == text
+            assert np.isnan(A.missing[0]) and A.missing[1] == -np.inf
+            assert fid.getncattr('title.global') == texts[2]
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_attribute_order():
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = DefinitionCache()
+        orders = (['a', 'b'], ['b', 'a'])
+        for i, order in enumerate(orders):
+            ncstruc = NCstructure.from_CDL('test.cdl')
+            for name in order:
+                ncstruc.createAttribute(name, 'value')
+            filename = os.path.join(tmpdir, 'order{}.nc'.format(i))
+            cache.create(ncstruc, filename).close()
+            with Dataset(filename) as fid:
+                assert fid.ncattrs()[1:] == order
+        assert cache.misses == 2
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_source_storage():
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmpdir, 'source.nc')
+        with Dataset(source, mode='w', format='NETCDF4') as fid:
+            fid.createDimension('time', None)
+            fid.createDimension('x', 6)
+            fid.createVariable('temp', 'f4', ('time', 'x'), zlib=True,
+                               complevel=6, shuffle=False,
+                               chunksizes=(2, 3))
+            fid.createVariable('x', 'f8', ('x',), contiguous=True)
+            fid.createVariable('count', 'i4', ())
+
+        # Chunking and compression are taken from the structure
+        ncstruc = NCstructure.from_file(source)
+        script = os.path.join(tmpdir, 'define.py')
+        with io.open(script, mode='w', encoding='utf-8') as f:
+            ncgen(ncstruc, f)
+        copy = source + '.nc'   # Default file name of the script
+        subprocess.check_call([sys.executable, script])
+        with Dataset(copy) as f1:
+            temp = f1.variables['temp']
+            assert temp.chunking() == [2, 3]
+            assert temp.filters()['zlib']
+            assert temp.filters()['complevel'] == 6
+            assert not temp.filters()['shuffle']
+            assert f1.variables['x'].chunking() == 'contiguous'
+
+        # The arguments override the structure
+        with io.open(script, mode='w', encoding='utf-8') as f:
+            ncgen(ncstruc, f, chunking='map')
+        subprocess.check_call([sys.executable, script])
+        with Dataset(copy) as f1:
+            assert f1.variables['temp'].chunking() == [1, 6]
+            assert f1.variables['temp'].filters()['zlib']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+CDL = """netcdf fixture {
+dimensions:
+	time = UNLIMITED ; // (3 currently)
+	x = 4 ;
+variables:
+	float temp(time, x) ;
+		temp:_FillValue = -999.f ;
+	int count ;
+data:
+
+ temp =
+  1, 2, 3, 4,
+  5, 6, 7, 8,
+  9, 10, 11, _ ;
+
+ count = 12 ;
+}
+"""
+
 
-    with open('a.py', mode='w') as f:
-        ncgen(ncstruc, f)
+def test_ncgen_data():
 
-    # Use a.py to generate a.nc
-    subprocess.call(['python', 'a.py'])
-    os.rename('test.nc', 'a.nc')
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cdlfile = os.path.join(tmpdir, 'fixture.cdl')
+        with open(cdlfile, 'w') as fid:
+            fid.write(CDL)
+        source = os.path.join(tmpdir, 'source.nc')
+        NCstructure.from_CDL(cdlfile, data=True).to_file(source, format='NETCDF4')
 
-    # Generate test.nc directly from test.cdl
-    subprocess.call(['ncgen', '-b', 'test.cdl'])
+        # The format is taken from the source structure
+        ncstruc = NCstructure.from_file(source)
+        script = os.path.join(tmpdir, 'fill.py')
+        with io.open(script, mode='w', encoding='utf-8') as f:
+            ncgen(ncstruc, f, data=True, compression='zlib',
+                  chunking='map', block_bytes=32)
 
-    # Check that the files are identical
-    return_code = subprocess.call(['cmp', 'a.nc', 'test.nc'])
-    assert(return_code == 0)
+        # From a netCDF file, two records at a time
+        copy = os.path.join(tmpdir, 'copy.nc')
+        subprocess.check_call([sys.executable, script, source, copy])
+        with Dataset(source) as f0, Dataset(copy) as f1:
+            assert f1.data_model == 'NETCDF4'
+            temp = f1.variables['temp']
+            assert temp.filters()['zlib']
+            assert temp.chunking() == [1, 4]
+            assert (temp[:] == f0.variables['temp'][:]).all()
+            assert temp[:].mask[2, 3]
+            assert f1.variables['count'][...] == 12
 
-    # Clean up
-    os.unlink('a.py')
-    os.unlink('a.nc')
-    os.unlink('test.nc')
+        # From memory mapped arrays
+        npydir = os.path.join(tmpdir, 'arrays')
+        os.mkdir(npydir)
+        temp = np.arange(12, dtype='f4').reshape(3, 4)
+        np.save(os.path.join(npydir, 'temp.npy'), temp)
+        subprocess.check_call([sys.executable, script, npydir, copy])
+        with Dataset(copy) as f1:
+            assert (f1.variables['temp'][:] == temp).all()
+            assert f1.variables['count'][...].mask
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from netCDF4 import Dataset
+
+from netcdf_utilities.ncheader import classic_header
+from netcdf_utilities.ncstructure import NCstructure
+
+
+def make_file(filename, format):
+    with Dataset(filename, mode='w', format=format) as fid:
+        fid.createDimension('time', None)
+        fid.createDimension('x', 5)
+        fid.createDimension('n', 7)
+        fid.title = 'Header test'
+        fid.version = np.int16(3)
+        v = fid.createVariable('time', 'd', ('time',))
+        v.units = 'days since 2000-01-01'
+        v[:] = np.arange(4)
+        v = fid.createVariable('temp', 'f', ('time', 'x'), fill_value=-1.0)
+        v.valid_range = np.array([-2, 40], dtype='float32')
+        v.flags = np.array([1, -2, 3], dtype='int8')
+        v.table = np.linspace(0, 1, 11)
+        v = fid.createVariable('name', 'S1', ('x', 'n'))
+        v.long_name = 'station name'
+        fid.createVariable('count', 'i4', ())
+
+
+class TestHeader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ncfile = os.path.join(self.tmpdir, 'header.nc')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_header(self, format, block_size=8192):
+        make_file(self.ncfile, format)
+        location, dimensions, variables, attributes = \
+            classic_header(self.ncfile, block_size)
+        self.assertEqual(dimensions, [('time', 4, True), ('x', 5, False),
+                                      ('n', 7, False)])
+        self.assertEqual(variables, [('time', 'double', ('time',)),
+                                     ('temp', 'float', ('time', 'x')),
+                                     ('name', 'char', ('x', 'n')),
+                                     ('count', 'int', ())])
+        with Dataset(self.ncfile) as fid:
+            for name in [None] + list(fid.variables):
+                obj = fid if name is None else fid.variables[name]
+                atts = attributes[name]
+                self.assertEqual([att[1] for att in atts], obj.ncattrs())
+                for var, attname, value in atts:
+                    expected = getattr(obj, attname)
+                    if isinstance(value, str):
+                        self.assertEqual(value, expected)
+                    else:
+                        expected = np.atleast_1d(expected)
+                        self.assertEqual(value.dtype, expected.dtype)
+                        self.assertTrue(np.all(value == expected))
+
+    def test_classic(self):
+        self.check_header('NETCDF3_CLASSIC')
+
+    def test_64bit_offset(self):
+        self.check_header('NETCDF3_64BIT_OFFSET')
+
+    def test_64bit_data(self):
+        self.check_header('NETCDF3_64BIT_DATA')
+
+    def test_long_header(self):
+        """Header longer than the first read"""
+        self.check_header('NETCDF3_CLASSIC', block_size=64)
+
+    def test_format(self):
+        for format in ['NETCDF3_CLASSIC', 'NETCDF3_64BIT_OFFSET',
+                       'NETCDF3_64BIT_DATA', 'NETCDF4_CLASSIC']:
+            make_file(self.ncfile, format)
+            self.assertEqual(NCstructure.from_file(self.ncfile).format,
+                             format)
+
+    def test_netcdf4(self):
+        """Not a classic file"""
+        make_file(self.ncfile, 'NETCDF4')
+        self.assertIsNone(classic_header(self.ncfile))
+
+    def test_from_file(self):
+        """Same structure by the header reader and the library"""
+        make_file(self.ncfile, 'NETCDF3_CLASSIC')
+        nc3 = NCstructure.from_file(self.ncfile)
+        nc4file = os.path.join(self.tmpdir, 'header4.nc')
+        make_file(nc4file, 'NETCDF4_CLASSIC')
+        nc4 = NCstructure.from_file(nc4file)
+        for name, var in nc4.variables.items():
+            self.assertEqual(nc3.variables[name].nctype, var.nctype)
+            self.assertEqual(list(nc3.variables[name].attributes),
+                             list(var.attributes))
+        self.assertEqual(nc3.dimensions['time'].length, 4)
+
+    def test_latin1(self):
+        """Text attributes that are not UTF-8, as read by netCDF4"""
+        with Dataset(self.ncfile, mode='w', format='NETCDF3_CLASSIC') as fid:
+            fid.title = 'Bjorn'
+            fid.note = 'ab..cd..'
+        with open(self.ncfile, 'rb') as fid:
+            data = fid.read()
+        data = data.replace(b'Bjorn', b'Bj\xf8rn')
+        data = data.replace(b'ab..cd..', b'ab\x00\x00cd\x00\x00')
+        with open(self.ncfile, 'wb') as fid:
+            fid.write(data)
+        attributes = classic_header(self.ncfile)[3][None]
+        with Dataset(self.ncfile) as fid:
+            self.assertEqual([att[2] for att in attributes],
+                             [fid.title, fid.note])
+        nc = NCstructure.from_file(self.ncfile)
+        self.assertEqual(nc.attributes['title'].value, 'Bj\ufffdrn')
+        self.assertEqual(nc.attributes['note'].value, 'abcd')
+
+
+if __name__ == '__main__':
+    unittest.main()
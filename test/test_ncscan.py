@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from netCDF4 import Dataset
+
+from netcdf_utilities.ncscan import StructureCache, find_files, scan
+from netcdf_utilities.ncscan import group_by_schema
+
+
+def make_file(filename, varname):
+    with Dataset(filename, mode='w', format='NETCDF3_CLASSIC') as fid:
+        fid.createDimension('x', 3)
+        v = fid.createVariable(varname, 'f', ('x',))
+        v.units = 'm'
+
+
+class TestScan(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.datadir = os.path.join(self.tmpdir, 'archive')
+        os.makedirs(os.path.join(self.datadir, 'sub'))
+        self.files = [os.path.join(self.datadir, 'a.nc'),
+                      os.path.join(self.datadir, 'sub', 'b.nc')]
+        for filename, varname in zip(self.files, ['u', 'v']):
+            make_file(filename, varname)
+        self.cachefile = os.path.join(self.tmpdir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find_files(self):
+        self.assertEqual(list(find_files([self.datadir])), self.files)
+
+    def test_scan(self):
+        structures, failed = scan([self.datadir], workers=2)
+        self.assertFalse(failed)
+        self.assertEqual(list(structures), self.files)
+        nc = structures[self.files[1]]
+        self.assertEqual(nc.variables['v'].attributes['units'].value, 'm')
+
+    def test_cache(self):
+        """Unchanged files are taken from the cache"""
+        scan([self.datadir], workers=2, cache=self.cachefile)
+
+        # Same size and time, not reopened
+        a = self.files[0]
+        st = os.stat(a)
+        make_file(a, 'w')
+        os.utime(a, (st.st_atime, st.st_mtime))
+        structures, failed = scan([self.datadir], cache=self.cachefile)
+        self.assertIn('u', structures[a].variables)
+
+        # Changed time, reopened
+        os.utime(a, (st.st_atime, st.st_mtime + 10))
+        with StructureCache(self.cachefile) as cache:
+            structures, failed = scan([self.datadir], cache=cache)
+        self.assertIn('w', structures[a].variables)
+
+    def test_group(self):
+        c = os.path.join(self.datadir, 'c.nc')
+        make_file(c, 'u')
+        structures, failed = scan([self.datadir], workers=2)
+        groups = group_by_schema(structures)
+        self.assertEqual(list(groups.values()), [[self.files[0], c],
+                                                 [self.files[1]]])
+
+    def test_failure(self):
+        bad = os.path.join(self.datadir, 'bad.nc')
+        with open(bad, 'w') as fid:
+            fid.write('not netCDF')
+        structures, failed = scan([self.datadir], cache=self.cachefile)
+        self.assertEqual(len(structures), 2)
+        self.assertEqual([f[0] for f in failed], [bad])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import numpy as np
+
+from netcdf_utilities.packing import UNDEF, chunk_slices, quantize, quantizer
+from netcdf_utilities.packing import chunk_grid_slices
+from netcdf_utilities.packing import variable_tasks, make_executor, convert
+from netcdf_utilities.packing import MAXPACKED, RangeStatistics, auto_rescale
+from netcdf_utilities.packing import packed_limits
+from netcdf_utilities.packing import choose_chunksizes, Trim, bitround
+
+
+class TestChunkSlices(unittest.TestCase):
+    """Testing the chunk_slices function"""
+
+    def test_cover(self):
+        """The chunks cover the array exactly once, within budget"""
+        shape = (3, 5, 7, 11)
+        count = np.zeros(shape, dtype='int32')
+        for index in chunk_slices(shape, 4, max_bytes=200):
+            count[index] += 1
+            self.assertLessEqual(count[index].size * 4, 200)
+        self.assertTrue(np.all(count == 1))
+
+    def test_whole(self):
+        """Small arrays are a single chunk"""
+        chunks = list(chunk_slices((10, 20), 8, max_bytes=10000))
+        self.assertEqual(chunks, [(slice(0, 10),)])
+
+    def test_scalar(self):
+        self.assertEqual(list(chunk_slices((), 8)), [()])
+
+    def test_empty_record(self):
+        """No records gives no chunks"""
+        self.assertEqual(list(chunk_slices((0, 10), 4, max_bytes=8)), [])
+
+    def test_empty_inner(self):
+        """A zero length inner dimension gives no chunks"""
+        self.assertEqual(list(chunk_slices((5, 0), 4)), [])
+
+    def test_large_element(self):
+        """A row larger than the budget is split along the last axis"""
+        chunks = list(chunk_slices((2, 100), 8, max_bytes=1))
+        self.assertEqual(len(chunks), 200)
+
+
+class TestChunkGridSlices(unittest.TestCase):
+    """Testing the chunk_grid_slices function"""
+
+    def test_whole_chunks(self):
+        """The tiles are blocks of whole storage chunks"""
+        shape, chunks = (10, 3, 20), (10, 1, 2)
+        covered = np.zeros(shape, dtype=int)
+        for index in chunk_grid_slices(shape, chunks, 4, max_bytes=400):
+            covered[index] += 1
+            for s, c, n in zip(index, chunks, shape):
+                self.assertEqual(s.start % c, 0)
+                self.assertTrue(s.stop == n or (s.stop - s.start) % c == 0)
+        self.assertTrue(np.all(covered == 1))
+
+    def test_grow(self):
+        """Record chunks are grouped up to the budget"""
+        tiles = list(chunk_grid_slices((5, 3, 20), (1, 3, 20), 4,
+                                       max_bytes=500))
+        self.assertEqual([t[0] for t in tiles],
+                         [slice(0, 2), slice(2, 4), slice(4, 5)])
+
+    def test_empty(self):
+        self.assertEqual(list(chunk_grid_slices((0, 10), (1, 10), 4)), [])
+
+
+class TestChooseChunksizes(unittest.TestCase):
+    """Testing the choose_chunksizes function"""
+
+    def test_map(self):
+        chunks = choose_chunksizes((100, 40, 200, 300), 2, 'map',
+                                   target_bytes=2**20)
+        self.assertEqual(chunks[0], 1)
+        self.assertLessEqual(np.prod(chunks) * 2, 2**20)
+        self.assertEqual(choose_chunksizes((100, 20, 30), 4, 'map'),
+                         (1, 20, 30))
+
+    def test_timeseries(self):
+        chunks = choose_chunksizes((100, 40, 200, 300), 2, 'timeseries',
+                                   target_bytes=2**16)
+        self.assertEqual(chunks[0], 100)
+        self.assertLessEqual(np.prod(chunks) * 2, 2**16)
+        self.assertGreater(np.prod(chunks) * 2, 2**15)
+
+    def test_nonrecord(self):
+        chunks = choose_chunksizes((200, 300), 8, 'timeseries', record=False,
+                                   target_bytes=2**16)
+        self.assertLessEqual(np.prod(chunks) * 8, 2**16)
+        self.assertEqual(choose_chunksizes((), 8), None)
+
+
+class TestQuantize(unittest.TestCase):
+    """Testing the quantize function"""
+
+    def test_values(self):
+        values = np.array([10.0, 10.0014, 9.9986], dtype='float32')
+        packed = quantize(values, 0.001, 10.0)
+        self.assertEqual(packed.dtype, np.dtype('int16'))
+        self.assertEqual(list(packed), [0, 1, -1])
+
+    def test_undefined(self):
+        """Out of range and NaN values become UNDEF"""
+        values = np.array([1.0e37, -1.0e37, np.nan, 0.0])
+        packed = quantize(values, 0.01, 0.0)
+        self.assertEqual(list(packed), [UNDEF, UNDEF, UNDEF, 0])
+
+    def test_buffers(self):
+        """Given buffers are used, the input is not modified"""
+        values = np.random.uniform(-40, 40, (4, 50)).astype('float32')
+        values[0, 0] = np.nan
+        original = values.copy()
+        work = np.empty(values.shape, dtype='float32')
+        mask = np.empty(values.shape, dtype=bool)
+        out = np.empty(values.shape, dtype='int16')
+        packed = quantize(values, 0.001, 0.0, out=out, work=work, mask=mask)
+        self.assertIs(packed, out)
+        self.assertTrue(np.array_equal(values, original, equal_nan=True))
+        # Same result as the straightforward formula
+        expected = (values - 0.0) / 0.001
+        expected[~(np.abs(expected) <= abs(UNDEF))] = UNDEF
+        expected = np.round(expected).astype('int16')
+        self.assertTrue(np.all(packed == expected))
+
+    def test_quantizer(self):
+        """The reused work buffers give the same result for new shapes"""
+        transform = quantizer(0.01, 5.0)
+        for shape in [(10, 10), (3,), (20, 20), ()]:
+            values = np.random.uniform(0, 10, shape)
+            self.assertTrue(np.all(transform(values) ==
+                                   quantize(values, 0.01, 5.0)))
+
+
+class TestBitround(unittest.TestCase):
+    """Testing the precision trimming"""
+
+    def test_keepbits(self):
+        self.assertEqual(Trim(digits=3).keepbits(), 10)
+        self.assertEqual(Trim(rel_error=0.001).keepbits(), 9)
+        with self.assertRaises(ValueError):
+            Trim()
+
+    def test_error(self):
+        """The relative error is within the bound"""
+        for dtype in ['float32', 'float64']:
+            values = np.random.lognormal(0, 5, 10000).astype(dtype)
+            for keepbits in [2, 7, 15]:
+                rounded = bitround(values, keepbits)
+                error = np.abs(rounded - values) / values
+                self.assertLessEqual(error.max(), 2.0**-(keepbits + 1))
+                # The low bits are zero
+                utype = 'uint32' if dtype == 'float32' else 'uint64'
+                nbits = 23 if dtype == 'float32' else 52
+                low = rounded.view(utype) & ((1 << (nbits-keepbits)) - 1)
+                self.assertFalse(np.any(low))
+
+    def test_special(self):
+        """NaN, infinity and fill values are kept"""
+        values = np.array([np.nan, np.inf, 1.0e37, 1.1], dtype='float32')
+        rounded = bitround(values, 3, fill_values=[np.float32(1.0e37)])
+        self.assertTrue(np.isnan(rounded[0]))
+        self.assertEqual(list(rounded[1:]),
+                         [np.inf, np.float32(1.0e37), 1.125])
+
+    def test_ties(self):
+        """Ties are rounded to even"""
+        values = np.array([1.0 + 2**-4, 1.0 + 3 * 2**-4], dtype='float32')
+        self.assertEqual(list(bitround(values, 3)), [1.0, 1.25])
+
+
+class TestAutoRescale(unittest.TestCase):
+    """Testing the derivation of packing parameters"""
+
+    def test_range(self):
+        stats = RangeStatistics(fill_values=np.array([1.0e37]))
+        stats.update(np.array([1.0, np.nan, 1.0e37]))
+        stats.update(np.array([[-3.0, 2.0], [0.0, 1.0e37]]))
+        self.assertEqual(stats.range(), (-3.0, 2.0))
+
+    def test_outside(self):
+        """Values outside the limits are counted, fill values are not"""
+        stats = RangeStatistics(fill_values=np.array([1.0e37]),
+                                limits=(0.0, 10.0))
+        stats.update(np.array([-1.0, 5.0, 1.0e37, 11.0, 12.0]))
+        self.assertEqual(stats.outside, 3)
+
+    def test_packed_limits(self):
+        """packed_limits bounds the values packed without UNDEF"""
+        scale_factor, add_offset = auto_rescale(0.0, 10.0)
+        low, high = packed_limits(scale_factor, add_offset)
+        values = np.array([low + 1.0e-6, high - 1.0e-6, low - 1.0e-3,
+                           high + 1.0e-3])
+        packed = quantize(values, scale_factor, add_offset)
+        self.assertEqual(list(packed == UNDEF), [False, False, True, True])
+
+    def test_no_values(self):
+        stats = RangeStatistics()
+        stats.update(np.array([np.nan]))
+        self.assertEqual(stats.range(), None)
+
+    def test_quantiles(self):
+        stats = RangeStatistics(quantiles=(0.01, 0.99), sample_size=1000)
+        for i in range(10):
+            stats.update(np.arange(1000.0*i, 1000.0*(i+1)))
+        vmin, vmax = stats.range()
+        self.assertAlmostEqual(vmin, 100, delta=20)
+        self.assertAlmostEqual(vmax, 9900, delta=20)
+
+    def test_rescale(self):
+        """The range is packed without undefined values"""
+        scale_factor, add_offset = auto_rescale(-2.0, 30.0)
+        values = np.linspace(-2.0, 30.0, 1001)
+        packed = quantize(values, scale_factor, add_offset)
+        self.assertEqual(packed.min(), -MAXPACKED)
+        self.assertEqual(packed.max(), MAXPACKED)
+        self.assertNotIn(UNDEF, packed)
+
+
+class TestConvert(unittest.TestCase):
+    """Testing the conversion pipeline"""
+
+    def setUp(self):
+        self.source = np.random.uniform(-1, 1, (6, 10, 12))
+        self.expected = quantize(self.source, 0.001, 0.0)
+
+    def check(self, executor):
+        target = np.zeros(self.source.shape, dtype='int16')
+        tasks = variable_tasks(self.source, target,
+                               quantizer(0.001, 0.0), max_bytes=300)
+        convert(tasks, executor, max_pending=3)
+        self.assertTrue(np.all(target == self.expected))
+
+    def test_serial(self):
+        self.check(make_executor(1))
+
+    def test_threads(self):
+        executor = make_executor(3)
+        self.check(executor)
+        executor.shutdown()
+
+    def test_processes(self):
+        executor = make_executor(2, processes=True)
+        self.check(executor)
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
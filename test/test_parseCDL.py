@@ -5,7 +5,8 @@ import unittest
 import numpy as np
 from netcdf_utilities.parse_CDL import parse_dimension, parse_variable
 from netcdf_utilities.parse_CDL import parse_attribute
-from netcdf_utilities.parse_CDL import join_lines, split_lines
+from netcdf_utilities.parse_CDL import tokenize, cdl_events, parse_CDL
+from netcdf_utilities.parse_CDL import data_value
 
 
 class TestParseDimension(unittest.TestCase):
@@ -111,27 +112,179 @@ class TestParseAttribute(unittest.TestCase):
         self.assertTrue(np.alltrue(value == np.array([1., 2e16, -4.2e11])))
 
 
-class TestLineHandling(unittest.TestCase):
-
-    def test_join(self):
-        lines = ['This is the first line',
-                 'logically it continues and ends here;',
-                 'This is the second logical line;']
-        log_lines = join_lines(lines)
-        line = next(log_lines)
-        expected = " ".join([lines[0], lines[1].rstrip(';')])
-        self.assertEqual(line, expected)
-        line = next(log_lines)
-        expected = lines[2].rstrip(';')
-        self.assertEqual(line, expected)
-
-    def test_split(self):
-        double_line = 'First line; Second line'
-        log_lines = split_lines([double_line])
-        line = next(log_lines)
-        self.assertEqual(line, 'First line')
-        line = next(log_lines)
-        self.assertEqual(line, ' Second line')
+    def test_suffixes(self):
+        """All CDL type suffixes"""
+        for line, dtype in [(':a = 1b, -2', 'int8'),
+                            (':a = 200ub', 'uint8'),
+                            (':a = 3us', 'uint16'),
+                            (':a = 2L', 'int32'),
+                            (':a = 7u', 'uint32'),
+                            (':a = 5ll', 'int64'),
+                            (':a = 5ull', 'uint64'),
+                            (':a = 1d, 2', 'float64'),
+                            (':a = NaNf, 1', 'float32')]:
+            var, name, value = parse_attribute(line)
+            self.assertEqual(value.dtype, np.dtype(dtype), line)
+
+    def test_mixed(self):
+        """The widest type of the values"""
+        for line, dtype, expected in [(':a = 1, 2.5', 'float64', [1, 2.5]),
+                                      (':a = 2.5, 1', 'float64', [2.5, 1]),
+                                      (':a = 1b, 300s', 'int16', [1, 300]),
+                                      (':a = 1s, 2.5f', 'float32', [1, 2.5]),
+                                      (':a = 1s, 2.5', 'float64', [1, 2.5]),
+                                      (':a = 1, 2e3', 'float64', [1, 2000])]:
+            var, name, value = parse_attribute(line)
+            self.assertEqual(value.dtype, np.dtype(dtype), line)
+            self.assertEqual(list(value), expected, line)
+
+    def test_typed(self):
+        """The type of the declaration overrides the values"""
+        var, name, value = parse_attribute('double var:a = 1, 2')
+        self.assertEqual(value.dtype, np.dtype('float64'))
+        self.assertEqual(list(value), [1.0, 2.0])
+
+    def test_long(self):
+        """Long numeric attributes"""
+        values = np.linspace(-1, 1, 5000)
+        line = ':table = ' + ', '.join(repr(v) for v in values) + ' ;'
+        var, name, value = parse_attribute(line)
+        self.assertTrue(np.all(value == values))
+
+
+class TestTokenize(unittest.TestCase):
+    """Testing the tokenizer"""
+
+    def test_tokens(self):
+        lines = ['netcdf a { // comment',
+                 '  temp:units = "deg;C // not a comment" ;',
+                 'float u(t,x), v ;']
+        tokens = list(tokenize(lines))
+        self.assertEqual(tokens, ['netcdf', 'a', '{',
+                                  'temp', ':', 'units', '=',
+                                  '"deg;C // not a comment"', ';',
+                                  'float', 'u', '(', 't', ',', 'x', ')',
+                                  ',', 'v', ';'])
+
+    def test_string_colon(self):
+        """Colons and equal signs in strings are kept"""
+        line = 't:units = "seconds since 1970-01-01 00:00:00" ;'
+        var, name, value = parse_attribute(line)
+        self.assertEqual(value, 'seconds since 1970-01-01 00:00:00')
+        line = ':comment = "a = b;  c" ;'
+        var, name, value = parse_attribute(line)
+        self.assertEqual(value, 'a = b;  c')
+
+    def test_escapes(self):
+        line = ':quote = "say \\"hello\\"", " again" ;'
+        var, name, value = parse_attribute(line)
+        self.assertEqual(value, 'say "hello" again')
+
+
+class TestEvents(unittest.TestCase):
+    """Testing the event stream"""
+
+    def test_events(self):
+        lines = ['netcdf a {',
+                 'dimensions: x = 2, t = UNLIMITED ;',
+                 'variables:',
+                 '  float u(t, x), v(x) ; u:a = 1s ;',
+                 '  double :b = 2 ;',
+                 'data:',
+                 '  u = this is never parsed',
+                 '}']
+        events = list(cdl_events(iter(lines)))
+        self.assertEqual(events[:5], [('location', 'a'),
+                                      ('dimension', ('x', 2, False)),
+                                      ('dimension', ('t', 0, True)),
+                                      ('variable', ('u', 'float', ('t', 'x'))),
+                                      ('variable', ('v', 'float', ('x',)))])
+        kind, (var, name, value) = events[5]
+        self.assertEqual((kind, var, name), ('attribute', 'u', 'a'))
+        self.assertEqual(value.dtype, np.dtype('int16'))
+        kind, (var, name, value) = events[6]
+        self.assertEqual((var, name), (None, 'b'))
+        self.assertEqual(value.dtype, np.dtype('float64'))
+        self.assertEqual(len(events), 7)
+
+    def test_section_names(self):
+        """Variables named as sections have attributes"""
+        lines = ['netcdf a {',
+                 'dimensions:',
+                 '  x = 2 ;',
+                 'variables:',
+                 '  float data(x) ;',
+                 '    data:units = "m" ;',
+                 '  float variables(x) ;',
+                 '    variables:long_name="v" ;',
+                 '  float y(x) ;',
+                 '  :title = "t" ;',
+                 'data:',
+                 ' data = 1, 2 ;',
+                 '}']
+        events = list(cdl_events(iter(lines), data=True))
+        self.assertEqual([e[1][0] for e in events if e[0] == 'variable'],
+                         ['data', 'variables', 'y'])
+        self.assertEqual([e[1][:2] for e in events if e[0] == 'attribute'],
+                         [('data', 'units'), ('variables', 'long_name'),
+                          (None, 'title')])
+        self.assertEqual([e[1][0] for e in events if e[0] == 'data'],
+                         ['data'])
+
+    def test_parse_CDL(self):
+        location, dimensions, variables, attributes = parse_CDL('test.cdl')
+        self.assertEqual(location, 'test')
+        self.assertEqual(dimensions, [('time', 0, True), ('X', 4, False)])
+        self.assertEqual(variables, [('A', 'int', ('time', 'X'))])
+        self.assertEqual(len(attributes['A']), 10)
+        self.assertEqual(attributes[None][0][2],
+                         'Handwritten input for testing')
+
+
+class TestData(unittest.TestCase):
+    """Testing the data section"""
+
+    lines = ['netcdf a {',
+             'dimensions: t = UNLIMITED ; x = 3 ; n = 4 ;',
+             'variables:',
+             '  float u(t, x) ; u:_FillValue = -1.f ;',
+             '  short s ; char c(x, n) ; int i(t) ;',
+             'data:',
+             ' u = 1, 2, 3,',
+             '   4, _, 6 ; s = 5s ;  // comment',
+             ' c = "ab", "c;d", "" ;',
+             ' i = 1, _ ;',
+             '}']
+
+    def test_data_events(self):
+        events = [e for e in cdl_events(iter(self.lines), data=True)
+                  if e[0] == 'data']
+        self.assertEqual([e[1][0] for e in events], ['u', 's', 'c', 'i'])
+        data = dict(e[1] for e in events)
+        self.assertEqual(data['u'].dtype, np.dtype('float32'))
+        self.assertTrue(np.all(data['u'] == [[1, 2, 3], [4, -1, 6]]))
+        self.assertEqual(data['s'].shape, ())
+        self.assertEqual(data['s'].dtype, np.dtype('int16'))
+        self.assertEqual(data['c'].shape, (3, 4))
+        self.assertEqual(data['c'][1].tobytes(), b'c;d\0')
+        self.assertEqual(list(data['i']), [1, -2147483647])
+
+    def test_no_data(self):
+        """The data section is skipped by default"""
+        events = list(cdl_events(iter(self.lines)))
+        self.assertNotIn('data', [e[0] for e in events])
+
+    def test_values(self):
+        value = data_value('NaN, 1e20, -Infinity, 2.5d', 'double')
+        self.assertTrue(np.isnan(value[0]))
+        self.assertEqual(list(value[1:]), [1e20, -np.inf, 2.5])
+        value = data_value('1ub, 255ub', 'ubyte')
+        self.assertEqual(value.dtype, np.dtype('uint8'))
+        self.assertRaises(ValueError, data_value, '1, 2, x', 'int')
+
+    def test_shape_error(self):
+        lines = self.lines[:6] + [' s = 1, 2 ;', '}']
+        self.assertRaises(ValueError, list, cdl_events(iter(lines), True))
 
 
 if __name__ == '__main__':
@@ -88,5 +88,59 @@ class TestRenameAttribute(unittest.TestCase):
         var.renameAttribute('long_name', 'standard_name')
         self.assertEqual(var.attributes['standard_name'].name, 'standard_name')
 
+    def test_in_use(self):
+        struc = NCstructure('test')
+        struc.createAttribute('a', 'first')
+        struc.createAttribute('b', 'second')
+        with self.assertRaises(ValueError):
+            struc.renameAttribute('a', 'b')
+        self.assertEqual(list(struc.attributes), ['a', 'b'])
+
+
+class TestRenameMany(unittest.TestCase):
+
+    def setUp(self):
+        struc = NCstructure('test')
+        struc.createDimension('lon', 360)
+        struc.createDimension('lat', 180)
+        struc.createDimension('depth', 10)
+        var = struc.createVariable('lon', 'float', ('lon',))
+        var.createAttribute('long_name', 'longitude')
+        var = struc.createVariable('temp', 'float', ('depth', 'lat', 'lon'))
+        var.createAttribute('long_name', 'temperature')
+        var.createAttribute('unit', 'Celsius')
+        struc.createAttribute('source', 'model')
+        self.struc = struc
+
+    def test_rename_many(self):
+        struc = self.struc
+        struc.rename_many({'lon': 'longitude', 'lat': 'latitude',
+                           'temp': 'sea_water_temperature',
+                           'unit': 'units', 'source': 'history',
+                           'not_used': 'whatever'})
+        self.assertEqual(list(struc.dimensions),
+                         ['longitude', 'latitude', 'depth'])
+        self.assertEqual(list(struc.variables),
+                         ['longitude', 'sea_water_temperature'])
+        var = struc.variables['sea_water_temperature']
+        self.assertEqual(var.name, 'sea_water_temperature')
+        self.assertEqual(var.shape, ('depth', 'latitude', 'longitude'))
+        self.assertEqual(list(var.attributes), ['long_name', 'units'])
+        self.assertEqual(list(struc.attributes), ['history'])
+
+    def test_swap(self):
+        """Names are changed simultaneously"""
+        self.struc.rename_many({'lon': 'lat', 'lat': 'lon'})
+        self.assertEqual(list(self.struc.dimensions), ['lat', 'lon', 'depth'])
+        self.assertEqual(self.struc.dimensions['lon'].length, 180)
+        self.assertEqual(self.struc.variables['temp'].shape,
+                         ('depth', 'lon', 'lat'))
+
+    def test_in_use(self):
+        """Nothing is renamed if a new name is in use"""
+        with self.assertRaises(ValueError):
+            self.struc.rename_many({'lon': 'depth'})
+        self.assertEqual(list(self.struc.dimensions), ['lon', 'lat', 'depth'])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from netCDF4 import Dataset
+
+from netcdf_utilities.ncstructure import NCstructure
+
+CDL = """netcdf fixture {
+dimensions:
+	time = UNLIMITED ; // (2 currently)
+	x = 3 ;
+variables:
+	double time(time) ;
+		time:units = "days since 2000-01-01" ;
+	short temp(time, x) ;
+		temp:_FillValue = -32767s ;
+		temp:scale_factor = 0.01f ;
+	char name(x) ;
+
+// global attributes:
+		:title = "Fixture" ;
+data:
+
+ time = 0, 1 ;
+
+ temp =
+  1, 2, 3,
+  4, _, 6 ;
+
+ name = "abc" ;
+}
+"""
+
+
+class TestToFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cdlfile = os.path.join(self.tmpdir, 'fixture.cdl')
+        self.ncfile = os.path.join(self.tmpdir, 'fixture.nc')
+        with open(self.cdlfile, 'w') as fid:
+            fid.write(CDL)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_from_CDL_data(self):
+        nc = NCstructure.from_CDL(self.cdlfile, data=True)
+        self.assertEqual(nc.dimensions['time'].length, 2)
+        self.assertEqual(nc.variables['temp'].data.shape, (2, 3))
+        nc = NCstructure.from_CDL(self.cdlfile)
+        self.assertIsNone(nc.variables['temp'].data)
+        self.assertEqual(nc.dimensions['time'].length, 0)
+
+    def test_from_CDL_structure(self):
+        """Data as by ncdump -t is not read by default"""
+        with open(self.cdlfile, 'w') as fid:
+            fid.write('''netcdf dates {
+dimensions:
+	time = 2 ;
+variables:
+	double time(time) ;
+		time:units = "days since 2000-01-01" ;
+data:
+
+ time = "2000-01-01", "2000-01-02" ;
+}
+''')
+        nc = NCstructure.from_CDL(self.cdlfile)
+        self.assertEqual(nc.variables['time'].attributes['units'].value,
+                         'days since 2000-01-01')
+        self.assertIsNone(nc.variables['time'].data)
+
+    def test_to_file(self):
+        NCstructure.from_CDL(self.cdlfile, data=True).to_file(self.ncfile)
+        with Dataset(self.ncfile) as fid:
+            self.assertEqual(fid.title, 'Fixture')
+            self.assertTrue(fid.dimensions['time'].isunlimited())
+            self.assertEqual(list(fid.variables['time'][:]), [0.0, 1.0])
+            temp = fid.variables['temp']
+            self.assertEqual(temp.dtype, np.dtype('int16'))
+            self.assertEqual(temp._FillValue, -32767)
+            self.assertTrue(np.allclose(temp[0], [0.01, 0.02, 0.03]))
+            self.assertTrue(temp[:].mask[1, 1])
+            self.assertEqual(fid.variables['name'][:].tobytes(), b'abc')
+
+    def test_compression(self):
+        nc = NCstructure.from_CDL(self.cdlfile, data=True)
+        nc.to_file(self.ncfile, compression='zlib', complevel=6,
+                   chunking='map')
+        self.assertIn('_FillValue', nc.variables['temp'].attributes)
+        with Dataset(self.ncfile) as fid:
+            temp = fid.variables['temp']
+            filters = temp.filters()
+            self.assertTrue(filters['zlib'])
+            self.assertEqual(filters['complevel'], 6)
+            self.assertTrue(filters['shuffle'])
+            self.assertEqual(temp.chunking(), [1, 3])
+            self.assertEqual(temp._FillValue, -32767)
+            self.assertAlmostEqual(temp[0, 2], 0.03)
+
+    def test_classic(self):
+        """Compression is ignored for the classic format"""
+        nc = NCstructure.from_CDL(self.cdlfile, data=True)
+        nc.to_file(self.ncfile, format='NETCDF3_CLASSIC',
+                   compression='zlib')
+        with Dataset(self.ncfile) as fid:
+            self.assertEqual(fid.data_model, 'NETCDF3_CLASSIC')
+            self.assertAlmostEqual(fid.variables['temp'][1, 2], 0.06)
+
+    def test_bad_compression(self):
+        nc = NCstructure.from_CDL(self.cdlfile)
+        self.assertRaises(ValueError, nc.to_file, self.ncfile,
+                          compression='lzma')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@
 
 import unittest
 
+import numpy as np
+
 from netcdf_utilities.ncstructure import *
 
 try:
@@ -47,5 +49,36 @@ class TestWriteCDL(unittest.TestCase):
         assert (output.getvalue() == target)
 
 
+class TestVector(unittest.TestCase):
+
+    def test_float(self):
+        value = np.array([1e20, 1.5, -2.0, 100.0, np.nan, -np.inf, 10.05])
+        self.assertEqual(vector2cdl(value),
+                         '1.e+20, 1.5, -2., 100., NaN, -Infinity, 10.05')
+        value = np.array([1.2, 1.3e18, 1.0e21, 0.1], dtype='float32')
+        self.assertEqual(vector2cdl(value), '1.2f, 1.3e+18f, 1.e+21f, 0.1f')
+        self.assertEqual(vector2ncml(np.array([1.0, 2.5])), '1. 2.5')
+
+    def test_integer(self):
+        self.assertEqual(vector2cdl(np.array([3, 11], dtype='int16')),
+                         '3s, 11s')
+        self.assertEqual(vector2cdl(np.array([1, -2], dtype='int8')),
+                         '1b, -2b')
+        self.assertEqual(vector2cdl(np.array([42], dtype='int32')), '42')
+
+
+class TestWriteNcML(unittest.TestCase):
+
+    def test_escape(self):
+        struc0 = NCstructure('a.nc')
+        struc0.createAttribute('title', 'Fish & chips')
+        struc0.createAttribute('version', np.int32(2))
+        text = struc0.to_NcML()
+        self.assertIn('<attribute name="title" value="Fish &amp; chips" />',
+                      text)
+        self.assertIn('<attribute name="version" type="int" value="2" />',
+                      text)
+
+
 if __name__ == '__main__':
     unittest.main()